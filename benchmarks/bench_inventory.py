@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmark: inventory crawler throughput against the local stub server as concurrency goes up
+    Usage: python -m benchmarks.bench_inventory [--users 500] [--latency 0.05]
+"""
+
+import os
+import time
+import argparse
+import tempfile
+
+from benchmarks.stub_server import start_stub_server
+from game_rec.crawler import get_inventory_for_user_async
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Inventory crawler throughput benchmark')
+    args_parser.add_argument('--users', type=int, default=500, help='Number of user ids to crawl')
+    args_parser.add_argument('--latency', type=float, default=0.05, help='Stub server latency per request (sec)')
+    args_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    args = args_parser.parse_args()
+
+    server, base_url = start_stub_server(latency=args.latency)
+    tmp_dir = tempfile.mkdtemp()
+    path_user_id = os.path.join(tmp_dir, 'user_id.txt')
+    with open(path_user_id, 'w') as f:
+        for i in range(args.users):
+            f.write('%s\n' % (76561197960265728 + i))
+
+    config = {'base_url': base_url + '/IPlayerService/GetOwnedGames/v0001/', 'key': 'bench'}
+    print('%12s %10s %12s' % ('concurrency', 'seconds', 'users/sec'))
+    for concurrency in args.concurrency:
+        path_user_inventory = os.path.join(tmp_dir, 'user_inventory_%s.txt' % concurrency)
+        start = time.time()
+        total_count = get_inventory_for_user_async(path_user_id, path_user_inventory, config,
+                                                   concurrency=concurrency)
+        elapsed = time.time() - start
+        print('%12s %10.2f %12.1f' % (concurrency, elapsed, total_count / elapsed))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
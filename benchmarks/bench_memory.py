@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmark: peak RSS of the streaming crawler stages against the number of input lines
+    Each measurement runs in a fresh process, so peaks don't carry over between sizes
+    Usage: python -m benchmarks.bench_memory [--lines 1000 10000 100000]
+"""
+
+import os
+import json
+import time
+import resource
+import argparse
+import tempfile
+import multiprocessing
+
+from benchmarks.stub_server import start_stub_server
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _run_inventory(path_input, base_url):
+    from game_rec.crawler import get_inventory_for_user_async
+    config = {'base_url': base_url + '/IPlayerService/GetOwnedGames/v0001/', 'key': 'bench'}
+    get_inventory_for_user_async(path_input, path_input + '.out', config, concurrency=32)
+    return _peak_rss_mb()
+
+
+def _run_app_list(path_input, base_url):
+    from game_rec.stream import iter_json_object_items
+    with open(path_input, 'r') as f:
+        count = sum(1 for _ in iter_json_object_items(f))
+    return _peak_rss_mb()
+
+
+def _run_parse_app_info(path_input, base_url):
+    from game_rec.stream import iter_json_lines
+    count = sum(1 for _ in iter_json_lines(path_input))
+    return _peak_rss_mb()
+
+
+def _write_fixture(stage, path, lines):
+    with open(path, 'w') as f:
+        if stage == 'inventory':
+            for i in range(lines):
+                f.write('%s\n' % (76561197960265728 + i))
+        elif stage == 'app_list':
+            f.write('{')
+            for i in range(lines):
+                f.write('%s"%s": %s' % (',' if i else '', i, json.dumps({'appid': i, 'name': 'game %s' % i,
+                                                                          'owners': i * 10, 'players_forever': i})))
+            f.write('}')
+        else:
+            for i in range(lines):
+                f.write(json.dumps({str(i): {'success': True, 'data': {'steam_appid': i, 'name': 'game %s' % i,
+                                                                       'about': 'x' * 500}}}) + '\n')
+
+
+STAGES = {'inventory': _run_inventory, 'app_list': _run_app_list, 'app_info_lines': _run_parse_app_info}
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Peak memory of the streaming stages vs input size')
+    args_parser.add_argument('--lines', type=int, nargs='+', default=[1000, 10000, 100000])
+    args_parser.add_argument('--stages', nargs='+', choices=sorted(STAGES), default=sorted(STAGES))
+    args = args_parser.parse_args()
+
+    server, base_url = start_stub_server()
+    tmp_dir = tempfile.mkdtemp()
+    ctx = multiprocessing.get_context('spawn')
+    print('%16s %10s %10s %12s' % ('stage', 'lines', 'seconds', 'peak_rss_mb'))
+    for stage in args.stages:
+        for lines in args.lines:
+            path_input = os.path.join(tmp_dir, '%s_%s.txt' % (stage, lines))
+            _write_fixture(stage, path_input, lines)
+            start = time.time()
+            with ctx.Pool(1) as pool:
+                peak_rss = pool.apply(STAGES[stage], (path_input, base_url))
+            print('%16s %10s %10.2f %12.1f' % (stage, lines, time.time() - start, peak_rss))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
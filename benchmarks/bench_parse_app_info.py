@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmark: columnar parse_app_info against the original row-by-row implementation
+    Usage: python -m benchmarks.bench_parse_app_info [--apps 20000]
+"""
+
+import os
+import re
+import time
+import argparse
+import tempfile
+
+import pandas as pd
+
+from datetime import datetime
+from benchmarks.fixtures import write_app_info
+from game_rec.stream import iter_json_lines
+from game_rec.database import parse_app_info
+
+
+def parse_app_info_legacy(path_app_info, path_steam_app_info):
+    ''' parse_app_info before the columnar rewrite, kept as the baseline: one dict update per field per app,
+        strptime per row and a per-element price map
+    '''
+    dic_steam_app = {'initial_price': {}, 'name': {}, 'score': {}, 'windows': {}, 'mac': {}, 'linux': {},
+                     'type': {}, 'release_date': {}, 'recommendation': {}, 'header_image': {}}
+    current_count = 0
+    # records are decoded one line at a time instead of reading the whole dump
+    for app_json in iter_json_lines(path_app_info):
+        (app_data,) = app_json.values()  # this should match the way dumps app detail
+        if app_data.get(
+                'success') == True:  # if success is False, steam api doesn't have information for the requested app id. We can skip that.
+            app_data = app_data.get('data')
+            steam_id = app_data.get('steam_appid')
+            initial_price = app_data.get('price_overview', {}).get('initial')
+            if app_data.get('is_free') == True:
+                initial_price = 0  # set price to 0 if the game is free
+            app_name = app_data.get('name')
+            critic_score = app_data.get('metacritic', {}).get('score')
+            app_type = app_data.get('type')
+            for (platform, is_supported) in app_data.get('platforms').items():
+                if is_supported == True:
+                    dic_steam_app[platform].update({steam_id: 1})
+            if app_data.get('release_date', {}).get('coming_soon') == False:
+                release_date = app_data.get('release_date', {}).get('date')
+                if not release_date == '':
+                    if re.search(',', release_date) == None:
+                        release_date = datetime.strptime(release_date, '%b %Y')
+                    else:
+                        release_date = datetime.strptime(release_date, '%b %d, %Y')
+
+            recommendation = app_data.get('recommendations', {}).get('total')
+            header_image = app_data.get('header_image')
+            dic_steam_app['initial_price'].update({steam_id: initial_price})
+            dic_steam_app['name'].update({steam_id: app_name})
+            dic_steam_app['score'].update({steam_id: critic_score})
+            dic_steam_app['type'].update({steam_id: app_type})
+            dic_steam_app['release_date'].update({steam_id: release_date})
+            dic_steam_app['recommendation'].update({steam_id: recommendation})
+            dic_steam_app['header_image'].update({steam_id: header_image})
+        current_count += 1
+    df_steam_app = pd.DataFrame(dic_steam_app)
+    df_steam_app.initial_price = df_steam_app.initial_price.map(lambda x: x / 100.0)
+    df_steam_app.index.name = 'steam_appid'
+    df_steam_app['windows'] = df_steam_app.windows.fillna(0)
+    df_steam_app['mac'] = df_steam_app.mac.fillna(0)
+    df_steam_app['linux'] = df_steam_app.linux.fillna(0)
+    df_steam_app = df_steam_app[
+        ['name', 'type', 'initial_price', 'release_date', 'score', 'recommendation', 'windows', 'mac', 'linux',
+         'header_image']]
+    df_steam_app.reset_index(inplace=True)
+    df_steam_app.to_csv(path_steam_app_info, encoding='utf8', index=False)
+    return df_steam_app
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='parse_app_info benchmark')
+    args_parser.add_argument('--apps', type=int, default=20000, help='Number of synthetic app detail lines')
+    args = args_parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    path_app_info = os.path.join(tmp_dir, 'app_info.txt')
+    write_app_info(path_app_info, args.apps)
+
+    print('%12s %10s %12s %10s' % ('version', 'seconds', 'apps/sec', 'rows'))
+    for version, func in [('legacy', parse_app_info_legacy), ('columnar', parse_app_info)]:
+        start = time.time()
+        df_steam_app = func(path_app_info, os.path.join(tmp_dir, 'steam_app_info_%s.csv' % version))
+        elapsed = time.time() - start
+        print('%12s %10.2f %12.1f %10s' % (version, elapsed, args.apps / elapsed, len(df_steam_app)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmark: top-n scoring users/sec against block size, with owned games masked
+    Usage: python -m benchmarks.bench_scoring [--users 200000] [--apps 20000] [--factors 10]
+"""
+
+import time
+import argparse
+
+import numpy as np
+import scipy.sparse
+
+from game_rec.scoring import score_blocks
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Top-n scoring benchmark')
+    args_parser.add_argument('--users', type=int, default=200000)
+    args_parser.add_argument('--apps', type=int, default=20000)
+    args_parser.add_argument('--factors', type=int, default=10)
+    args_parser.add_argument('--owned_per_user', type=int, default=40)
+    args_parser.add_argument('--recommend_num', type=int, default=10)
+    args_parser.add_argument('--block_size', type=int, nargs='+', default=[1, 16, 64, 256, 1024, 4096])
+    args_parser.add_argument('--max_seconds', type=float, default=20.0, help='Stop a block size after this long')
+    args = args_parser.parse_args()
+
+    rnd = np.random.RandomState(0)
+    user_factors = rnd.normal(size=(args.users, args.factors)).astype(np.float32)
+    item_factors = rnd.normal(size=(args.apps, args.factors)).astype(np.float32)
+    rows = np.repeat(np.arange(args.users), args.owned_per_user)
+    cols = rnd.randint(0, args.apps, size=len(rows))
+    owned = scipy.sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                    shape=(args.users, args.apps))
+
+    print('%12s %10s %12s %16s' % ('block_size', 'users', 'seconds', 'users/sec'))
+    for block_size in args.block_size:
+        start = time.time()
+        users = 0
+        for _, top, _ in score_blocks(user_factors, item_factors, args.recommend_num, owned, block_size):
+            users += top.shape[0]
+            if time.time() - start > args.max_seconds:
+                break
+        elapsed = time.time() - start
+        print('%12s %10s %12.2f %16.0f' % (block_size, users, elapsed, users / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmark: parse_app_steamspy pages/sec across tag extraction modes and worker counts
+    Usage: python -m benchmarks.bench_steamspy_parse [--pages 2000] [--workers 1 4]
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+from benchmarks.fixtures import write_app_steamspy
+from game_rec.database import parse_app_steamspy
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='SteamSpy tag extraction benchmark')
+    args_parser.add_argument('--pages', type=int, default=2000, help='Number of synthetic steamSpy pages')
+    args_parser.add_argument('--workers', type=int, nargs='+', default=[1, multiprocessing.cpu_count()])
+    args_parser.add_argument('--modes', nargs='+', default=['soup', 'xpath'])
+    args = args_parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    path_app_steamspy = os.path.join(tmp_dir, 'app_steamspy.txt')
+    write_app_steamspy(path_app_steamspy, args.pages)
+
+    print('%8s %8s %10s %12s %8s' % ('mode', 'workers', 'seconds', 'pages/sec', 'tags'))
+    for mode in args.modes:
+        for workers in args.workers:
+            path_steam_app_tag = os.path.join(tmp_dir, 'steam_app_tag_%s_%s.csv' % (mode, workers))
+            start = time.time()
+            df_app_tag = parse_app_steamspy(path_app_steamspy, path_steam_app_tag, workers=workers, mode=mode)
+            elapsed = time.time() - start
+            print('%8s %8s %10.2f %12.1f %8s' % (mode, workers, elapsed, args.pages / elapsed,
+                                                 df_app_tag.shape[1] - 1))
+
+
+if __name__ == '__main__':
+    main()
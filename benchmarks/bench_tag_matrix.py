@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmark: memory footprint of the app tag table, dense dict-of-dicts DataFrame vs sparse CSR frame
+    Usage: python -m benchmarks.bench_tag_matrix [--apps 50000] [--tags 400] [--tags_per_app 12]
+"""
+
+import time
+import random
+import argparse
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from game_rec.database import app_tag_frame
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='App tag table memory benchmark')
+    args_parser.add_argument('--apps', type=int, default=50000)
+    args_parser.add_argument('--tags', type=int, default=400)
+    args_parser.add_argument('--tags_per_app', type=int, default=12)
+    args = args_parser.parse_args()
+
+    rnd = random.Random(0)
+    lst_tag = ['tag_%03d' % i for i in range(args.tags)]
+    lst_pair = [(app_id, tag) for app_id in range(10, 10 + args.apps)
+                for tag in rnd.sample(range(args.tags), rnd.randint(1, 2 * args.tags_per_app))]
+
+    # before: tag -> {appid: 1}, turned into a dense frame of 1.0 / NaN
+    start = time.time()
+    dic_tag = {}
+    for app_id, tag in lst_pair:
+        dic_tag.setdefault(lst_tag[tag], {})[app_id] = 1
+    df_dense = pd.DataFrame(dic_tag)
+    dense_seconds = time.time() - start
+    dense_mb = df_dense.memory_usage(deep=True).sum() / 1024.0 ** 2
+
+    # after: integer coded (app, tag) pairs in a CSR matrix, wrapped as sparse uint8 columns
+    start = time.time()
+    arr_pair = np.array(lst_pair, dtype=np.int32)
+    tag_matrix = scipy.sparse.csr_matrix((np.ones(len(arr_pair), dtype=np.uint8),
+                                          (arr_pair[:, 0] - 10, arr_pair[:, 1])), shape=(args.apps, args.tags))
+    df_sparse = app_tag_frame(tag_matrix, np.arange(10, 10 + args.apps), lst_tag)
+    sparse_seconds = time.time() - start
+    sparse_mb = df_sparse.memory_usage(deep=True).sum() / 1024.0 ** 2
+    csr_mb = (tag_matrix.data.nbytes + tag_matrix.indices.nbytes + tag_matrix.indptr.nbytes) / 1024.0 ** 2
+
+    print('apps=%s tags=%s nonzero=%s density=%.3f' % (args.apps, args.tags, tag_matrix.nnz,
+                                                       tag_matrix.nnz / float(args.apps * args.tags)))
+    print('%24s %10s %10s' % ('representation', 'MB', 'seconds'))
+    print('%24s %10.1f %10.2f' % ('dense DataFrame', dense_mb, dense_seconds))
+    print('%24s %10.1f %10.2f' % ('sparse DataFrame', sparse_mb, sparse_seconds))
+    print('%24s %10.1f %10s' % ('CSR matrix', csr_mb, '-'))
+
+
+if __name__ == '__main__':
+    main()
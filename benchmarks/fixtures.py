@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Synthetic Steam-like fixtures for the benchmarks
+    Content is generated deterministically from the ids, so runs are comparable
+"""
+
+import json
+import random
+
+# first synthetic steam user id, the 64-bit id of account 0
+FIRST_STEAMID = 76561197960265728
+# app ids start at 10, like the ids of the real store
+FIRST_APP_ID = 10
+
+TAGS = ['Action', 'Adventure', 'Indie', 'RPG', 'Strategy', 'Simulation', 'Casual', 'Free to Play', 'Multiplayer',
+        'Singleplayer', 'Open World', 'Co-op', 'Sci-fi', 'Horror', 'Puzzle', 'Platformer', 'Racing', 'Sports',
+        'Survival', 'Shooter', 'Early Access', 'Sandbox', 'Story Rich', 'Pixel Graphics', 'Turn-Based']
+
+
+def steamids(users):
+    return range(FIRST_STEAMID, FIRST_STEAMID + users)
+
+
+def app_ids(apps):
+    return range(FIRST_APP_ID, FIRST_APP_ID + apps)
+
+
+def write_user_ids(path, users):
+    ''' write a user id list of `users` ids, one per line '''
+    with open(path, 'w') as f:
+        for steamid in steamids(users):
+            f.write('%s\n' % steamid)
+
+
+def fake_inventory(steamid, max_games=50, max_app_id=100000):
+    ''' owned games of one user, about half of them played '''
+    rnd = random.Random(steamid)
+    return [{'appid': rnd.randint(FIRST_APP_ID, max_app_id),
+             'playtime_forever': rnd.choice([0, rnd.randint(1, 20000)])}
+            for _ in range(rnd.randint(0, max_games))]
+
+
+def write_user_inventory(path, users, apps, max_games=50):
+    ''' write a user inventory crawl dump of `users` users owning games among the first `apps` app ids,
+        the same lines get_inventory_for_user writes from the stub server
+    '''
+    max_app_id = FIRST_APP_ID + apps - 1
+    with open(path, 'w') as f:
+        for steamid in steamids(users):
+            f.write(json.dumps({str(steamid): fake_inventory(str(steamid), max_games, max_app_id)}) + '\n')
+
+
+def app_list(apps):
+    ''' the steamspy "request=all" response: per-app owner estimates keyed by app id '''
+    dic_app = {}
+    for app_id in app_ids(apps):
+        rnd = random.Random(app_id)
+        owners = rnd.randint(0, 10 ** 6)
+        dic_app[str(app_id)] = {'appid': app_id, 'name': 'Game %s' % app_id, 'owners': owners,
+                                'players_forever': rnd.randint(0, owners)}
+    return dic_app
+
+
+def write_app_list(path, apps):
+    with open(path, 'w') as f:
+        json.dump(app_list(apps), f)
+
+
+def steamspy_page(app_id, missing_summary=False):
+    ''' html of a steamSpy app page, padded with navigation and scripts like the real thing '''
+    rnd = random.Random(app_id)
+    lst_tag = rnd.sample(TAGS, rnd.randint(1, 15))
+    links = ', '.join('<a href="/tag/%s#">%s</a>' % (tag.replace(' ', '+'), tag) for tag in lst_tag)
+    summary = '' if missing_summary else (
+        '<div class="p-r-30"><h3>Game %s</h3><p><strong>Developer:</strong> <a href="/dev/x">Studio</a><br>'
+        '<strong>Genre:</strong> <a href="/genre/Action">Action</a><br><strong>Tags:</strong> %s<br>'
+        '<strong>Owners:</strong> %s</p></div>' % (app_id, links, rnd.randint(0, 10 ** 6)))
+    nav = ''.join('<li><a href="/nav/%s">Menu item %s</a></li>' % (i, i) for i in range(80))
+    script = '<script>var data = [%s];</script>' % ','.join(str(rnd.random()) for _ in range(300))
+    return ('<html><head><title>Game %s - SteamSpy</title>%s</head><body><ul class="nav">%s</ul>'
+            '<div class="container"><div class="row">%s</div></div></body></html>' % (app_id, script, nav, summary))
+
+
+def write_app_steamspy(path, pages, missing_every=50):
+    ''' write a steamSpy crawl dump of `pages` apps, every `missing_every`-th page lacks the summary div '''
+    with open(path, 'w') as f:
+        for app_id in app_ids(pages):
+            page = steamspy_page(app_id, missing_summary=missing_every and app_id % missing_every == 0)
+            f.write(json.dumps({str(app_id): page}) + '\n')
+
+
+def app_detail(app_id):
+    ''' app details response of the steam store api for one app, as dumped by get_app_details '''
+    rnd = random.Random(app_id)
+    if rnd.random() < 0.05:
+        return {str(app_id): {'success': False}}
+    is_free = rnd.random() < 0.15
+    coming_soon = rnd.random() < 0.05
+    month = rnd.choice(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])
+    date = rnd.choice(['%s %s, %s' % (month, rnd.randint(1, 28), rnd.randint(2000, 2016)),
+                       '%s %s' % (month, rnd.randint(2000, 2016)), ''])
+    data = {'type': rnd.choice(['game', 'game', 'game', 'dlc', 'demo']),
+            'name': 'Game %s' % app_id,
+            'steam_appid': app_id,
+            'is_free': is_free,
+            'detailed_description': 'Lorem ipsum ' * rnd.randint(10, 200),
+            'header_image': 'http://cdn.akamai.steamstatic.com/steam/apps/%s/header.jpg' % app_id,
+            'platforms': {'windows': True, 'mac': rnd.random() < 0.3, 'linux': rnd.random() < 0.2},
+            'release_date': {'coming_soon': coming_soon, 'date': date}}
+    if not is_free:
+        data['price_overview'] = {'currency': 'USD', 'initial': rnd.choice([499, 999, 1499, 1999, 5999]),
+                                  'final': 999, 'discount_percent': 0}
+    if rnd.random() < 0.3:
+        data['metacritic'] = {'score': rnd.randint(40, 98), 'url': 'http://www.metacritic.com/game/pc/x'}
+    if rnd.random() < 0.7:
+        data['recommendations'] = {'total': rnd.randint(0, 100000)}
+    return {str(app_id): {'success': True, 'data': data}}
+
+
+def write_app_info(path, apps):
+    ''' write an app details crawl dump of `apps` apps '''
+    with open(path, 'w') as f:
+        for app_id in app_ids(apps):
+            f.write(json.dumps(app_detail(app_id)) + '\n')
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Local stub of the Steam web api, the steam store api and steamspy, so the crawlers can be exercised
+    and timed offline
+    Responses are generated deterministically from the requested ids, with the fixtures' generators
+    Routes: /IPlayerService/GetOwnedGames/v0001/?steamid=, /api.php?request=all, /api/appdetails?appids=,
+    /app/<app_id>
+    Written by Faye Yan, 2016
+"""
+
+import json
+import time
+import socket
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    raise ImportError('the stub server requires python 3')
+
+from benchmarks.fixtures import FIRST_APP_ID, fake_inventory, app_list, app_detail, steamspy_page
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # headers and body go out in separate writes, so don't let Nagle hold the body back
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, obj, status=200):
+        self._send(json.dumps(obj).encode('utf-8'), 'application/json', status)
+
+    def _app_id(self, value):
+        ''' :return: the requested app id if it is one of the stub's apps, else None '''
+        try:
+            app_id = int(value)
+        except ValueError:
+            return None
+        return app_id if FIRST_APP_ID <= app_id < FIRST_APP_ID + self.server.apps else None
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.startswith('/IPlayerService/GetOwnedGames'):
+            steamid = query.get('steamid', [''])[0]
+            lst_game = fake_inventory(steamid, max_app_id=FIRST_APP_ID + self.server.apps - 1)
+            self._send_json({'response': {'game_count': len(lst_game), 'games': lst_game}})
+        elif url.path == '/api.php' and query.get('request') == ['all']:
+            self._send(self.server.app_list_body(), 'application/json')
+        elif url.path == '/api/appdetails':
+            value = query.get('appids', [''])[0]
+            app_id = self._app_id(value)
+            # the store answers unknown ids with success false, not with an error status
+            self._send_json(app_detail(app_id) if app_id is not None else {value: {'success': False}})
+        elif url.path.startswith('/app/'):
+            app_id = self._app_id(url.path.rstrip('/').rsplit('/', 1)[1])
+            if app_id is None:
+                self._send_json({'error': 'not found'}, status=404)
+            else:
+                page = steamspy_page(app_id, missing_summary=app_id % 50 == 0)
+                self._send(page.encode('utf-8'), 'text/html; charset=utf-8')
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, apps=1000):
+        ThreadingHTTPServer.__init__(self, address, StubHandler)
+        self.latency = latency
+        self.apps = apps
+        self._app_list = None
+        self._lock = threading.Lock()
+
+    def app_list_body(self):
+        # built once, the app list of a large stub is several MB
+        with self._lock:
+            if self._app_list is None:
+                self._app_list = json.dumps(app_list(self.apps)).encode('utf-8')
+            return self._app_list
+
+
+def stub_config(base_url):
+    ''' crawler config entries pointing every endpoint at the stub server '''
+    return {'base_url': base_url + '/IPlayerService/GetOwnedGames/v0001/',
+            'key': 'bench',
+            'steamspy_url': base_url + '/api.php?request=all',
+            'steampower_url': base_url + '/api/appdetails?appids=[app_id]',
+            'steamspy_app': base_url + '/app/[app_id]'}
+
+
+def start_stub_server(latency=0.0, port=0, apps=1000):
+    ''' start the stub server in a background thread
+        :param latency: seconds to sleep before each response, to mimic a remote host
+        :param port: port to bind, 0 picks a free one
+        :param apps: number of apps in the app list; inventories only own these apps
+        :return: (server, base url)
+    '''
+    server = StubServer(('127.0.0.1', port), latency, apps)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%s' % server.server_address[1]
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Benchmark suite: the engine's steps timed end to end on synthetic fixtures, at fixed scales
+    Fixtures are generated once per scale into the fixture folder and reused, their content only depends
+    on the scale. The crawl steps run against the local stub server. Every run appends one JSON line per
+    step to the results file, tagged with the git commit, and --compare lines up two commits.
+    Usage: python -m benchmarks.suite [--scale 1k 100k 1m] [--steps parse_app_info merge_dfs ...]
+           python -m benchmarks.suite --compare [--base <commit>] [--head <commit>]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import yaml
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from benchmarks import fixtures
+from benchmarks.stub_server import start_stub_server, stub_config
+from game_rec.metrics import rss_bytes
+from game_rec.crawler import get_inventory_for_user, get_inventory_for_user_async, crawl_apps_streaming
+from game_rec.database import parse_app_info, parse_app_steamspy, merge_dfs
+from game_rec.als_local import recommend_local
+
+# scale name -> number of users; the number of apps grows with it up to MAX_APPS, about the size of the store
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+MAX_APPS = 30000
+
+STEPS = ('inventory', 'inventory_async', 'app_crawl', 'parse_app_info', 'parse_app_steamspy', 'merge_dfs',
+         'recommend')
+
+PATH_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+
+
+def parse_scale(scale):
+    ''' :param scale: a name of SCALES, or a number of users with an optional k/m suffix, e.g. 250k
+        :return: (users, apps)
+    '''
+    match = re.match(r'^(\d+)([km]?)$', scale.lower())
+    if not match:
+        raise argparse.ArgumentTypeError('Invalid scale %s, expected e.g. 1k, 100k or 1m' % scale)
+    users = SCALES.get(scale.lower()) or int(match.group(1)) * {'': 1, 'k': 1000, 'm': 1000000}[match.group(2)]
+    return users, min(users, MAX_APPS)
+
+
+def git_commit():
+    ''' :return: (short hash of HEAD, True if tracked files have uncommitted changes) '''
+    path_repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=path_repo,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+        # the results file itself changes with every run
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no', '--', '.',
+                                          ':(exclude)benchmarks/results.jsonl'], cwd=path_repo,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, bool(status)
+
+
+def make_fixtures(fixture_dir, scale, users, apps):
+    ''' generate the fixtures of a scale, unless a previous run already did
+        :return: dict of fixture name -> path
+    '''
+    path_dir = os.path.join(fixture_dir, scale)
+    dic_path = {'user_id': os.path.join(path_dir, 'user_id.txt'),
+                'user_inventory': os.path.join(path_dir, 'user_inventory.txt'),
+                'app_info': os.path.join(path_dir, 'app_info.txt'),
+                'app_steamspy': os.path.join(path_dir, 'app_steamspy.txt')}
+    path_done = os.path.join(path_dir, 'done')
+    if os.path.isfile(path_done):
+        return dic_path
+    if not os.path.isdir(path_dir):
+        os.makedirs(path_dir)
+    start = time.time()
+    print('Generating %s fixtures: %s users, %s apps...' % (scale, users, apps))
+    fixtures.write_user_ids(dic_path['user_id'], users)
+    fixtures.write_user_inventory(dic_path['user_inventory'], users, apps)
+    fixtures.write_app_info(dic_path['app_info'], apps)
+    fixtures.write_app_steamspy(dic_path['app_steamspy'], apps)
+    # written last, a fixture folder without it was interrupted and is generated again
+    with open(path_done, 'w') as f:
+        f.write('%s %s\n' % (users, apps))
+    print('  ...done in %.1fs' % (time.time() - start))
+    return dic_path
+
+
+def step_inventory(ctx):
+    return get_inventory_for_user(ctx['user_id'], ctx['path']('user_inventory.txt'), ctx['crawler'])
+
+
+def step_inventory_async(ctx):
+    return get_inventory_for_user_async(ctx['user_id'], ctx['path']('user_inventory_async.txt'), ctx['crawler'])
+
+
+def step_app_crawl(ctx):
+    lst_app_id = crawl_apps_streaming(ctx['path']('app_user.txt'), ctx['path']('app_info.txt'),
+                                      ctx['path']('app_steamspy.txt'), ctx['crawler'])
+    # two requests per app
+    return 2 * len(lst_app_id)
+
+
+def step_parse_app_info(ctx):
+    return len(parse_app_info(ctx['app_info'], ctx['path']('steam_app_info.parquet')))
+
+
+def step_parse_app_steamspy(ctx):
+    config = ctx['config_dict']['database']
+    return len(parse_app_steamspy(ctx['app_steamspy'], ctx['path']('steam_app_tag.parquet'),
+                                  workers=config.get('parse_workers', 1), mode=config.get('tag_parser', 'soup')))
+
+
+def step_merge_dfs(ctx):
+    return len(merge_dfs(ctx['path']('steam_app_tag.parquet'), ctx['path']('steam_app_info.parquet'),
+                         ctx['path']('master_app_info.parquet')))
+
+
+def step_recommend(ctx):
+    config = dict(ctx['config_dict']['recommendation'], model_dir=None)
+    return recommend_local(ctx['user_inventory'], ctx['path']('recommendation'), config)
+
+
+STEP_FUNCS = {'inventory': step_inventory, 'inventory_async': step_inventory_async, 'app_crawl': step_app_crawl,
+              'parse_app_info': step_parse_app_info, 'parse_app_steamspy': step_parse_app_steamspy,
+              'merge_dfs': step_merge_dfs, 'recommend': step_recommend}
+
+# steps whose outputs a step reads; they are run untimed first when they were not selected
+STEP_REQUIRES = {'merge_dfs': ('parse_app_info', 'parse_app_steamspy')}
+
+# what each step counts: its items per second are the step's throughput
+STEP_ITEMS = {'inventory': 'users', 'inventory_async': 'users', 'app_crawl': 'requests', 'parse_app_info': 'apps',
+              'parse_app_steamspy': 'apps', 'merge_dfs': 'apps', 'recommend': 'users'}
+
+
+def run_scale(scale, lst_step, config_dict, fixture_dir, latency=0.0):
+    ''' time the steps at one scale
+        :return: list of result dicts, one per step
+    '''
+    users, apps = parse_scale(scale)
+    ctx = make_fixtures(fixture_dir, scale, users, apps)
+    out_dir = tempfile.mkdtemp(prefix='bench_%s_' % scale)
+    server, base_url = start_stub_server(latency=latency, apps=apps)
+    config_crawler = dict(config_dict['crawler'], **stub_config(base_url))
+    # the stub has no quota, and cached responses would time the cache instead of the crawl
+    config_crawler.update(rate_limit={}, cache=None)
+    ctx.update(config_dict=config_dict, crawler=config_crawler, path=lambda name: os.path.join(out_dir, name))
+    lst_result = []
+    set_done = set()
+    try:
+        for step in lst_step:
+            for required in STEP_REQUIRES.get(step, ()):
+                if required not in set_done:
+                    STEP_FUNCS[required](ctx)
+                    set_done.add(required)
+            rss_start = rss_bytes()
+            start = time.time()
+            try:
+                items = STEP_FUNCS[step](ctx)
+            except ImportError as e:
+                # e.g. aiohttp for the asyncio crawler
+                print('%6s %20s skipped: %s' % (scale, step, e))
+                continue
+            seconds = time.time() - start
+            set_done.add(step)
+            dic_result = {'scale': scale, 'users': users, 'apps': apps, 'step': step, 'items': items,
+                          'unit': STEP_ITEMS[step], 'seconds': round(seconds, 3),
+                          'items_per_sec': round(items / seconds, 1) if seconds else None,
+                          'rss_delta_mb': round((rss_bytes() - rss_start) / 1024.0 ** 2, 1)}
+            print('%6s %20s %10s %10.2f %12s %12s' % (scale, step, items, seconds, dic_result['items_per_sec'],
+                                                      dic_result['rss_delta_mb']))
+            lst_result.append(dic_result)
+    finally:
+        server.shutdown()
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return lst_result
+
+
+def read_results(path_results):
+    if not os.path.isfile(path_results):
+        return []
+    with open(path_results) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(path_results, base=None, head=None, threshold=0.1):
+    ''' print the seconds of every scale and step at two commits
+        :param base: commit to compare against, defaults to the last one recorded before head
+        :param head: commit to compare, defaults to the last one recorded
+        :param threshold: relative slowdown reported as a regression
+        :return: number of regressions
+    '''
+    lst_result = read_results(path_results)
+    lst_commit = []
+    for dic_result in lst_result:
+        if dic_result['commit'] in lst_commit:
+            lst_commit.remove(dic_result['commit'])
+        lst_commit.append(dic_result['commit'])
+    if not lst_commit:
+        print('No results in %s' % path_results)
+        return 0
+    head = head or lst_commit[-1]
+    if base is None:
+        lst_before = [commit for commit in lst_commit if commit != head]
+        if not lst_before:
+            print('Only %s has results, nothing to compare' % head)
+            return 0
+        base = lst_before[-1]
+
+    def latest(commit):
+        # the last run of a commit wins, e.g. a rerun after a noisy one
+        return dict(((i['scale'], i['step']), i) for i in lst_result if i['commit'] == commit)
+    dic_base, dic_head = latest(base), latest(head)
+    regressions = 0
+    print('%6s %20s %12s %12s %9s' % ('scale', 'step', base, head, 'change'))
+    for key in sorted(set(dic_base) & set(dic_head), key=lambda x: (parse_scale(x[0])[0], STEPS.index(x[1]))):
+        base_seconds, head_seconds = dic_base[key]['seconds'], dic_head[key]['seconds']
+        change = (head_seconds - base_seconds) / base_seconds if base_seconds else 0.0
+        regression = change > threshold
+        regressions += regression
+        print('%6s %20s %12.2f %12.2f %+8.1f%%%s' % (key[0], key[1], base_seconds, head_seconds, 100 * change,
+                                                    '  REGRESSION' if regression else ''))
+    return regressions
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description='Benchmark suite of the engine steps on synthetic fixtures')
+    args_parser.add_argument('--scale', nargs='+', default=['1k'], help='Scales to run: 1k, 100k, 1m or e.g. 250k')
+    args_parser.add_argument('--steps', nargs='+', choices=STEPS, default=list(STEPS))
+    args_parser.add_argument('--config', '-c', help='Path to config file', default='conf/config.yml')
+    args_parser.add_argument('--fixture_dir', help='Folder of the generated fixtures, reused between runs',
+                             default=os.path.join(tempfile.gettempdir(), 'game_rec_bench'))
+    args_parser.add_argument('--latency', type=float, default=0.0, help='Stub server latency per request (sec)')
+    args_parser.add_argument('--results', help='Results file, one JSON line per step and run', default=PATH_RESULTS)
+    args_parser.add_argument('--compare', action='store_true', help='Compare recorded results instead of running')
+    args_parser.add_argument('--base', help='Commit to compare against, defaults to the previous one recorded')
+    args_parser.add_argument('--head', help='Commit to compare, defaults to the last one recorded')
+    args_parser.add_argument('--threshold', type=float, default=0.1, help='Slowdown reported as a regression')
+    args = args_parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.results, args.base, args.head, args.threshold) else 0)
+
+    for scale in args.scale:
+        parse_scale(scale)
+    config_dict = yaml.safe_load(open(args.config))
+    commit, dirty = git_commit()
+    dic_run = {'commit': commit, 'dirty': dirty, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'host': socket.gethostname(), 'python': platform.python_version(), 'cpus': os.cpu_count()}
+    print('%6s %20s %10s %10s %12s %12s' % ('scale', 'step', 'items', 'seconds', 'items/sec', 'rss_delta_mb'))
+    for scale in args.scale:
+        lst_result = run_scale(scale, args.steps, config_dict, args.fixture_dir, args.latency)
+        # appended per scale, so the results of a long 1m run are kept even if a later scale fails
+        with open(args.results, 'a') as f:
+            for dic_result in lst_result:
+                f.write(json.dumps(dict(dic_run, **dic_result), sort_keys=True) + '\n')
+    print('Results of %s%s appended to %s' % (commit, ' (uncommitted changes)' if dirty else '', args.results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Single-node recommendation engine, an alternative to the Spark backend
+    Implicit-feedback ALS on a scipy.sparse user x app playtime matrix, solved with vectorized NumPy
+    over blocks of users on a thread pool
+    Input: user game inventory list
+    Output: top n recommended games per user in JSON format, laid out like the Spark output
+    The trained factors are saved to the model store; --fold_in scores new users against the latest
+    saved model without retraining
+    Written by Faye Yan, 2016
+"""
+
+import os
+import sys
+import json
+import yaml
+import logging
+import argparse
+import numpy as np
+import scipy.sparse
+
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from game_rec.stream import iter_json_lines
+from game_rec.interactions import transform_playtime, load_interactions, read_interactions_meta
+from game_rec.scoring import score_blocks
+from game_rec.model_store import save_model, load_model
+
+
+def proc_args():
+    args_parser = argparse.ArgumentParser(description="Output game recommendations in JSON format, without Spark")
+    args_parser.add_argument('input_file', help='Path to the user_inventory file')
+    args_parser.add_argument('--config', '-c', help='Path to config file', default='conf/config.yml')
+    args_parser.add_argument('--output_path', '-o', help='Path to output file folder', default='.')
+    args_parser.add_argument('--interactions', help='Path to the interaction dataset of the input file')
+    args_parser.add_argument('--fold_in', action='store_true',
+                             help='Score the input users against the latest saved model instead of retraining')
+
+    args,_ = args_parser.parse_known_args()
+    return args
+
+
+def load_playtime_matrix(path_user_inventory):
+    ''' build the user x app playtime matrix from the crawler output
+        only games with playtime count, like create_tuple in the Spark backend; users without any are left
+        out, so they are neither trained, saved with the model nor scored
+        :return: (csr matrix of playtime minutes, list of steam user ids per row, array of app ids per column)
+    '''
+    lst_user_id = []
+    arr_row = []
+    arr_app = []
+    arr_playtime = []
+    for user_inventory in iter_json_lines(path_user_inventory):
+        (user_id, lst_inventory), = user_inventory.items()
+        lst_played = [i for i in lst_inventory or [] if (i.get('playtime_forever') or 0) > 0]
+        if not lst_played:
+            continue
+        row = len(lst_user_id)
+        lst_user_id.append(user_id)
+        for i in lst_played:
+            arr_row.append(row)
+            arr_app.append(i.get('appid'))
+            arr_playtime.append(i.get('playtime_forever'))
+    arr_app_id, arr_col = np.unique(np.asarray(arr_app, dtype=np.int64), return_inverse=True)
+    matrix = scipy.sparse.csr_matrix((np.asarray(arr_playtime, dtype=np.float32),
+                                      (np.asarray(arr_row, dtype=np.int32), arr_col.astype(np.int32))),
+                                     shape=(len(lst_user_id), len(arr_app_id)))
+    matrix.sum_duplicates()
+    return matrix, lst_user_id, arr_app_id
+
+
+def _row_blocks(indptr, nnz_per_block):
+    ''' split rows into blocks of roughly nnz_per_block stored entries '''
+    lst_block = []
+    start = 0
+    n_rows = len(indptr) - 1
+    while start < n_rows:
+        end = int(np.searchsorted(indptr, indptr[start] + nnz_per_block, side='right')) - 1
+        end = min(max(end, start + 1), n_rows)
+        lst_block.append((start, end))
+        start = end
+    return lst_block
+
+
+def _row_sums(fixed, indices, arr_row, n_rows, gram_weight, rhs_weight, chunk):
+    ''' per-row sums of gram_weight * f f' and rhs_weight * f over the stored entries of a block of rows
+        the entries are taken chunk at a time, so the per-entry outer products never exceed chunk x k x k,
+        however many entries a single row has (e.g. the owners of a very popular app)
+        :param arr_row: row of each entry within the block, ascending
+        :return: (n_rows x k x k, n_rows x k)
+    '''
+    k = fixed.shape[1]
+    arr_gram = np.zeros((n_rows, k, k))
+    arr_rhs = np.zeros((n_rows, k))
+    for lo in range(0, len(arr_row), chunk):
+        hi = min(lo + chunk, len(arr_row))
+        factors = fixed[indices[lo:hi]]
+        rows = arr_row[lo:hi]
+        # first entry of each row in the chunk; a row cut by the chunk boundary is summed in two parts
+        offsets = np.flatnonzero(np.concatenate([[True], rows[1:] != rows[:-1]]))
+        outer = (factors * gram_weight[lo:hi, None])[:, :, None] * factors[:, None, :]
+        arr_gram[rows[offsets]] += np.add.reduceat(outer, offsets, axis=0)
+        arr_rhs[rows[offsets]] += np.add.reduceat(factors * rhs_weight[lo:hi, None], offsets, axis=0)
+    return arr_gram, arr_rhs
+
+
+def _solve_block(confidence, fixed, gram, regularization, start, end, out, chunk=50000, scale_regularization=False):
+    ''' least squares for rows start:end of one side, against the fixed factors of the other side
+        for row u: (F'F + F'(Cu - I)F + reg * I) x_u = F' Cu p_u, with p_u = 1 on the observed entries
+        :param scale_regularization: use reg * n_u, the number of entries of row u, as Spark's trainImplicit does
+    '''
+    indptr = confidence.indptr[start:end + 1]
+    arr_nnz = np.diff(indptr)
+    arr_nonempty = np.flatnonzero(arr_nnz)
+    out[start:end] = 0
+    if not len(arr_nonempty):
+        return
+    lo, hi = indptr[0], indptr[-1]
+    weight = confidence.data[lo:hi]
+    # sum over each row's entries of (c - 1) * f f' and c * f
+    arr_gram, arr_rhs = _row_sums(fixed, confidence.indices[lo:hi], np.repeat(np.arange(end - start), arr_nnz),
+                                  end - start, weight, 1.0 + weight, chunk)
+    arr_regularization = regularization * (arr_nnz[arr_nonempty] if scale_regularization else
+                                           np.ones(len(arr_nonempty)))
+    lhs = arr_gram[arr_nonempty] + gram + arr_regularization[:, None, None] * np.eye(gram.shape[0])
+    out[start + arr_nonempty] = np.linalg.solve(lhs, arr_rhs[arr_nonempty][:, :, None])[:, :, 0]
+
+
+def _solve_side(confidence, fixed, regularization, out, executor, nnz_per_block, scale_regularization=False):
+    gram = fixed.T.dot(fixed)
+    lst_future = [executor.submit(_solve_block, confidence, fixed, gram, regularization, start, end, out,
+                                  nnz_per_block, scale_regularization)
+                  for start, end in _row_blocks(confidence.indptr, nnz_per_block)]
+    for future in lst_future:
+        future.result()
+
+
+def confidence_matrix(playtime, alpha, transform='log', lst_bucket=None):
+    ''' extra confidence (c - 1) of every observed entry, alpha * transformed playtime minutes
+        :param transform: playtime transform, see interactions.transform_playtime
+    '''
+    confidence = playtime.tocsr().astype(np.float64)
+    confidence.data = alpha * transform_playtime(confidence.data, transform, lst_bucket).astype(np.float64)
+    return confidence
+
+
+def train_als(playtime, factors=10, regularization=0.1, iterations=10, alpha=40.0, threads=4,
+              nnz_per_block=50000, seed=0, transform='log', lst_bucket=None):
+    ''' implicit-feedback ALS (Hu, Koren & Volinsky 2008)
+        confidence is 1 + alpha * transformed playtime, by default log(1 + minutes) so a few very long
+        sessions don't dominate
+        :param playtime: csr matrix of users x apps
+        :param factors: rank of the factorization
+        :param threads: blocks of users (or apps) solved in parallel; NumPy releases the GIL in the heavy parts
+        :param nnz_per_block: matrix entries per block, and per chunk of the per-entry outer products,
+            which bounds their memory even for a row with more entries
+        :param transform: playtime transform, 'raw' for matrices that already hold transformed values
+        :return: (user factors, app factors) as float32 arrays
+    '''
+    confidence = confidence_matrix(playtime, alpha, transform, lst_bucket)
+    confidence_t = confidence.T.tocsr()
+    rnd = np.random.RandomState(seed)
+    user_factors = np.zeros((confidence.shape[0], factors))
+    item_factors = rnd.normal(scale=0.01, size=(confidence.shape[1], factors))
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for iteration in range(iterations):
+            _solve_side(confidence, item_factors, regularization, user_factors, executor, nnz_per_block)
+            _solve_side(confidence_t, user_factors, regularization, item_factors, executor, nnz_per_block)
+            logging.debug('ALS iteration %s/%s done' % (iteration + 1, iterations))
+    return user_factors.astype(np.float32), item_factors.astype(np.float32)
+
+
+def _solve_block_explicit(ratings, fixed, regularization, start, end, out, chunk=50000):
+    ''' explicit ALS as trained by Spark's ALS.train, with the regularization scaled by each row's entries
+        for row u: (F_u'F_u + reg * n_u * I) x_u = F_u' r_u, over the observed entries only
+    '''
+    indptr = ratings.indptr[start:end + 1]
+    arr_nnz = np.diff(indptr)
+    arr_nonempty = np.flatnonzero(arr_nnz)
+    out[start:end] = 0
+    if not len(arr_nonempty):
+        return
+    lo, hi = indptr[0], indptr[-1]
+    arr_gram, arr_rhs = _row_sums(fixed, ratings.indices[lo:hi], np.repeat(np.arange(end - start), arr_nnz),
+                                  end - start, np.ones(hi - lo), ratings.data[lo:hi], chunk)
+    lhs = arr_gram[arr_nonempty] + \
+          (regularization * arr_nnz[arr_nonempty])[:, None, None] * np.eye(fixed.shape[1])
+    out[start + arr_nonempty] = np.linalg.solve(lhs, arr_rhs[arr_nonempty][:, :, None])[:, :, 0]
+
+
+def fold_in(playtime, model, threads=4, nnz_per_block=50000):
+    ''' factors for users outside the training data, solved against the model's fixed app factors
+        this is the user half of one ALS iteration, so it takes a fraction of a second per thousand users
+        :param playtime: csr matrix of users x apps, columns in the order of model.app_ids
+        :param model: model_store.ALSModel, its meta says how it was trained
+        :return: users x rank float32 array, zero rows for users without playtime on known apps
+    '''
+    dic_meta = model.meta
+    item_factors = np.asarray(model.item_factors, dtype=np.float64)
+    user_factors = np.zeros((playtime.shape[0], item_factors.shape[1]))
+    regularization = dic_meta.get('regularization', 0.1)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        if dic_meta.get('implicit', True):
+            # Spark's trainImplicit scales the regularization by each user's entries, the local trainer does not
+            _solve_side(confidence_matrix(playtime, dic_meta.get('alpha', 40.0), dic_meta.get('transform', 'log'),
+                                          dic_meta.get('buckets')), item_factors,
+                        regularization, user_factors, executor, nnz_per_block,
+                        scale_regularization=dic_meta.get('backend') == 'spark')
+        else:
+            ratings = playtime.tocsr().astype(np.float64)
+            lst_future = [executor.submit(_solve_block_explicit, ratings, item_factors, regularization,
+                                          start, end, user_factors, nnz_per_block)
+                          for start, end in _row_blocks(ratings.indptr, nnz_per_block)]
+            for future in lst_future:
+                future.result()
+    return user_factors.astype(np.float32)
+
+
+def align_columns(playtime, arr_app_id, model):
+    ''' re-index the columns of a playtime matrix onto the model's apps, dropping apps it has not seen
+        :param arr_app_id: app id of each column of playtime
+        :return: csr matrix of users x model apps
+    '''
+    playtime = playtime.tocoo()
+    arr_col = model.app_columns(arr_app_id)[playtime.col]
+    arr_known = arr_col >= 0
+    matrix = scipy.sparse.csr_matrix((playtime.data[arr_known], (playtime.row[arr_known], arr_col[arr_known])),
+                                     shape=(playtime.shape[0], len(model.app_ids)))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def _write_recommendations(path_recommend_games, user_factors, item_factors, playtime, lst_user_id, arr_app_id,
+                           config):
+    ''' top-n of every user with playtime, as {user_id: [app ids]} JSON lines in path_recommend_games/part-00000
+        :return: number of users written
+    '''
+    # users without any playtime (e.g. folded-in users playing only apps the model has not seen) are not
+    # in the model, as with Spark, and are not scored
+    arr_active = np.flatnonzero(np.diff(playtime.indptr) > 0)
+    if not os.path.isdir(path_recommend_games):
+        os.makedirs(path_recommend_games)
+    # games the user has played are not recommended back
+    owned = playtime[arr_active] if config.get('exclude_owned', True) else None
+    current_count = 0
+    with open(os.path.join(path_recommend_games, 'part-00000'), 'w') as f:
+        for start, top, _ in score_blocks(user_factors[arr_active], item_factors, config['recommend_num'], owned,
+                                          config.get('score_block_size')):
+            for i in range(top.shape[0]):
+                arr_col = top[i][top[i] >= 0]
+                f.write(json.dumps({lst_user_id[arr_active[start + i]]: arr_app_id[arr_col].tolist()}) + '\n')
+                current_count += 1
+    return current_count
+
+
+def recommend_local(path_user_inventory, path_recommend_games, config, path_interactions=None):
+    ''' train ALS on one node and write the top-n games of every user
+        the output is a directory holding a part file with one {user_id: [app ids]} JSON line per user,
+        the same layout the Spark backend writes
+        :param config: recommendation section of the config
+        :param path_interactions: optional interaction dataset of the inventory, read instead of the JSON
+        :return: number of users with recommendations
+    '''
+    if path_interactions:
+        # the dataset already holds transformed playtime, the model remembers the transform for fold-in
+        playtime, lst_user_id, arr_app_id = load_interactions(path_interactions, config['dict_dir'])
+        dic_meta = read_interactions_meta(path_interactions)
+        transform, lst_bucket = dic_meta.get('transform', 'log'), dic_meta.get('buckets')
+        train_transform = 'raw'
+    else:
+        playtime, lst_user_id, arr_app_id = load_playtime_matrix(path_user_inventory)
+        transform, lst_bucket = config.get('playtime_transform', 'log'), config.get('playtime_buckets')
+        train_transform = transform
+    logging.info('Training local ALS on %s users x %s apps (%s entries)...' %
+                 (playtime.shape[0], playtime.shape[1], playtime.nnz))
+    user_factors, item_factors = train_als(playtime, factors=config['model_feature_num'],
+                                           regularization=config.get('regularization', 0.1),
+                                           iterations=config.get('iterations', 10),
+                                           alpha=config.get('alpha', 40.0),
+                                           threads=config.get('threads', 4),
+                                           transform=train_transform, lst_bucket=lst_bucket)
+    if config.get('model_dir'):
+        save_model(config['model_dir'], user_factors, item_factors, lst_user_id, arr_app_id,
+                   {'backend': 'local', 'implicit': True, 'alpha': config.get('alpha', 40.0),
+                    'regularization': config.get('regularization', 0.1),
+                    'iterations': config.get('iterations', 10), 'transform': transform, 'buckets': lst_bucket,
+                    'input': path_interactions or path_user_inventory},
+                   keep=config.get('model_keep'), owned=playtime)
+    return _write_recommendations(path_recommend_games, user_factors, item_factors, playtime, lst_user_id,
+                                  arr_app_id, config)
+
+
+def recommend_fold_in(path_user_inventory, path_recommend_games, config):
+    ''' recommendations for new or changed users from the latest saved model, without retraining
+        the users' factors are folded in against the model's app factors, so the input can be the
+        inventory of a handful of freshly crawled users
+        :param config: recommendation section of the config, model_dir locates the model
+        :return: number of users with recommendations
+    '''
+    model = load_model(config['model_dir'])
+    if model is None:
+        raise ValueError('No saved model in %s, run a full training first' % config['model_dir'])
+    playtime, lst_user_id, arr_app_id = load_playtime_matrix(path_user_inventory)
+    playtime = align_columns(playtime, arr_app_id, model)
+    logging.info('Folding %s users into model version %s...' % (playtime.shape[0], model.version))
+    user_factors = fold_in(playtime, model, threads=config.get('threads', 4))
+    return _write_recommendations(path_recommend_games, user_factors, model.item_factors, playtime, lst_user_id,
+                                  model.app_ids, config)
+
+
+def main():
+
+    now = datetime.now().strftime('%Y%m%d-%H%M%S')
+    # parse commandline parameters
+    args = proc_args()
+    path_user_inventory = args.input_file
+    if not os.path.isfile(path_user_inventory):
+        logging.exception('Exit. Invalid input file: %s' % path_user_inventory)
+        sys.exit(-1)
+
+    # parse config
+    logging.info('Parsing config file...')
+    config_dict = yaml.safe_load(open(args.config))
+    config = config_dict['recommendation']
+
+    path_recommend_games = os.path.join(args.output_path, config['path_recommend_games'].replace('[timestamp]', now)
+                                                                                        .replace('[format]', 'json'))
+    if args.fold_in:
+        total_ct = recommend_fold_in(path_user_inventory, path_recommend_games, config)
+    else:
+        total_ct = recommend_local(path_user_inventory, path_recommend_games, config, args.interactions)
+    logging.info('Recommendation Done for %s users: %s' % (total_ct, path_recommend_games))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Read access to the app metadata saved by database.py
+    Enriches recommended app ids with name, price and header image, using batched lookups
+    behind an in-process LRU cache
+    Written by Faye Yan, 2016
+"""
+
+import logging
+import threading
+import collections
+import sqlalchemy
+
+from game_rec.database import tbl_steam_app, create_db_engine
+
+# secondary indexes of tbl_steam_app; steam_appid is the primary key. Platforms are filtered on one at a
+# time (e.g. mac = 1), which a composite (windows, mac, linux) index can only serve for windows
+lst_index = [sqlalchemy.Index('idx_steam_app_type', tbl_steam_app.c.type),
+             sqlalchemy.Index('idx_steam_app_release_date', tbl_steam_app.c.release_date),
+             sqlalchemy.Index('idx_steam_app_windows', tbl_steam_app.c.windows),
+             sqlalchemy.Index('idx_steam_app_mac', tbl_steam_app.c.mac),
+             sqlalchemy.Index('idx_steam_app_linux', tbl_steam_app.c.linux)]
+
+# fields added to each recommended app
+APP_FIELDS = ('name', 'initial_price', 'header_image')
+
+
+def create_indexes(engine):
+    ''' create tbl_steam_app and its indexes if they don't exist yet '''
+    tbl_steam_app.create(engine, checkfirst=True)
+    for index in lst_index:
+        index.create(engine, checkfirst=True)
+
+
+class AppStore(object):
+    ''' batched, cached lookups of app metadata by steam_appid
+        :param engine: SQLAlchemy engine of the app database
+        :param cache_size: number of apps kept in the LRU cache; unknown app ids are cached too
+        :param batch_size: app ids per IN (...) query
+    '''
+    def __init__(self, engine, cache_size=100000, batch_size=500):
+        self.engine = engine
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'queries': 0}
+
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return float(self.stats['hits']) / lookups if lookups else 0.0
+
+    def _fetch(self, lst_app_id):
+        columns = [tbl_steam_app.c.steam_appid] + [tbl_steam_app.c[field] for field in APP_FIELDS]
+        dic_app = dict((app_id, None) for app_id in lst_app_id)
+        with self.engine.connect() as conn:
+            for start in range(0, len(lst_app_id), self.batch_size):
+                lst_batch = lst_app_id[start:start + self.batch_size]
+                query = sqlalchemy.select(*columns).where(tbl_steam_app.c.steam_appid.in_(lst_batch))
+                for row in conn.execute(query):
+                    dic_app[row[0]] = dict(zip(APP_FIELDS, row[1:]))
+                self.stats['queries'] += 1
+        return dic_app
+
+    def get_apps(self, lst_app_id):
+        ''' look up the metadata of many apps at once
+            :param lst_app_id: steam app ids, duplicates allowed
+            :return: dict of steam_appid -> {name, initial_price, header_image}, or None for unknown apps
+        '''
+        dic_app = {}
+        lst_missing = []
+        with self._lock:
+            for app_id in set(int(app_id) for app_id in lst_app_id):
+                if app_id in self._cache:
+                    self._cache.move_to_end(app_id)
+                    dic_app[app_id] = self._cache[app_id]
+                    self.stats['hits'] += 1
+                else:
+                    lst_missing.append(app_id)
+                    self.stats['misses'] += 1
+        if lst_missing:
+            dic_fetched = self._fetch(lst_missing)
+            dic_app.update(dic_fetched)
+            with self._lock:
+                self._cache.update(dic_fetched)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return dic_app
+
+    def enrich(self, dic_recommended):
+        ''' replace the bare app ids of a recommendation output with app details
+            all users' app ids are looked up together, so the number of queries does not grow with the users
+            :param dic_recommended: dict of user id -> list of recommended app ids
+            :return: dict of user id -> list of {steam_appid, name, initial_price, header_image}
+        '''
+        dic_app = self.get_apps(app_id for lst_app_id in dic_recommended.values() for app_id in lst_app_id)
+        dic_enriched = {}
+        for user_id, lst_app_id in dic_recommended.items():
+            lst_app = []
+            for app_id in lst_app_id:
+                dic_detail = dict(dic_app.get(int(app_id)) or {})
+                dic_detail['steam_appid'] = int(app_id)
+                lst_app.append(dic_detail)
+            dic_enriched[user_id] = lst_app
+        return dic_enriched
+
+
+def app_store_from_config(config):
+    ''' build an AppStore from the database config, creating the indexes if needed '''
+    engine = create_db_engine(config)
+    create_indexes(engine)
+    store = AppStore(engine, cache_size=config.get('app_cache_size', 100000),
+                     batch_size=config.get('lookup_batch_size', 500))
+    logging.info('App store ready on %s' % engine.url.render_as_string(hide_password=True))
+    return store
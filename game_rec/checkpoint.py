@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Checkpoints for resumable crawls
+    Each crawler output gets an append-only journal next to it, recording which entity ids
+    succeeded or failed, so a rerun of the same run only fetches what is missing
+    Written by Faye Yan, 2016
+"""
+
+import os
+import threading
+
+from game_rec import metrics
+from game_rec.dump import open_dump_writer
+
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+# written after the done ids of a batch, with the size the output had once the batch was flushed
+STATUS_END = 'end'
+
+
+class CheckpointJournal(object):
+    ''' append-only journal of entity ids, one "<status>\t<id>" line per outcome
+        the last status recorded for an id wins, so a failed id that later succeeds counts as done.
+        A batch of done ids is followed by an "end\t<output size>" line; on resume, done ids without
+        their end line are dropped and output_size tells how much of the output they are committed for.
+    '''
+    def __init__(self, path, resume=False):
+        self.path = path
+        # statuses of a previous run; ids journaled in this run are only counted, so memory stays flat
+        self.dic_status = {}
+        self.dic_count = {STATUS_DONE: 0, STATUS_FAILED: 0}
+        # output size after the last complete batch of a previous run, None if it was never recorded
+        self.output_size = None
+        if resume and os.path.isfile(path):
+            lst_pending = []
+            with open(path, 'r') as f:
+                for line in f:
+                    # skip a torn last line left by a crash
+                    if not line.endswith('\n'):
+                        continue
+                    status, _, entity_id = line.rstrip('\n').partition('\t')
+                    if status == STATUS_END:
+                        self.output_size = int(entity_id)
+                        self.dic_status.update((i, STATUS_DONE) for i in lst_pending)
+                        lst_pending = []
+                    elif status == STATUS_DONE:
+                        lst_pending.append(entity_id)
+                    else:
+                        self.dic_status[entity_id] = status
+            if self.output_size is None:
+                # journal of ids marked done one at a time, without output sizes
+                self.dic_status.update((i, STATUS_DONE) for i in lst_pending)
+        self._f = open(path, 'a' if resume else 'w')
+        self._lock = threading.Lock()
+
+    def __contains__(self, entity_id):
+        return self.dic_status.get(str(entity_id)) == STATUS_DONE
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _mark(self, lst_entity_id, status, output_size=None):
+        with self._lock:
+            self._f.writelines('%s\t%s\n' % (status, entity_id) for entity_id in lst_entity_id)
+            if output_size is not None:
+                self._f.write('%s\t%s\n' % (STATUS_END, output_size))
+            self._f.flush()
+            self.dic_count[status] += len(lst_entity_id)
+
+    def mark_done(self, entity_id):
+        self._mark([entity_id], STATUS_DONE)
+
+    def mark_done_many(self, lst_entity_id, output_size=None):
+        ''' :param output_size: size of the output once these ids' lines were flushed, what a resume keeps '''
+        self._mark(lst_entity_id, STATUS_DONE, output_size)
+
+    def mark_failed(self, entity_id):
+        self._mark([entity_id], STATUS_FAILED)
+
+    def pending(self, lst_entity_id):
+        ''' :return: generator of the ids not yet done, failed ids included '''
+        return (entity_id for entity_id in lst_entity_id if entity_id not in self)
+
+    def counts(self):
+        ''' :return: number of ids journaled as done and failed in this run '''
+        return dict(self.dic_count)
+
+    def close(self):
+        self._f.close()
+
+
+class BatchWriter(object):
+    ''' buffers output lines and writes them in batches
+        ids are journaled as done only once their lines are flushed, together with the output size after
+        them, so a crash loses at most one batch of work and never leaves an id marked done without its
+        output. Lines flushed before a crash but not journaled are cut off on resume (see open_checkpoint),
+        so refetching them does not duplicate them.
+        :param name: label of the output in the run metrics, defaults to the output file name
+    '''
+    def __init__(self, f, journal, batch_size=500, name=None):
+        self.f = f
+        self.name = name or os.path.basename(getattr(f, 'name', 'output'))
+        self.journal = journal
+        self.batch_size = batch_size
+        self.lst_line = []
+        self.lst_entity_id = []
+
+    def write(self, entity_id, line):
+        self.lst_line.append(line)
+        self.lst_entity_id.append(entity_id)
+        if len(self.lst_line) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.lst_line:
+            return
+        if hasattr(self.f, 'write_block'):
+            # a framed dump compresses each batch as one block, indexed by the batch's ids
+            self.f.write_block(self.lst_entity_id, self.lst_line)
+            output_size = self.f.offset
+        else:
+            self.f.writelines(self.lst_line)
+            self.f.flush()
+            output_size = self.f.tell()
+        metrics.inc('bytes_written', sum(len(line) for line in self.lst_line), output=self.name)
+        metrics.inc('rows_written', len(self.lst_line), output=self.name)
+        self.journal.mark_done_many(self.lst_entity_id, output_size)
+        self.lst_line = []
+        self.lst_entity_id = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+def open_checkpoint(path_output, resume=False, compression=None):
+    ''' open the journal and the line-per-entity output file of a crawl
+        on resume the output is appended to, after cutting it back to the last batch the journal recorded,
+        or for older journals to its last complete line
+        :param path_output: crawler output file
+        :param resume: continue a previous run instead of starting over
+        :param compression: gzip or zstd to write a framed dump (see game_rec.dump), empty for plain lines
+        :return: (journal, output file object)
+    '''
+    journal = CheckpointJournal(path_output + '.ckpt', resume)
+    if resume and journal.output_size is not None and os.path.isfile(path_output) and \
+            os.path.getsize(path_output) > journal.output_size:
+        # lines flushed after the last journaled batch; their ids are fetched again
+        with open(path_output, 'rb+') as f:
+            f.truncate(journal.output_size)
+    if compression:
+        # a dump cuts itself back to its last complete block
+        return journal, open_dump_writer(path_output, compression, resume)
+    if resume and os.path.isfile(path_output):
+        with open(path_output, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            pos = size
+            while pos > 0:
+                step = min(pos, 65536)
+                f.seek(pos - step)
+                chunk = f.read(step)
+                idx = chunk.rfind(b'\n')
+                if idx >= 0:
+                    pos = pos - step + idx + 1
+                    break
+                pos -= step
+            if pos < size:
+                f.truncate(pos)
+    return journal, open_dump_writer(path_output, None, resume)
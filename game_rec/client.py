@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Shared http client for the web crawlers
+    One keep-alive connection pool per run instead of a new connection per request,
+    with per-host latency histograms
+    Written by Faye Yan, 2016
+"""
+
+import time
+import bisect
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from game_rec import metrics
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+# upper bounds of the latency buckets, in milliseconds
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float('inf'))
+
+
+class LatencyHistogram(object):
+    ''' fixed-bucket latency histogram '''
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+
+    def quantile(self, q):
+        ''' :return: upper bound of the bucket holding the q-th quantile '''
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.bounds[-1]
+
+    def summary(self):
+        return {'count': self.count,
+                'mean_ms': self.total_ms / self.count if self.count else None,
+                'p50_ms': self.quantile(0.5),
+                'p90_ms': self.quantile(0.9),
+                'p99_ms': self.quantile(0.99),
+                'buckets': dict(('le_%s' % bound, count) for bound, count in zip(self.bounds, self.counts))}
+
+
+class CrawlerClient(object):
+    ''' pooled keep-alive http client shared by all crawl stages
+        :param pool_size: connections kept alive per host
+        :param pool_hosts: number of hosts to keep pools for
+        :param connect_timeout: seconds to establish a connection
+        :param read_timeout: seconds to wait for a response
+        :param gzip: ask servers for compressed responses
+    '''
+    def __init__(self, pool_size=10, pool_hosts=10, connect_timeout=5, read_timeout=30, gzip=True):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate' if gzip else 'identity'
+        self.dic_latency = {}
+        self._lock = threading.Lock()
+
+    def record(self, url, seconds):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.dic_latency:
+                self.dic_latency[host] = LatencyHistogram()
+            self.dic_latency[host].observe(seconds * 1000.0)
+        metrics.observe('http_request', seconds, host=host)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.time()
+        try:
+            return self.session.get(url, **kwargs)
+        finally:
+            self.record(url, time.time() - start)
+
+    def async_session(self, limit=None):
+        ''' aiohttp session for the asyncio crawler, with the same timeouts and compression
+            latencies are not recorded automatically; the caller reports them with record()
+            :param limit: connections per host, defaults to pool_size
+        '''
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit_per_host=limit or self.pool_size)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        return aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                     headers={'Accept-Encoding': self.session.headers['Accept-Encoding']})
+
+    def latency_summary(self):
+        with self._lock:
+            return dict((host, histogram.summary()) for host, histogram in self.dic_latency.items())
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def client_from_config(config_dict):
+    ''' build the crawler client from the `http` settings of the crawler config '''
+    dic_http = config_dict.get('http') or {}
+    return CrawlerClient(pool_size=dic_http.get('pool_size', 10),
+                         pool_hosts=dic_http.get('pool_hosts', 10),
+                         connect_timeout=dic_http.get('connect_timeout', 5),
+                         read_timeout=config_dict.get('timeout', 30),
+                         gzip=dic_http.get('gzip', True))
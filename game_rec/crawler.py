@@ -13,123 +13,538 @@ import os
 import sys
 import time
 import json
+import zlib
 import yaml
+import queue
+import codecs
+import asyncio
 import logging
 import requests
 import argparse
+import threading
+import multiprocessing
 
 from datetime import datetime
+from game_rec import metrics
+from game_rec.client import client_from_config
+from game_rec.stream import CHUNK_SIZE, iter_ids, iter_json_object_items
+from game_rec.checkpoint import BatchWriter, open_checkpoint
+from game_rec.http_cache import cache_from_config
+from game_rec.throttle import controller_from_config
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# how often a blocked streaming queue put or get checks whether the crawl was stopped by an error
+STREAM_POLL_SECONDS = 0.5
 
 def proc_args():
     args_parser = argparse.ArgumentParser(description="Web Crawler")
     args_parser.add_argument('input_file', help='Path to user id file')
     args_parser.add_argument('--config', '-c', help='Path to config file', default='conf/config.yml')
     args_parser.add_argument('--output_path', '-o', help='Path to output file folder', default='.')
+    args_parser.add_argument('--resume', help='Timestamp of a previous run to resume, e.g. 20160501-120000')
 
     args,_ = args_parser.parse_known_args()
     return args
 
-def get_inventory_for_user(path_user_id, path_user_inventory, config_dict):
+def get_inventory_for_user(path_user_id, path_user_inventory, config_dict, repeat=3, resume=False, client=None):
     ''' crawler 1: get game inventory of each steam user id
         :param path_user_id: user id list input
         :param path_user_inventory: user inventory output
+        :param repeat: attempts per user id on 429/5xx or connection errors
+        :param resume: only fetch the user ids not yet done in a previous run of the same output
+        :param client: CrawlerClient shared by the crawl stages, built from config if not given
         :return: total_count: total number of user ids
     '''
-    lst_user_id = []
-    with open(path_user_id, 'rb') as f:
-        lst_user_id = f.readlines()
-    total_count = len(lst_user_id)
+    client = client or client_from_config(config_dict)
+    # the same per-key budget, retries and backoff as the asyncio crawler, so a sharded crawl keeps every key
+    # within its quota and honors Retry-After
+    rate_controller = controller_from_config(config_dict, 'inventory', repeat, client=client)
+    total_count = 0
     current_count = 0
-    with open(path_user_inventory, 'wb') as f:
-        for user_id in lst_user_id:
+    journal, f = open_checkpoint(path_user_inventory, resume)
+    with journal, f, BatchWriter(f, journal, config_dict.get('write_batch', 500), 'inventory') as writer:
+        # user ids are read lazily, so memory stays flat however long the id file is
+        for user_id in iter_ids(path_user_id):
+            total_count += 1
+            metrics.inc('crawl_items', step='inventory', status='seen')
+            if user_id in journal:
+                continue
             base_url = config_dict['base_url']
             params = {'key': config_dict['key'],
                       'steamid': user_id,
                       'format': 'json'}
-            r = requests.get(base_url, params=params)
-            user_inventory = r.json().get('response').get('games')
-            f.write(json.dumps({user_id.strip(): user_inventory}))
-            f.write('\n')
+            try:
+                r = rate_controller.get(base_url, params=params)
+                if r.status_code != 200:
+                    raise ValueError('HTTP %s' % r.status_code)
+                user_inventory = r.json().get('response').get('games')
+            except (requests.RequestException, ValueError, AttributeError) as e:
+                logging.warning('Inventory request failed for %s: %s' % (user_id, e))
+                journal.mark_failed(user_id)
+                metrics.inc('crawl_items', step='inventory', status='failed')
+                continue
+            writer.write(user_id, json.dumps({user_id: user_inventory}) + '\n')
             current_count += 1
+            metrics.inc('crawl_items', step='inventory', status='done')
+
+    logging.info('Inventory: %(calls)s calls, %(retries)s retries, '
+                 'waited %(wait_seconds).1fs, worked %(work_seconds).1fs' % rate_controller.stats)
+    return total_count
+
+async def _inventory_worker(session, queue, writer, journal, rate_controller, config_dict):
+    ''' pull user ids off the queue and write one inventory line per user '''
+    processed = 0
+    while True:
+        user_id = await queue.get()
+        if user_id is None:
+            return processed
+        params = {'key': config_dict['key'],
+                  'steamid': user_id,
+                  'format': 'json'}
+        try:
+            # waits on the inventory limiter, and backs off on 429/5xx like the blocking crawlers
+            dic_result = await rate_controller.get_json_async(session, config_dict['base_url'], params=params)
+            user_inventory = dic_result.get('response').get('games')
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, AttributeError) as e:
+            logging.warning('Inventory request failed for %s: %s' % (user_id, e))
+            journal.mark_failed(user_id)
+            metrics.inc('crawl_items', step='inventory', status='failed')
+            continue
+        # the event loop is single threaded, so workers can share the output writer
+        writer.write(user_id, json.dumps({user_id: user_inventory}) + '\n')
+        processed += 1
+        metrics.inc('crawl_items', step='inventory', status='done')
+
+async def _get_inventory_async(path_user_id, path_user_inventory, config_dict, concurrency, repeat, resume, client):
+    rate_controller = controller_from_config(config_dict, 'inventory', repeat, client=client)
+    # bounded queue, so the user id file is read only as fast as the workers consume it
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    metrics.sample('queue_depth', queue.qsize, queue='inventory')
+    try:
+        async with client.async_session(concurrency) as session:
+            journal, f = open_checkpoint(path_user_inventory, resume)
+            with journal, f, BatchWriter(f, journal, config_dict.get('write_batch', 500), 'inventory') as writer:
+                workers = [asyncio.ensure_future(_inventory_worker(session, queue, writer, journal, rate_controller,
+                                                                    config_dict))
+                           for _ in range(concurrency)]
+                total_count = 0
+                for user_id in iter_ids(path_user_id):
+                    total_count += 1
+                    metrics.inc('crawl_items', step='inventory', status='seen')
+                    if user_id not in journal:
+                        await queue.put(user_id)
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+    finally:
+        metrics.unsample(queue.qsize)
+    logging.info('Inventory: %(calls)s calls, %(retries)s retries, '
+                 'waited %(wait_seconds).1fs, worked %(work_seconds).1fs' % rate_controller.stats)
+    return total_count
+
+def get_inventory_for_user_async(path_user_id, path_user_inventory, config_dict, concurrency=None, repeat=3,
+                                 resume=False, client=None):
+    ''' crawler 1, asyncio mode: get game inventory of each steam user id with concurrent requests
+        :param path_user_id: user id list input
+        :param path_user_inventory: user inventory output, same line-per-user JSON as get_inventory_for_user
+        :param concurrency: number of requests in flight, defaults to inventory_concurrency in config
+        :param resume: only fetch the user ids not yet done in a previous run of the same output
+        :param client: CrawlerClient shared by the crawl stages, built from config if not given
+        :return: total_count: total number of user ids
+    '''
+    if aiohttp is None:
+        raise ImportError('aiohttp is required for the asyncio inventory crawler')
+    client = client or client_from_config(config_dict)
+    concurrency = concurrency or config_dict.get('inventory_concurrency', 10)
+    return asyncio.run(_get_inventory_async(path_user_id, path_user_inventory, config_dict, concurrency, repeat,
+                                            resume, client))
+
+def shard_of(user_id, shards):
+    ''' :return: shard of a user id, stable across runs so a resumed crawl finds its ids in the same shard '''
+    return zlib.crc32(user_id.encode('utf-8')) % shards
 
+def split_user_ids(path_user_id, lst_path_shard):
+    ''' partition the user id file into one id file per shard, in one pass '''
+    lst_f = [open(path_shard, 'w') for path_shard in lst_path_shard]
+    try:
+        for user_id in iter_ids(path_user_id):
+            lst_f[shard_of(user_id, len(lst_f))].write(user_id + '\n')
+    finally:
+        for f in lst_f:
+            f.close()
+
+def shard_paths(path_shard_dir, shards):
+    ''' :return: list of (user id file, inventory file) of each shard '''
+    return [(os.path.join(path_shard_dir, 'user_id_%s.txt' % shard),
+             os.path.join(path_shard_dir, 'user_inventory_%s.txt' % shard)) for shard in range(shards)]
+
+def _read_shard_count(path_shard_dir):
+    ''' :return: number of shards the folder was last split into, None if unknown '''
+    path_count = os.path.join(path_shard_dir, 'shards.txt')
+    if not os.path.isfile(path_count):
+        return None
+    with open(path_count) as f:
+        return int(f.read().strip() or 0) or None
+
+def _crawl_shard(args):
+    ''' crawl one shard in a worker process, with its own key, rate limiter and http client
+        :return: (number of user ids, metrics report of the worker)
+    '''
+    path_user_id, path_user_inventory, config_dict, key, repeat, resume = args
+    # a forked worker starts with a copy of the parent's metrics, only its own are sent back
+    metrics.reset()
+    config_dict = dict(config_dict, key=key)
+    with client_from_config(config_dict) as client:
+        if config_dict.get('inventory_mode') == 'async':
+            total_count = get_inventory_for_user_async(path_user_id, path_user_inventory, config_dict, repeat=repeat,
+                                                       resume=resume, client=client)
+        else:
+            total_count = get_inventory_for_user(path_user_id, path_user_inventory, config_dict, repeat=repeat,
+                                                 resume=resume, client=client)
+    metrics.stop_sampler()
+    return total_count, metrics.report()
+
+def get_inventory_sharded(path_user_id, path_shard_dir, config_dict, lst_key=None, repeat=3, resume=False):
+    ''' crawler 1, sharded mode: one worker process per API key
+        the request quota is per key, so each worker gets its own key, its own rate limiter built from
+        rate_limit.inventory and its own part of the user ids, and throughput grows with the number of keys.
+        Every worker crawls in inventory_mode and writes its own checkpointed output, so a resumed run
+        continues every shard where it stopped. merge_inventory_shards joins the outputs.
+        :param path_user_id: user id list input
+        :param path_shard_dir: folder of the shard id lists and outputs
+        :param lst_key: API keys, one shard each; defaults to keys in config
+        :param resume: only fetch the user ids not yet done in a previous run of the same shard folder
+        :return: total_count: total number of user ids
+    '''
+    lst_key = lst_key or config_dict['keys']
+    if not os.path.isdir(path_shard_dir):
+        os.makedirs(path_shard_dir)
+    if resume and _read_shard_count(path_shard_dir) != len(lst_key):
+        # the outputs of a different number of shards hold users that now belong to other shards
+        logging.warning('%s was not split into %s shards, crawling it from the start' %
+                        (path_shard_dir, len(lst_key)))
+        resume = False
+    with open(os.path.join(path_shard_dir, 'shards.txt'), 'w') as f:
+        f.write('%s\n' % len(lst_key))
+    lst_path = shard_paths(path_shard_dir, len(lst_key))
+    # the partition only depends on the ids and the number of keys, so resuming re-splits to the same shards
+    split_user_ids(path_user_id, [path_id for path_id, _ in lst_path])
+    lst_args = [(path_id, path_inventory, config_dict, key, repeat, resume)
+                for (path_id, path_inventory), key in zip(lst_path, lst_key)]
+    pool = multiprocessing.Pool(len(lst_key))
+    try:
+        lst_result = pool.map(_crawl_shard, lst_args, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    total_count = 0
+    for shard, (shard_count, dic_report) in enumerate(lst_result):
+        metrics.merge(dic_report, shard=shard)
+        total_count += shard_count
+    logging.info('  ...%s user ids over %s shards: %s' %
+                 (total_count, len(lst_result), ', '.join(str(shard_count) for shard_count, _ in lst_result)))
+    return total_count
+
+def merge_inventory_shards(path_shard_dir, path_user_inventory, shards):
+    ''' concatenate the shard outputs into the single user inventory file the recommendation step reads
+        only the outputs of the given number of shards are read, not those an earlier run with a different
+        number of keys left in the folder, so each user is in exactly one of them and no deduplication is needed
+        :param shards: number of shards of the crawl, i.e. of API keys
+        :return: number of users in the merged file
+    '''
+    total_count = 0
+    # written under a temporary name, so a failed merge never leaves a truncated inventory behind
+    with open(path_user_inventory + '.tmp', 'wb') as f:
+        for _, path_inventory in shard_paths(path_shard_dir, shards):
+            with open(path_inventory, 'rb') as f_shard:
+                for chunk in iter(lambda: f_shard.read(CHUNK_SIZE), b''):
+                    f.write(chunk)
+                    total_count += chunk.count(b'\n')
+    os.replace(path_user_inventory + '.tmp', path_user_inventory)
+    metrics.inc('bytes_written', os.path.getsize(path_user_inventory), output='inventory_merge')
     return total_count
 
-def get_app_details(path_app_info, path_app_user, config_dict, repeat=3):
+def dump_compression(config_dict, endpoint):
+    ''' :return: codec of the framed dump of an endpoint's output, None for plain lines '''
+    return (config_dict.get('dump_compression') or {}).get(endpoint)
+
+def get_app_list(path_app_user, config_dict, rate_controller):
+    ''' download the steamspy app list, streamed straight to disk instead of holding the whole dict
+        :param path_app_user: estimated user counts of each steam game from steamspy
+    '''
+    r = rate_controller.get(config_dict['steamspy_url'], stream=True)
+    with open(path_app_user, 'wb') as f:
+        for chunk in r.iter_content(CHUNK_SIZE):
+            f.write(chunk)
+
+def read_app_list(path_app_user):
+    ''' :return: list of the app ids in the steamspy app list '''
+    # only the app ids are kept, the per-app steamspy data is decoded one app at a time
+    with open(path_app_user, 'r') as f:
+        return [app_id for app_id, _ in iter_json_object_items(f)]
+
+def _fetch_app_detail(rate_controller, config_dict, app_id):
+    ''' :return: output line with the details of one app, or None if the request failed '''
+    url_app_detail = config_dict['steampower_url'].replace('[app_id]', app_id)
+    # the controller paces calls to the 200 calls per 5 min quota and retries throttled requests
+    try:
+        r = rate_controller.get(url_app_detail)
+        # after its retries the controller returns the last 429/5xx, which must be journaled as failed
+        if r.status_code != 200:
+            logging.warning('No app details for %s: HTTP %s' % (app_id, r.status_code))
+            return None
+        # we know the result is in JSON format, so use json() to parse it from text directly
+        result = r.json()
+    except (requests.RequestException, ValueError) as e:
+        logging.warning('No app details for %s: %s' % (app_id, e))
+        return None
+    if result is None:
+        return None
+    return json.dumps(result) + '\n'
+
+def _fetch_game_page(rate_controller, config_dict, app_id):
+    ''' :return: output line with the steamSpy page of one app, or None if the request failed '''
+    url_app_steamspy = config_dict['steamspy_app'].replace('[app_id]', app_id)
+    try:
+        r = rate_controller.get(url_app_steamspy)
+    except requests.RequestException as e:
+        logging.warning('No steamSpy page for %s: %s' % (app_id, e))
+        return None
+    # an error page would be saved and journaled as done, and never fetched again
+    if r.status_code != 200:
+        logging.warning('No steamSpy page for %s: HTTP %s' % (app_id, r.status_code))
+        return None
+    # because the result is a html page, we save it as text for now
+    return json.dumps({app_id: r.text}) + '\n'
+
+def get_app_details(path_app_info, path_app_user, config_dict, repeat=3, rate_controller=None, resume=False,
+                    client=None, fetch_list=True):
     ''' crawler 2: get app details
         :param path_app_info: app details, from steam web api
         :param path_app_user: estimated user counts of each steam game from steamspy
+        :param rate_controller: RateController for the app details endpoint, built from config if not given
+        :param resume: reuse the steamspy list and only fetch the app ids not yet done in a previous run
+        :param client: CrawlerClient shared by the crawl stages, built from config if not given
+        :param fetch_list: download the steamspy list first; False reads the one already at path_app_user
     '''
-    r = requests.get(config_dict['steamspy_url'])
-    dic_app_user = r.json()
-    with open(path_app_user, 'wb') as f:
-        json.dump(dic_app_user, f)
-    lst_app_id = dic_app_user.keys()
+    if rate_controller is None:
+        rate_controller = controller_from_config(config_dict, 'app_details', repeat, cache_from_config(config_dict),
+                                                 client or client_from_config(config_dict))
+    if fetch_list and not (resume and os.path.isfile(path_app_user)):
+        get_app_list(path_app_user, config_dict, rate_controller)
+    lst_app_id = read_app_list(path_app_user)
     total_count = len(lst_app_id)
     current_count = 0
+    metrics.inc('crawl_items', total_count, step='app_details', status='seen')
 
-    with open(path_app_info, 'wb') as f:
-        for app_id in lst_app_id:
-            url_app_detail = config_dict['steampower_url'].replace('[app_id]', app_id)
-            result = None
-            # try no more than x times for each app id
-            for i in range(repeat):
-                try:
-                    r = requests.get(url_app_detail)
-                    # we know the result is in JSON format, so use json() to parse it from text directly
-                    result = r.json()
-                    # if all scripts under try block was run successfully, we get what we need.
-                    # Break the loop and move onto the next app id
-                    break
-                except:
-                    time.sleep(5)
-                    # otherwise, continue for loop and try to send the http request again
-                    pass
-            f.write(json.dumps(result))
-            f.write('\n')
+    journal, f = open_checkpoint(path_app_info, resume, dump_compression(config_dict, 'app_details'))
+    with journal, f, BatchWriter(f, journal, config_dict.get('write_batch', 500), 'app_details') as writer:
+        for app_id in journal.pending(lst_app_id):
+            line = _fetch_app_detail(rate_controller, config_dict, app_id)
+            if line is None:
+                journal.mark_failed(app_id)
+                metrics.inc('crawl_items', step='app_details', status='failed')
+                continue
+            writer.write(app_id, line)
             current_count += 1
-            if current_count % 200 == 0:
-                # this API endpoint has a limit of 200 calls per 5 min
-                time.sleep(300)
-            else:
-                time.sleep(.5)
+            metrics.inc('crawl_items', step='app_details', status='done')
 
+    logging.info('App details: %(calls)s calls, %(retries)s retries, '
+                 'waited %(wait_seconds).1fs, worked %(work_seconds).1fs' % rate_controller.stats)
+    if rate_controller.cache is not None:
+        logging.info('  ...cache hit rate %.1f%% (%s)' % (100 * rate_controller.cache.hit_rate(), rate_controller.cache.stats))
     return lst_app_id
 
-def get_game_page(lst_app_id, path_app_steamspy, config_dict, repeat=3):
+def get_game_page(lst_app_id, path_app_steamspy, config_dict, repeat=3, rate_controller=None, resume=False,
+                  client=None):
     ''' crawler 3: get game's steamSpy page
         :param lst_app_id: list of app ids
         :param path_app_steamspy: app info from steamspy page
+        :param rate_controller: RateController for the steamspy pages, built from config if not given
+        :param resume: only fetch the app ids not yet done in a previous run of the same output
+        :param client: CrawlerClient shared by the crawl stages, built from config if not given
         :return: app tagging info
     '''
+    if rate_controller is None:
+        # a latency between requests reduces burden on the server and avoids your IP being blocked
+        rate_controller = controller_from_config(config_dict, 'steamspy_page', repeat, cache_from_config(config_dict),
+                                                 client or client_from_config(config_dict))
     current_count = 0
-    with open(path_app_steamspy, 'wb') as f:
-        for app_id in lst_app_id:
-            url_app_steamspy = config_dict['steamspy_app'].replace('[app_id]', 'app_id')
-            for i in range(repeat):
-                try:
-                    r = requests.get(url_app_steamspy)
-                    # because the result is a html page, we save it as text for now
-                    f.write(json.dumps({app_id: r.text}))
-                    f.write('\n')
-                    break
-                except:
-                    time.sleep(5)
-                    pass
-
+    metrics.inc('crawl_items', len(lst_app_id), step='steamspy_page', status='seen')
+    journal, f = open_checkpoint(path_app_steamspy, resume, dump_compression(config_dict, 'steamspy_page'))
+    with journal, f, BatchWriter(f, journal, config_dict.get('write_batch', 500), 'steamspy_page') as writer:
+        for app_id in journal.pending(lst_app_id):
+            line = _fetch_game_page(rate_controller, config_dict, app_id)
+            if line is None:
+                journal.mark_failed(app_id)
+                metrics.inc('crawl_items', step='steamspy_page', status='failed')
+                continue
+            writer.write(app_id, line)
             current_count += 1
-            if current_count % 200 == 0:
-                time.sleep(10)
-            else:
-                # it's highly recommended to put a latency after each http request,
-                # which helps to reduce burdon on the server and avoid your IP being blocked
-                time.sleep(1)
+            metrics.inc('crawl_items', step='steamspy_page', status='done')
+
+    logging.info('SteamSpy pages: %(calls)s calls, %(retries)s retries, '
+                 'waited %(wait_seconds).1fs, worked %(work_seconds).1fs' % rate_controller.stats)
+    if rate_controller.cache is not None:
+        logging.info('  ...cache hit rate %.1f%% (%s)' % (100 * rate_controller.cache.hit_rate(), rate_controller.cache.stats))
+
+
+class _TeeReader(object):
+    ''' text reader over a streamed response body, copying the raw bytes to a file as they are read '''
+    def __init__(self, r, f):
+        self.chunks = r.iter_content(CHUNK_SIZE)
+        self.decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')()
+        self.f = f
+
+    def read(self, size=-1):
+        # returns one network chunk at a time, whatever the size asked for; '' at the end of the body
+        for chunk in self.chunks:
+            self.f.write(chunk)
+            text = self.decoder.decode(chunk)
+            if text:
+                return text
+        return self.decoder.decode(b'', final=True)
+
+def _iter_app_list(path_app_user, config_dict, rate_controller, fetch_list):
+    ''' app ids of the steamspy list as they arrive, while the list is saved to path_app_user '''
+    if not fetch_list:
+        for app_id in read_app_list(path_app_user):
+            yield app_id
+        return
+    r = rate_controller.get(config_dict['steamspy_url'], stream=True)
+    # renamed into place once complete, so a crawl stopped part way never resumes from a truncated list
+    with open(path_app_user + '.tmp', 'wb') as f:
+        for app_id, _ in iter_json_object_items(_TeeReader(r, f)):
+            yield app_id
+    os.replace(path_app_user + '.tmp', path_app_user)
+
+def _put_unless_stopped(app_queue, item, stop):
+    ''' put an item on a bounded queue, giving up once stop is set
+        :return: True if the item was queued
+    '''
+    while not stop.is_set():
+        try:
+            app_queue.put(item, timeout=STREAM_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _app_consumer(app_queue, fetch, rate_controller, config_dict, journal, writer, lock, dic_count, stop, lst_error):
+    ''' fetch the app ids of a queue until its end marker, one output line per app
+        an error is stored in lst_error and sets stop, so the list reader and the other consumers quit
+        instead of waiting on a queue nobody drains; the caller raises it
+    '''
+    while not stop.is_set():
+        try:
+            app_id = app_queue.get(timeout=STREAM_POLL_SECONDS)
+        except queue.Empty:
+            continue
+        if app_id is None:
+            return
+        try:
+            line = fetch(rate_controller, config_dict, app_id)
+            # the consumers of one stage share its journal and writer
+            with lock:
+                if line is None:
+                    journal.mark_failed(app_id)
+                else:
+                    writer.write(app_id, line)
+                    dic_count['done'] += 1
+        except Exception as e:
+            logging.exception('%s consumer stopped at app %s: %s' % (rate_controller.endpoint, app_id, e))
+            lst_error.append(e)
+            stop.set()
+            return
+        metrics.inc('crawl_items', step=rate_controller.endpoint, status='failed' if line is None else 'done')
+
+def crawl_apps_streaming(path_app_user, path_app_info, path_app_steamspy, config_dict, repeat=3, resume=False,
+                         client=None, queue_size=None, dic_workers=None):
+    ''' crawlers 2 and 3 as one streaming stage
+        app ids are decoded from the steamspy list while it downloads and fanned out to two bounded queues,
+        one per endpoint; the app details and steamSpy page consumers run at the same time under their own
+        rate limits, so the crawl takes as long as the slower endpoint instead of the sum of both.
+        A full queue blocks the list reader, which bounds memory whatever the list size.
+        :param path_app_user: steamspy app list output, same as get_app_details
+        :param path_app_info: app details output, same as get_app_details
+        :param path_app_steamspy: steamSpy page output, same as get_game_page
+        :param resume: reuse the steamspy list and only fetch the app ids not yet done in a previous run
+        :param queue_size: app ids buffered per endpoint, defaults to stream_queue_size in config
+        :param dic_workers: consumer threads per endpoint, defaults to stream_workers in config
+        :return: list of app ids
+    '''
+    client = client or client_from_config(config_dict)
+    cache = cache_from_config(config_dict)
+    queue_size = queue_size or config_dict.get('stream_queue_size', 1000)
+    dic_workers = dic_workers or config_dict.get('stream_workers') or {}
+    lst_app_id = []
+    lst_stage = []
+    for endpoint, path_output, fetch in (('app_details', path_app_info, _fetch_app_detail),
+                                         ('steamspy_page', path_app_steamspy, _fetch_game_page)):
+        journal, f = open_checkpoint(path_output, resume, dump_compression(config_dict, endpoint))
+        lst_stage.append({'endpoint': endpoint, 'fetch': fetch, 'journal': journal, 'f': f,
+                          'writer': BatchWriter(f, journal, config_dict.get('write_batch', 500), endpoint),
+                          'controller': controller_from_config(config_dict, endpoint, repeat, cache, client),
+                          'queue': queue.Queue(maxsize=queue_size), 'lock': threading.Lock(), 'count': {'done': 0}})
+    lst_thread = []
+    stop = threading.Event()
+    lst_error = []
+    for dic_stage in lst_stage:
+        metrics.sample('queue_depth', dic_stage['queue'].qsize, queue=dic_stage['endpoint'])
+    try:
+        for dic_stage in lst_stage:
+            for _ in range(dic_workers.get(dic_stage['endpoint'], 1)):
+                thread = threading.Thread(target=_app_consumer,
+                                          args=(dic_stage['queue'], dic_stage['fetch'], dic_stage['controller'],
+                                                config_dict, dic_stage['journal'], dic_stage['writer'],
+                                                dic_stage['lock'], dic_stage['count'], stop, lst_error),
+                                          name='crawl-%s' % dic_stage['endpoint'], daemon=True)
+                thread.start()
+                lst_thread.append((dic_stage, thread))
+        fetch_list = not (resume and os.path.isfile(path_app_user))
+        for app_id in _iter_app_list(path_app_user, config_dict, lst_stage[0]['controller'], fetch_list):
+            if stop.is_set():
+                break
+            lst_app_id.append(app_id)
+            for dic_stage in lst_stage:
+                metrics.inc('crawl_items', step=dic_stage['endpoint'], status='seen')
+                if app_id not in dic_stage['journal']:
+                    _put_unless_stopped(dic_stage['queue'], app_id, stop)
+    finally:
+        # end markers, one per consumer thread, then wait for the queues to drain; after a consumer error
+        # the others stop at their next app instead
+        for dic_stage, _ in lst_thread:
+            _put_unless_stopped(dic_stage['queue'], None, stop)
+        for _, thread in lst_thread:
+            thread.join()
+        for dic_stage in lst_stage:
+            metrics.unsample(dic_stage['queue'].qsize)
+            dic_stage['writer'].flush()
+            dic_stage['journal'].close()
+            dic_stage['f'].close()
+    if lst_error:
+        raise lst_error[0]
+
+    for dic_stage in lst_stage:
+        logging.info('%s: %s of %s apps, ' % (dic_stage['endpoint'], dic_stage['count']['done'], len(lst_app_id)) +
+                     '%(calls)s calls, %(retries)s retries, waited %(wait_seconds).1fs, worked %(work_seconds).1fs'
+                     % dic_stage['controller'].stats)
+    if cache is not None:
+        logging.info('  ...cache hit rate %.1f%% (%s)' % (100 * cache.hit_rate(), cache.stats))
+    return lst_app_id
 
 
 def main():
 
-    now = datetime.now().strftime('%Y%m%d-%H%M%S')
     # parse commandline parameters
     args = proc_args()
+    # a resumed run reuses the timestamp, and so the output files, of the run it continues
+    resume = args.resume is not None
+    now = args.resume if resume else datetime.now().strftime('%Y%m%d-%H%M%S')
     path_user_id = args.input_file
     if not os.path.isfile(path_user_id):
         logging.exception('Exit. Invalid input file: %s' % path_user_id)
@@ -148,19 +563,46 @@ def main():
     path_app_info = os.path.join(out_path, config['path_app_info'].replace('[timestamp]', now))
     path_app_steamspy = os.path.join(out_path, config['path_app_steamspy'].replace('[timestamp]', now))
 
+    # one pooled http client shared by all crawlers
+    client = client_from_config(config)
+
     # step 1: get game inventory of each steam user id
     logging.info('Getting game inventory of each steam user id...')
-    total_ct = get_inventory_for_user(path_user_id, path_user_inventory, config)
+    if config.get('keys'):
+        # one worker process per API key, then one inventory file
+        path_shard_dir = path_user_inventory + '.shards'
+        total_ct = get_inventory_sharded(path_user_id, path_shard_dir, config, repeat=config['repeat_num'],
+                                         resume=resume)
+        merge_inventory_shards(path_shard_dir, path_user_inventory, len(config['keys']))
+    elif config.get('inventory_mode') == 'async':
+        total_ct = get_inventory_for_user_async(path_user_id, path_user_inventory, config,
+                                                repeat=config['repeat_num'], resume=resume, client=client)
+    else:
+        total_ct = get_inventory_for_user(path_user_id, path_user_inventory, config, repeat=config['repeat_num'],
+                                          resume=resume, client=client)
     logging.info('  ...processed %s steam user ids.' % total_ct)
 
-    # step 2: get app details
-    logging.info('Getting game app details...')
-    lst_app_id = get_app_details(path_app_info, path_app_user, config, repeat=config['repeat_num'])
-    logging.info('  ...returned %s app ids.' % len(lst_app_id))
+    if config.get('app_crawl_mode') == 'stream':
+        # steps 2 and 3 at the same time, fed from the steamspy list as it downloads
+        logging.info('Getting game app details and game pages...')
+        lst_app_id = crawl_apps_streaming(path_app_user, path_app_info, path_app_steamspy, config,
+                                          repeat=config['repeat_num'], resume=resume, client=client)
+        logging.info('  ...returned %s app ids.' % len(lst_app_id))
+    else:
+        # step 2: get app details
+        logging.info('Getting game app details...')
+        lst_app_id = get_app_details(path_app_info, path_app_user, config, repeat=config['repeat_num'],
+                                     resume=resume, client=client)
+        logging.info('  ...returned %s app ids.' % len(lst_app_id))
 
-    # step 3: get game's steamspy page
-    logging.info('Getting game page...')
-    get_game_page(lst_app_id, path_app_steamspy, config, repeat=config['repeat_num'])
+        # step 3: get game's steamspy page
+        logging.info('Getting game page...')
+        get_game_page(lst_app_id, path_app_steamspy, config, repeat=config['repeat_num'], resume=resume,
+                      client=client)
+    for host, dic_latency in client.latency_summary().items():
+        logging.info('  ...%s: %s requests, mean %.0f ms, p50 <= %s ms, p99 <= %s ms' %
+                     (host, dic_latency['count'], dic_latency['mean_ms'], dic_latency['p50_ms'], dic_latency['p99_ms']))
+    client.close()
     logging.info('Crawler Done.')
 
 
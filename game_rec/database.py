@@ -11,16 +11,28 @@
 import re
 import os
 import sys
+import time
 import json
 import yaml
+import array
 import logging
 import argparse
 import sqlalchemy
+import lxml.html
+import lxml.etree
+import multiprocessing
+import scipy.sparse
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from bs4 import BeautifulSoup
 from datetime import datetime
 
+from game_rec import metrics
+from game_rec.dump import DumpReader, is_dump, iter_lines
+
 def proc_args():
     args_parser = argparse.ArgumentParser(description="Parse and save crawler outputs to DB")
     args_parser.add_argument('app_info', help='Path to the crawler output: app_info')
@@ -31,152 +43,398 @@ def proc_args():
     args,_ = args_parser.parse_known_args()
     return args
 
-def save_to_db(path_steam_app_info, config):
+# keyed app table and the staging table each load batch goes through
+metadata = sqlalchemy.MetaData()
+
+def _steam_app_columns(keyed):
+    return [sqlalchemy.Column('steam_appid', sqlalchemy.Integer, primary_key=keyed, autoincrement=False,
+                              nullable=not keyed),
+            sqlalchemy.Column('name', sqlalchemy.String(500)),
+            sqlalchemy.Column('type', sqlalchemy.String(15)),
+            sqlalchemy.Column('initial_price', sqlalchemy.Float),
+            sqlalchemy.Column('release_date', sqlalchemy.Date),
+            sqlalchemy.Column('score', sqlalchemy.Integer),
+            sqlalchemy.Column('recommendation', sqlalchemy.Integer),
+            sqlalchemy.Column('windows', sqlalchemy.Boolean),
+            sqlalchemy.Column('mac', sqlalchemy.Boolean),
+            sqlalchemy.Column('linux', sqlalchemy.Boolean),
+            sqlalchemy.Column('header_image', sqlalchemy.String(255))]
+
+tbl_steam_app = sqlalchemy.Table('tbl_steam_app', metadata, *_steam_app_columns(True), mysql_charset='utf8mb4')
+tbl_steam_app_staging = sqlalchemy.Table('tbl_steam_app_staging', metadata, *_steam_app_columns(False),
+                                         mysql_charset='utf8mb4')
+
+def create_db_engine(config):
+    ''' pooled engine for the db_conn in the database config '''
+    dic_option = {'pool_pre_ping': True}
+    if not config['db_conn'].startswith('sqlite'):
+        dic_option.update(pool_size=config.get('db_pool_size', 5), pool_recycle=3600)
+    return sqlalchemy.create_engine(config['db_conn'], **dic_option)
+
+def _upsert_statement(dialect):
+    ''' statement moving the staging rows into the keyed table, replacing rows with the same steam_appid '''
+    lst_col = [col.name for col in tbl_steam_app.columns]
+    select = 'SELECT %s FROM tbl_steam_app_staging' % ', '.join(lst_col)
+    insert = 'INSERT INTO tbl_steam_app (%s) ' % ', '.join(lst_col)
+    if dialect == 'mysql':
+        return insert + select + ' ON DUPLICATE KEY UPDATE ' + \
+               ', '.join('%s = VALUES(%s)' % (col, col) for col in lst_col[1:])
+    # sqlite and postgresql; sqlite needs the WHERE to tell the upsert clause from a join
+    return insert + select + ' WHERE true ON CONFLICT (steam_appid) DO UPDATE SET ' + \
+           ', '.join('%s = excluded.%s' % (col, col) for col in lst_col[1:])
+
+def save_to_db(df_steam_app, config, engine=None):
     ''' save to MySQL
-        :param path_steam_app_info: steam app info file
-        :param config:
-        :return: N/A
+        rows are streamed through a staging table in batches and upserted into the keyed tbl_steam_app,
+        so rerunning a load replaces rows instead of duplicating them
+        :param df_steam_app: steam app info frame, or the path of the steam app info file
+        :param config: database config; db_conn, load_batch_size and db_pool_size are used
+        :param engine: engine to use instead of one built from db_conn, e.g. a SQLite stand-in
+        :return: number of rows loaded
     '''
-    # replace MySQL and csv path
-    engine = sqlalchemy.create_engine(config['db_conn'])
+    if not isinstance(df_steam_app, pd.DataFrame):
+        df_steam_app = read_frame(df_steam_app)
+    engine = engine or create_db_engine(config)
+    batch_size = config.get('load_batch_size', 5000)
+    lst_col = [col.name for col in tbl_steam_app.columns]
     # create table schema if needed
-    engine.execute('''
-        CREATE TABLE IF NOT EXISTS `tbl_steam_app`(
-            `steam_appid` INT,
-            `name` VARCHAR(500) CHARACTER SET utf8mb4,
-            `type` VARCHAR(15),
-            `initial_price` FLOAT,
-            `release_date` VARCHAR(20),
-            `score` INT,
-            `recommendation` INT,
-            `windows` BOOLEAN,
-            `mac` BOOLEAN,
-            `linux` BOOLEAN,
-            `header_image` VARCHAR(100)
-        );
-        ''')
-    # write to table
-    engine.execute('''
-        LOAD DATA INFILE '%s' INTO TABLE `tbl_steam_app`
-        FIELDS TERMINATED BY ','
-        OPTIONALLY ENCLOSED BY '"'
-        LINES TERMINATED BY '\n'
-        IGNORE 1 LINES
-        (@steam_appid, @name, @type, @initial_price, @release_date, @score, @recommendation, @windows, @mac, @linux, @header_image)
-        SET
-        steam_appid = nullif(@steam_appid, ''),
-        name = nullif(@name, ''),
-        type = nullif(@type, ''),
-        initial_price = nullif(@initial_price,''),
-        release_date = nullif(@release_date,''),
-        score = nullif(@score,''),
-        recommendation = nullif(@recommendation, ''),
-        windows = nullif(@windows, ''),
-        mac = nullif(@mac, ''),
-        linux = nullif(@linux, ''),
-        header_image = nullif(@header_image, '');
-        ''' % path_steam_app_info)
-
-
-def merge_dfs(df_app_tag, df_steam_app, path_master_app_info, logging):
+    metadata.create_all(engine)
+    upsert = sqlalchemy.text(_upsert_statement(engine.dialect.name))
+
+    start = time.time()
+    current_count = 0
+    for start_row in range(0, len(df_steam_app), batch_size):
+        df_batch = df_steam_app.iloc[start_row:start_row + batch_size][lst_col]
+        if 'release_date' in df_batch:
+            df_batch = df_batch.assign(release_date=pd.to_datetime(df_batch['release_date']).dt.date)
+        # missing values (NaN, NaT, pd.NA) go in as NULL
+        lst_row = df_batch.astype(object).where(df_batch.notna(), None).to_dict('records')
+        # each batch is one transaction, so a failed load can simply be rerun
+        with engine.begin() as conn:
+            conn.execute(tbl_steam_app_staging.delete())
+            conn.execute(tbl_steam_app_staging.insert(), lst_row)
+            conn.execute(upsert)
+        current_count += len(lst_row)
+        metrics.inc('rows_loaded', len(lst_row), table='tbl_steam_app')
+    elapsed = time.time() - start
+    logging.info('Loaded %s rows into tbl_steam_app in %.1fs (%.0f rows/sec)' %
+                 (current_count, elapsed, current_count / elapsed if elapsed else 0))
+    return current_count
+
+
+def merge_dfs(df_app_tag, df_steam_app, path_master_app_info):
     ''' merge two tables
-        :param df_app_tag:
-        :param df_steam_app:
+        left join of the sparse app tags onto the app info, done on the CSR matrix so tags stay sparse
+        :param df_app_tag: sparse app tag frame from parse_app_steamspy, or the path of the app tag file
+        :param df_steam_app: steam app info frame, or the path of the steam app info file
         :param path_master_app_info:
-        :return: N/A
+        :return: df_master
+    '''
+    if not isinstance(df_app_tag, pd.DataFrame):
+        df_app_tag = read_frame(df_app_tag)
+    if not isinstance(df_steam_app, pd.DataFrame):
+        df_steam_app = read_frame(df_steam_app)
+    tag_matrix, arr_app_id, lst_tag = app_tag_matrix(df_app_tag)
+    # apps without a steamSpy page point at an appended all-zero row (position -1)
+    arr_pos = pd.Index(arr_app_id).get_indexer(df_steam_app['steam_appid'].values)
+    tag_matrix = scipy.sparse.vstack([tag_matrix, scipy.sparse.csr_matrix((1, len(lst_tag)), dtype=np.uint8)],
+                                     format='csr')[arr_pos]
+    df_tag = pd.DataFrame.sparse.from_spmatrix(tag_matrix, columns=lst_tag)
+    df_master = pd.concat([df_steam_app.reset_index(drop=True), df_tag], axis=1)
+    write_frame(df_master, path_master_app_info)
+    return df_master
+
+def app_tag_frame(tag_matrix, arr_app_id, lst_tag):
+    ''' wrap an app x tag CSR matrix as a DataFrame with a steam_appid column and one sparse uint8 column per tag '''
+    df_app_tag = pd.DataFrame.sparse.from_spmatrix(tag_matrix, columns=lst_tag)
+    df_app_tag.insert(0, 'steam_appid', np.asarray(arr_app_id, dtype=np.int32))
+    return df_app_tag
+
+def app_tag_matrix(df_app_tag):
+    ''' :return: (app x tag CSR matrix, steam_appid per row, tag per column) of an app tag frame '''
+    lst_tag = [col for col in df_app_tag.columns if col != 'steam_appid']
+    if not lst_tag:
+        return scipy.sparse.csr_matrix((len(df_app_tag), 0), dtype=np.uint8), df_app_tag['steam_appid'].values, []
+    if all(isinstance(dtype, pd.SparseDtype) for dtype in df_app_tag[lst_tag].dtypes):
+        return df_app_tag[lst_tag].sparse.to_coo().tocsr(), df_app_tag['steam_appid'].values, lst_tag
+    # frames read back from a stage artifact are dense
+    return scipy.sparse.csr_matrix(df_app_tag[lst_tag].to_numpy(dtype=np.uint8)), df_app_tag['steam_appid'].values, \
+           lst_tag
+
+def write_frame(df, path, block_size=50000):
+    ''' write a stage artifact, as Parquet if the path ends with .parquet and as csv otherwise
+        :param df: frame to write, sparse columns are densified one block of rows at a time
+        :param path: output file
+    '''
+    if path.endswith('.parquet'):
+        write_parquet_blocks(df, path, block_size)
+    else:
+        write_csv_blocks(df, path, block_size)
+    metrics.inc('rows_written', len(df), output=os.path.basename(path))
+    metrics.inc('bytes_written', os.path.getsize(path), output=os.path.basename(path))
+
+def read_frame(path, columns=None):
+    ''' read a stage artifact written by write_frame
+        :param columns: columns to read; Parquet only reads these from disk
+        :return: DataFrame
+    '''
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns, encoding='utf8')
+
+def _parquet_compatible(df_block):
+    # unsigned ints are widened to signed, and timestamps stored in ms, so the Spark reader accepts them
+    dic_cast = {}
+    for col, dtype in df_block.dtypes.items():
+        if isinstance(dtype, pd.SparseDtype):
+            dtype = dtype.subtype
+        if dtype.kind == 'u':
+            dic_cast[col] = np.dtype('int%s' % min(64, dtype.itemsize * 16))
+        elif isinstance(df_block[col].dtype, pd.SparseDtype):
+            dic_cast[col] = dtype
+    return df_block.astype(dic_cast) if dic_cast else df_block
+
+def write_parquet_blocks(df, path, block_size=50000, compression='snappy'):
+    ''' write a frame to compressed Parquet, one row group per block of rows '''
+    writer = None
+    try:
+        for start in range(0, max(len(df), 1), block_size):
+            # later blocks reuse the schema of the first, so an all-null block keeps its column types
+            table = pa.Table.from_pandas(_parquet_compatible(df.iloc[start:start + block_size]), preserve_index=False,
+                                         schema=writer.schema if writer is not None else None)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression=compression, coerce_timestamps='ms',
+                                          allow_truncated_timestamps=True)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+def write_csv_blocks(df, path, block_size=50000):
+    ''' write a frame with sparse columns to csv, densifying one block of rows at a time '''
+    lst_sparse = [col for col, dtype in df.dtypes.items() if isinstance(dtype, pd.SparseDtype)]
+    with open(path, 'w') as f:
+        for start in range(0, max(len(df), 1), block_size):
+            df_block = df.iloc[start:start + block_size]
+            if lst_sparse:
+                df_block = df_block.astype(dict((col, df[col].dtype.subtype) for col in lst_sparse))
+            df_block.to_csv(f, encoding='utf8', index=False, header=start == 0)
+
+# the app summary div of a steamSpy page, and the tag links inside it
+XPATH_SUMMARY = "//div[contains(concat(' ', normalize-space(@class), ' '), ' p-r-30 ')]"
+XPATH_TAG = ".//a[contains(@href, '/tag/')]/text()"
+
+def normalize_tag(tag):
+    return tag.strip().lower().replace(' ', '_').replace('-', '_')
+
+def extract_tags_soup(page):
+    ''' extract the tags of one steamSpy page with a full BeautifulSoup build
+        :param page: html of the page
+        :return: list of tags, or None if the page has no summary div
+    '''
+    soup = BeautifulSoup(page, 'lxml')
+    app_summary = soup.find('div', {'class': 'p-r-30'})
+    if app_summary is None:
+        return None
+    return [normalize_tag(i.string) for i in app_summary.find_all('a', href=re.compile('/tag/.*')) if i.string]
+
+def extract_tags_xpath(page):
+    ''' extract the tags of one steamSpy page with an lxml XPath over the parsed tree, without building a soup
+        :param page: html of the page
+        :return: list of tags, or None if the page has no summary div
+    '''
+    if not page:
+        return None
+    try:
+        tree = lxml.html.fromstring(page)
+    except lxml.etree.ParserError:
+        # whitespace-only or comment-only pages parse to an empty document
+        return None
+    lst_summary = tree.xpath(XPATH_SUMMARY)
+    if not lst_summary:
+        return None
+    return [normalize_tag(tag) for tag in lst_summary[0].xpath(XPATH_TAG) if tag.strip()]
+
+TAG_EXTRACTORS = {'soup': extract_tags_soup, 'xpath': extract_tags_xpath}
+
+def _parse_steamspy_chunk(args):
+    ''' worker: build the tag map of a chunk of steamSpy dump lines
+        :return: (dic_tag of tag -> list of steam_appids, number of pages skipped)
+    '''
+    lst_raw_string, mode = args
+    extract_tags = TAG_EXTRACTORS[mode]
+    dic_tag = {}
+    skipped = 0
+    for raw_string in lst_raw_string:
+        (app_id, page), = json.loads(raw_string).items()
+        lst_tag = extract_tags(page)
+        if lst_tag is None:
+            skipped += 1
+            continue
+        steam_appid = int(app_id)
+        for tag in lst_tag:
+            if tag in dic_tag:
+                dic_tag[tag].append(steam_appid)
+            else:
+                dic_tag[tag] = [steam_appid]
+    return dic_tag, skipped
+
+def _parse_steamspy_blocks(args):
+    ''' worker: build the tag map of a range of blocks of a steamSpy dump, read and decompressed by the worker
+        :return: same as _parse_steamspy_chunk
     '''
-    df_master = df_steam_app.merge(df_app_tag, on='steam_appid', how='left')
-    df_master.to_csv(path_master_app_info, encoding='utf8', index=False)
+    path, start, stop, mode = args
+    lst_raw_string = [line for lst_line in DumpReader(path).iter_blocks(start, stop) for line in lst_line]
+    return _parse_steamspy_chunk((lst_raw_string, mode))
 
-def parse_app_steamspy(path_app_steamSpy, path_steam_app_tag):
+def _iter_chunks(path, chunk_size):
+    # plain crawler outputs and framed dumps alike
+    lst_chunk = []
+    for line in iter_lines(path):
+        if not line.strip():
+            continue
+        lst_chunk.append(line)
+        if len(lst_chunk) >= chunk_size:
+            yield lst_chunk
+            lst_chunk = []
+    if lst_chunk:
+        yield lst_chunk
+
+def parse_app_steamspy(path_app_steamSpy, path_steam_app_tag, workers=1, mode='soup', chunk_size=200):
     ''' extract app tags from steamSpy page
         :param path_app_steamSpy:
         :param path_steam_app_tag:
-        :return: df_app_tag
+        :param workers: number of parser processes, 1 parses in this process
+        :param mode: soup (BeautifulSoup) or xpath (lxml XPath on the /tag/ anchors only, faster)
+        :param chunk_size: pages per task sent to a worker
+        :return: df_app_tag, one sparse uint8 column per tag
     '''
-    with open(path_app_steamSpy, 'rb') as f:
-        dic_tag = {}
-
-        lst_raw_string = f.readlines()
-        total_count = len(lst_raw_string)
-        current_count = 0
-
-        for raw_string in lst_raw_string:
-            app_json = json.loads(raw_string)
-            steam_appid = int(app_json.keys()[0])
-            soup = BeautifulSoup(app_json.values()[0], 'lxml')
-            app_summary = soup.find('div', {'class': 'p-r-30'})
-            for i in app_summary.find_all('a', href=re.compile('/tag/.*')):
-                tag = i.string.lower().replace(' ', '_').replace('-', '_')
-                if tag in dic_tag:
-                    dic_tag[tag].update({steam_appid: 1})
-                else:
-                    dic_tag[tag] = {steam_appid: 1}
-
+    # tags and apps are integer coded as they are first seen, the matrix is built from (app, tag) codes
+    dic_tag_code = {}
+    dic_app_code = {}
+    arr_row = array.array('i')
+    arr_col = array.array('i')
+    current_count = 0
+    skipped_count = 0
+    # pages are read and parsed one chunk at a time instead of reading the whole dump
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    if pool and is_dump(path_app_steamSpy):
+        # the workers get block ranges and decompress them themselves, the pages never go through this process
+        chunks = ((path_app_steamSpy, start, stop, mode)
+                  for start, stop in DumpReader(path_app_steamSpy).ranges(chunk_size))
+        parse_chunk = _parse_steamspy_blocks
+    else:
+        chunks = ((lst_chunk, mode) for lst_chunk in _iter_chunks(path_app_steamSpy, chunk_size))
+        parse_chunk = _parse_steamspy_chunk
+    try:
+        results = pool.imap_unordered(parse_chunk, chunks) if pool else map(parse_chunk, chunks)
+        # merge the per-worker tag maps
+        for dic_chunk_tag, skipped in results:
+            for tag, lst_app_id in dic_chunk_tag.items():
+                col = dic_tag_code.setdefault(tag, len(dic_tag_code))
+                for steam_appid in lst_app_id:
+                    arr_row.append(dic_app_code.setdefault(steam_appid, len(dic_app_code)))
+                    arr_col.append(col)
+            skipped_count += skipped
             current_count += 1
-    df_app_tag = pd.DataFrame(dic_tag)
-    df_app_tag.index.name = 'steam_appid'
-    df_app_tag.reset_index(inplace=True)
-    df_app_tag.to_csv(path_steam_app_tag, encoding='utf8', index=False)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    if skipped_count:
+        logging.warning('Skipped %s steamSpy pages without an app summary' % skipped_count)
+    metrics.inc('rows_parsed', len(dic_app_code), step='parse_app_steamspy')
+    metrics.inc('rows_skipped', skipped_count, step='parse_app_steamspy')
+    tag_matrix = scipy.sparse.csr_matrix((np.ones(len(arr_row), dtype=np.uint8), (arr_row, arr_col)),
+                                         shape=(len(dic_app_code), len(dic_tag_code)))
+    # a tag listed twice on a page is still a single flag
+    tag_matrix.sum_duplicates()
+    tag_matrix.data[:] = 1
+    # order rows by steam_appid and columns by tag name, so outputs are stable between runs
+    arr_app_id = np.fromiter(dic_app_code.keys(), dtype=np.int32, count=len(dic_app_code))
+    arr_tag = np.array(list(dic_tag_code.keys()), dtype=object)
+    arr_app_order = np.argsort(arr_app_id, kind='stable')
+    arr_tag_order = np.argsort(arr_tag, kind='stable')
+    tag_matrix = tag_matrix[arr_app_order][:, arr_tag_order]
+    df_app_tag = app_tag_frame(tag_matrix, arr_app_id[arr_app_order], list(arr_tag[arr_tag_order]))
+    write_frame(df_app_tag, path_steam_app_tag)
 
     return df_app_tag
 
-def parse_app_info(path_app_info, path_steam_app_info):
+# column order and dtypes of the steam app table
+APP_INFO_DTYPES = [('steam_appid', 'int32'), ('name', 'object'), ('type', 'category'), ('initial_price', 'float64'),
+                   ('release_date', 'datetime64[ns]'), ('score', 'Int16'), ('recommendation', 'Int64'),
+                   ('windows', 'uint8'), ('mac', 'uint8'), ('linux', 'uint8'), ('header_image', 'object')]
+
+def _app_info_columns(lst_raw_string):
+    ''' pull the raw fields of a batch of app detail lines into per-column lists '''
+    dic_column = dict((col, []) for col, _ in APP_INFO_DTYPES)
+    dic_column['is_free'] = []
+    dic_column['coming_soon'] = []
+    for raw_string in lst_raw_string:
+        (app_data,) = json.loads(raw_string).values()  # this should match the way dumps app detail
+        # if success is False, steam api doesn't have information for the requested app id. We can skip that.
+        if not app_data or app_data.get('success') is not True:
+            continue
+        app_data = app_data.get('data')
+        platforms = app_data.get('platforms') or {}
+        release_date = app_data.get('release_date') or {}
+        dic_column['steam_appid'].append(app_data.get('steam_appid'))
+        dic_column['name'].append(app_data.get('name'))
+        dic_column['type'].append(app_data.get('type'))
+        dic_column['initial_price'].append((app_data.get('price_overview') or {}).get('initial'))
+        dic_column['is_free'].append(app_data.get('is_free') is True)
+        dic_column['release_date'].append(release_date.get('date') or None)
+        dic_column['coming_soon'].append(release_date.get('coming_soon') is not False)
+        dic_column['score'].append((app_data.get('metacritic') or {}).get('score'))
+        dic_column['recommendation'].append((app_data.get('recommendations') or {}).get('total'))
+        for platform in ('windows', 'mac', 'linux'):
+            dic_column[platform].append(platforms.get(platform) is True)
+        dic_column['header_image'].append(app_data.get('header_image'))
+    return dic_column
+
+def _app_info_frame(dic_column):
+    ''' convert the column lists of a batch into typed arrays with vectorized operations '''
+    df = pd.DataFrame(dic_column)
+    # prices come in cents; free games cost 0
+    price = pd.to_numeric(df['initial_price'], errors='coerce').astype('float64')
+    df['initial_price'] = price.where(~df['is_free'].astype(bool), 0.0) / 100.0
+    # released games have either "Nov 5, 2015" or "Nov 2015"; unreleased or missing dates stay NaT
+    date = df['release_date'].where(~df['coming_soon'].astype(bool))
+    release_date = pd.to_datetime(date, format='%b %d, %Y', errors='coerce')
+    month_only = release_date.isna() & date.notna()
+    if month_only.any():
+        release_date[month_only] = pd.to_datetime(date[month_only], format='%b %Y', errors='coerce')
+    df['release_date'] = release_date
+    df['score'] = pd.to_numeric(df['score'], errors='coerce')
+    df['recommendation'] = pd.to_numeric(df['recommendation'], errors='coerce')
+    return df[[col for col, _ in APP_INFO_DTYPES]]
+
+def parse_app_info(path_app_info, path_steam_app_info, batch_size=10000):
     ''' extract app info
+        records are read in batches, normalized into columns and converted with vectorized operations
         param path_app_info: app info from web crawler
         param path_steam_app_info: parsed and extractd app info
-        return: df_app_info
+        param batch_size: app detail lines decoded per batch
+        return: df_app_info, with the column dtypes of APP_INFO_DTYPES
     '''
-    with open(path_app_info, 'rb') as f:
-        dic_steam_app = {'initial_price': {}, 'name': {}, 'score': {}, 'windows': {}, 'mac': {}, 'linux': {},
-                         'type': {}, 'release_date': {}, 'recommendation': {}, 'header_image': {}}
-        lst_raw_string = f.readlines()
-        total_count = len(lst_raw_string)
-        current_count = 0
-        for raw_string in lst_raw_string:
-            app_data = json.loads(raw_string).values()[0]  # this should match the way dumps app detail
-            if app_data.get(
-                    'success') == True:  # if success is False, steam api doesn't have information for the requested app id. We can skip that.
-                app_data = app_data.get('data')
-                steam_id = app_data.get('steam_appid')
-                initial_price = app_data.get('price_overview', {}).get('initial')
-                if app_data.get('is_free') == True:
-                    initial_price = 0  # set price to 0 if the game is free
-                app_name = app_data.get('name')
-                critic_score = app_data.get('metacritic', {}).get('score')
-                app_type = app_data.get('type')
-                for (platform, is_supported) in app_data.get('platforms').items():
-                    if is_supported == True:
-                        dic_steam_app[platform].update({steam_id: 1})
-                if app_data.get('release_date', {}).get('coming_soon') == False:
-                    release_date = app_data.get('release_date', {}).get('date')
-                    if not release_date == '':
-                        if re.search(',', release_date) == None:
-                            release_date = datetime.strptime(release_date, '%b %Y')
-                        else:
-                            release_date = datetime.strptime(release_date, '%b %d, %Y')
-
-                recommendation = app_data.get('recommendations', {}).get('total')
-                header_image = app_data.get('header_image')
-                dic_steam_app['initial_price'].update({steam_id: initial_price})
-                dic_steam_app['name'].update({steam_id: app_name})
-                dic_steam_app['score'].update({steam_id: critic_score})
-                dic_steam_app['type'].update({steam_id: app_type})
-                dic_steam_app['release_date'].update({steam_id: release_date})
-                dic_steam_app['recommendation'].update({steam_id: recommendation})
-                dic_steam_app['header_image'].update({steam_id: header_image})
-            current_count += 1
-    df_steam_app = pd.DataFrame(dic_steam_app)
-    df_steam_app.initial_price = df_steam_app.initial_price.map(lambda x: x / 100.0)
-    df_steam_app.index.name = 'steam_appid'
-    df_steam_app['windows'] = df_steam_app.windows.fillna(0)
-    df_steam_app['mac'] = df_steam_app.mac.fillna(0)
-    df_steam_app['linux'] = df_steam_app.linux.fillna(0)
-    df_steam_app = df_steam_app[
-        ['name', 'type', 'initial_price', 'release_date', 'score', 'recommendation', 'windows', 'mac', 'linux',
-         'header_image']]
-    df_steam_app.reset_index(inplace=True)
-    df_steam_app.to_csv(path_steam_app_info, encoding='utf8', index=False)
+    lst_df = []
+    current_count = 0
+    for lst_raw_string in _iter_chunks(path_app_info, batch_size):
+        lst_df.append(_app_info_frame(_app_info_columns(lst_raw_string)))
+        current_count += len(lst_raw_string)
+        metrics.inc('rows_parsed', len(lst_raw_string), step='parse_app_info')
+    if lst_df:
+        df_steam_app = pd.concat(lst_df, ignore_index=True)
+    else:
+        df_steam_app = _app_info_frame(_app_info_columns([]))
+    # an app crawled twice keeps its latest details
+    df_steam_app = df_steam_app.dropna(subset=['steam_appid'])\
+                               .drop_duplicates(subset='steam_appid', keep='last')\
+                               .sort_values('steam_appid')\
+                               .reset_index(drop=True)
+    df_steam_app = df_steam_app.astype(dict(APP_INFO_DTYPES))
+    write_frame(df_steam_app, path_steam_app_info)
     return df_steam_app
 
 def main():
@@ -202,9 +460,14 @@ def main():
     path_app_steamspy = args.app_steamspy
     # setup output files
     logging.info('Setup output files...')
-    path_steam_app_info = os.path.join(out_path, config['path_steam_app_info'].replace('[timestamp]', now))
-    path_steam_app_tag = os.path.join(out_path, config['path_steam_app_tag'].replace('[timestamp]', now))
-    path_master_app_info = os.path.join(out_path, config['path_master_app_info'].replace('[timestamp]', now))
+    # stage artifacts are written as csv or Parquet
+    db_format = config.get('output_format', 'csv')
+    path_steam_app_info = os.path.join(out_path, config['path_steam_app_info'].replace('[timestamp]', now)
+                                                                              .replace('[format]', db_format))
+    path_steam_app_tag = os.path.join(out_path, config['path_steam_app_tag'].replace('[timestamp]', now)
+                                                                            .replace('[format]', db_format))
+    path_master_app_info = os.path.join(out_path, config['path_master_app_info'].replace('[timestamp]', now)
+                                                                                .replace('[format]', db_format))
 
     # step 1: parse app info
     logging.info('Parsing app info: %s' % path_app_info)
@@ -213,7 +476,8 @@ def main():
 
     # step 2: parse app steamspy
     logging.info('Parsing app steamspy: %s' % path_app_steamspy)
-    df_app_tag = parse_app_steamspy(path_app_steamspy, path_steam_app_tag)
+    df_app_tag = parse_app_steamspy(path_app_steamspy, path_steam_app_tag, workers=config.get('parse_workers', 1),
+                                    mode=config.get('tag_parser', 'soup'))
     logging.info('Steam app steamSpy file created.')
 
     # step 3: merge dataframes
@@ -223,7 +487,7 @@ def main():
 
     # step 4: save steam app info to MySQL
     logging.info('Saving steam app info to DB...')
-    save_to_db(path_steam_app_info, config)
+    save_to_db(df_steam_app, config)
     logging.info('Save to MySQL Done.')
 
 
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Compressed, framed storage for the raw crawl dumps
+    A dump holds the same JSON lines as the plain crawler outputs, compressed in independently
+    decompressible blocks (gzip members, or zstd frames with the zstandard package) written one per
+    batch of the crawler. The blocks simply follow each other, so `zcat`/`zstdcat` still read the whole
+    dump. A small text index next to it, <dump>.idx, lists the offset, length and record ids of every
+    block, so a reader can decompress the one block holding an app's record, or hand block ranges to
+    parser processes, without reading the whole dump.
+    Input: a dump
+    Output: its stats, or the record of an id
+    Written by Faye Yan, 2016
+"""
+
+import os
+import sys
+import gzip
+import logging
+import argparse
+
+from game_rec import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_SUFFIX = '.idx'
+INDEX_HEADER = 'game_rec-dump'
+INDEX_VERSION = '1'
+
+CODECS = ('gzip', 'zstd')
+# first bytes of a gzip member and of a zstd frame
+MAGIC = {'gzip': b'\x1f\x8b', 'zstd': b'\x28\xb5\x2f\xfd'}
+
+
+def proc_args():
+    args_parser = argparse.ArgumentParser(description="Show the stats of a crawl dump, or the record of an id")
+    args_parser.add_argument('input_file', help='Path to the dump')
+    args_parser.add_argument('--id', help='Print the record of this id')
+
+    args,_ = args_parser.parse_known_args()
+    return args
+
+
+def _compressor(codec, level=None):
+    if codec == 'gzip':
+        # mtime 0 so the same records always give the same bytes
+        return lambda data: gzip.compress(data, compresslevel=level or 6, mtime=0)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('the zstandard package is required for zstd crawl dumps')
+        return zstandard.ZstdCompressor(level=level or 3).compress
+    raise ValueError('Unknown dump codec %s, expected one of %s' % (codec, CODECS))
+
+
+def _decompressor(codec):
+    if codec == 'gzip':
+        return gzip.decompress
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('the zstandard package is required for zstd crawl dumps')
+        return zstandard.ZstdDecompressor().decompress
+    raise ValueError('Unknown dump codec %s, expected one of %s' % (codec, CODECS))
+
+
+def read_index(path):
+    ''' read the index of a dump, keeping only the blocks that are complete in the dump file
+        a dump being written, or cut short by a crash, can be read up to its last complete block
+        :return: (codec, list of (offset, length, list of record ids) per block)
+    '''
+    with open(path + INDEX_SUFFIX, 'r') as f:
+        header = f.readline().split()
+        if len(header) != 3 or header[0] != INDEX_HEADER:
+            raise ValueError('%s is not a crawl dump index' % (path + INDEX_SUFFIX))
+        if header[1] != INDEX_VERSION:
+            raise ValueError('Unsupported crawl dump version %s in %s' % (header[1], path + INDEX_SUFFIX))
+        codec = header[2]
+        size = os.path.getsize(path)
+        lst_block = []
+        offset = 0
+        for line in f:
+            # a torn last line was written by a crash
+            if not line.endswith('\n'):
+                break
+            block_offset, length, keys = line.rstrip('\n').split('\t')
+            block_offset, length = int(block_offset), int(length)
+            if block_offset != offset or offset + length > size:
+                break
+            lst_block.append((block_offset, length, keys.split(',') if keys else []))
+            offset += length
+    return codec, lst_block
+
+
+def is_dump(path):
+    ''' :return: True if path is a framed dump, False for a plain line-per-record file '''
+    if not os.path.isfile(path + INDEX_SUFFIX):
+        return False
+    # a plain output rewritten over an old dump of the same name leaves a stale index behind
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    return not magic or any(magic.startswith(value) for value in MAGIC.values())
+
+
+class DumpWriter(object):
+    ''' appends blocks of records to a dump and its index
+        used as the output file of a crawl: BatchWriter hands it one block per batch with write_block
+        :param path: dump file
+        :param codec: gzip or zstd
+        :param resume: append to a previous dump, after cutting it back to its last complete block
+        :param level: compression level, the codec's default if not given
+    '''
+    def __init__(self, path, codec='gzip', resume=False, level=None):
+        self.path = path
+        self.name = path
+        self.codec = codec
+        self._compress = _compressor(codec, level)
+        path_index = path + INDEX_SUFFIX
+        if resume and os.path.isfile(path):
+            if not os.path.isfile(path_index):
+                raise ValueError('%s was written without compression, resume it with the same setting' % path)
+            codec_written, lst_block = read_index(path)
+            if codec_written != codec:
+                raise ValueError('%s was written with %s, resume it with the same codec' % (path, codec_written))
+            self.offset = sum(length for _, length, _ in lst_block)
+            # drop a block written after the last complete index entry, and any torn index line
+            with open(path, 'rb+') as f:
+                f.truncate(self.offset)
+            self._write_index(lst_block)
+            self._f = open(path, 'ab')
+        else:
+            self.offset = 0
+            self._write_index([])
+            self._f = open(path, 'wb')
+        self._f_index = open(path_index, 'a')
+
+    def _write_index(self, lst_block):
+        path_index = self.path + INDEX_SUFFIX
+        with open(path_index + '.tmp', 'w') as f:
+            f.write('%s %s %s\n' % (INDEX_HEADER, INDEX_VERSION, self.codec))
+            f.writelines('%s\t%s\t%s\n' % (offset, length, ','.join(lst_key))
+                         for offset, length, lst_key in lst_block)
+        os.replace(path_index + '.tmp', path_index)
+
+    def write_block(self, lst_key, lst_line):
+        ''' compress one block of records; the block is in the dump and the index once this returns
+            :param lst_key: record ids, without commas, one per line
+            :param lst_line: records, one JSON line each
+        '''
+        if not lst_line:
+            return
+        data = self._compress(''.join(lst_line).encode('utf-8'))
+        self._f.write(data)
+        self._f.flush()
+        self._f_index.write('%s\t%s\t%s\n' % (self.offset, len(data), ','.join(str(key) for key in lst_key)))
+        self._f_index.flush()
+        self.offset += len(data)
+        metrics.inc('bytes_compressed', len(data), output=os.path.basename(self.path))
+
+    def close(self):
+        self._f.close()
+        self._f_index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DumpReader(object):
+    ''' random and ranged access to the records of a dump
+        :param path: dump file, with its index next to it
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.codec, self.lst_block = read_index(path)
+        self._decompress = _decompressor(self.codec)
+        self._dic_key = None
+
+    def __len__(self):
+        return sum(len(lst_key) for _, _, lst_key in self.lst_block)
+
+    def read_block(self, block, f=None):
+        ''' :return: list of the record lines of one block '''
+        offset, length, _ = self.lst_block[block]
+        if f is None:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+        else:
+            f.seek(offset)
+            data = f.read(length)
+        # records are JSON lines, so the only raw newlines are the line ends
+        return [line + '\n' for line in self._decompress(data).decode('utf-8').split('\n')[:-1]]
+
+    def iter_blocks(self, start=0, stop=None):
+        ''' :return: generator of the record lines of blocks start to stop, one list per block '''
+        with open(self.path, 'rb') as f:
+            for block in range(start, len(self.lst_block) if stop is None else stop):
+                yield self.read_block(block, f)
+
+    def get(self, key):
+        ''' :return: the record line of an id, decompressing only its block, or None if it is not in the dump
+            the latest record wins for an id written twice, like in the plain outputs
+        '''
+        if self._dic_key is None:
+            self._dic_key = {}
+            for block, (_, _, lst_key) in enumerate(self.lst_block):
+                for row, record_key in enumerate(lst_key):
+                    self._dic_key[record_key] = (block, row)
+        position = self._dic_key.get(str(key))
+        if position is None:
+            return None
+        return self.read_block(position[0])[position[1]]
+
+    def ranges(self, records):
+        ''' split the dump into ranges of whole blocks of about `records` records each, e.g. one per parser task
+            :return: list of (start block, stop block)
+        '''
+        lst_range = []
+        start = 0
+        count = 0
+        for block, (_, _, lst_key) in enumerate(self.lst_block):
+            count += len(lst_key)
+            if count >= records:
+                lst_range.append((start, block + 1))
+                start = block + 1
+                count = 0
+        if start < len(self.lst_block):
+            lst_range.append((start, len(self.lst_block)))
+        return lst_range
+
+
+def open_dump_writer(path, codec=None, resume=False):
+    ''' :return: DumpWriter for a codec, or a plain text output file if codec is empty '''
+    if codec:
+        return DumpWriter(path, codec, resume)
+    if not resume and os.path.isfile(path + INDEX_SUFFIX):
+        # the index of an earlier dump of the same name would no longer match
+        os.remove(path + INDEX_SUFFIX)
+    return open(path, 'a' if resume else 'w')
+
+
+def iter_lines(path):
+    ''' lazily read the lines of a crawler output, plain or framed dump
+        :return: generator of record lines
+    '''
+    if is_dump(path):
+        for lst_line in DumpReader(path).iter_blocks():
+            for line in lst_line:
+                yield line
+        return
+    with open(path, 'r') as f:
+        for line in f:
+            yield line
+
+
+def main():
+
+    # parse commandline parameters
+    args = proc_args()
+    if not is_dump(args.input_file):
+        logging.exception('Exit. Not a crawl dump: %s' % args.input_file)
+        sys.exit(-1)
+    reader = DumpReader(args.input_file)
+    if args.id:
+        line = reader.get(args.id)
+        if line is None:
+            logging.error('No record for %s in %s' % (args.id, args.input_file))
+            sys.exit(1)
+        sys.stdout.write(line)
+        return
+    compressed = sum(length for _, length, _ in reader.lst_block)
+    sys.stdout.write('%s: %s, %s records in %s blocks, %.1f MB compressed\n' %
+                     (args.input_file, reader.codec, len(reader), len(reader.lst_block), compressed / 1024.0 ** 2))
+
+
+if __name__ == '__main__':
+    main()
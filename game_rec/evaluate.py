@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Offline evaluation and hyperparameter search for the local ALS backend
+    Holds out part of each user's played games, trains every configuration of a grid in a pool of
+    worker processes and ranks the held-out games with precision@k, recall@k and NDCG@k, together
+    with the training and scoring time of each configuration
+    Input: user game inventory list (or its interaction dataset)
+    Output: one JSON line per configuration, best NDCG first
+    Written by Faye Yan, 2016
+"""
+
+import os
+import sys
+import json
+import time
+import yaml
+import logging
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+import scipy.sparse
+
+from datetime import datetime
+
+from game_rec.scoring import score_all
+from game_rec.interactions import load_interactions
+from game_rec.als_local import load_playtime_matrix, train_als
+
+# grid keys are train_als parameters
+GRID_KEYS = ('factors', 'regularization', 'iterations', 'alpha', 'transform')
+
+# train and test matrices of the worker processes, set once per worker instead of sent with every task
+_dic_split = {}
+
+
+def proc_args():
+    args_parser = argparse.ArgumentParser(description="Evaluate a grid of ALS configurations on a holdout split")
+    args_parser.add_argument('input_file', help='Path to the user_inventory file')
+    args_parser.add_argument('--config', '-c', help='Path to config file', default='conf/config.yml')
+    args_parser.add_argument('--output_path', '-o', help='Path to output file folder', default='.')
+    args_parser.add_argument('--interactions', help='Path to the interaction dataset of the input file')
+
+    args,_ = args_parser.parse_known_args()
+    return args
+
+
+def split_train_test(playtime, test_fraction=0.2, min_items=5, seed=0):
+    ''' hold out a random share of the played games of every user with at least min_items of them
+        :return: (train csr, test csr), same shape as playtime
+    '''
+    playtime = playtime.tocsr()
+    rnd = np.random.RandomState(seed)
+    arr_nnz = np.diff(playtime.indptr)
+    arr_row = np.repeat(np.arange(playtime.shape[0]), arr_nnz)
+    arr_test = (rnd.rand(playtime.nnz) < test_fraction) & (arr_nnz[arr_row] >= min_items)
+    train = scipy.sparse.csr_matrix((playtime.data[~arr_test], (arr_row[~arr_test], playtime.indices[~arr_test])),
+                                    shape=playtime.shape)
+    test = scipy.sparse.csr_matrix((playtime.data[arr_test], (arr_row[arr_test], playtime.indices[arr_test])),
+                                   shape=playtime.shape)
+    return train, test
+
+
+def ranking_metrics(top, test, k):
+    ''' precision@k, recall@k and NDCG@k of ranked recommendations against held-out games
+        :param top: users x k app columns, best first, -1 for empty slots; fewer than k columns when the
+            catalog has fewer than k apps
+        :param test: csr users x apps matrix of held-out games, same rows as top
+        :return: dict of the metrics averaged over users with held-out games, and the number of those users
+    '''
+    top = top[:, :k]
+    if top.shape[1] < k:
+        top = np.hstack([top, np.full((top.shape[0], k - top.shape[1]), -1, dtype=top.dtype)])
+    test = test.tocsr()
+    arr_test_count = np.diff(test.indptr)
+    arr_user = np.flatnonzero(arr_test_count)
+    if not len(arr_user):
+        return {'precision': 0.0, 'recall': 0.0, 'ndcg': 0.0, 'users': 0}
+    # a recommended (user, app) pair is a hit if it is among the stored entries of the test matrix
+    n_items = test.shape[1]
+    arr_test_key = np.repeat(np.arange(test.shape[0], dtype=np.int64), arr_test_count) * n_items + test.indices
+    top = top[arr_user]
+    arr_key = arr_user[:, None].astype(np.int64) * n_items + top
+    hits = np.isin(arr_key, arr_test_key) & (top >= 0)
+    arr_count = arr_test_count[arr_user]
+    arr_discount = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = hits.dot(arr_discount)
+    # ideal DCG: all held-out games (up to k) at the top
+    idcg = np.concatenate([[0.0], np.cumsum(arr_discount)])[np.minimum(arr_count, k)]
+    arr_hit = hits.sum(axis=1)
+    return {'precision': float(np.mean(arr_hit / float(k))),
+            'recall': float(np.mean(arr_hit / arr_count.astype(np.float64))),
+            'ndcg': float(np.mean(dcg / idcg)),
+            'users': len(arr_user)}
+
+
+def grid_from_config(dic_grid):
+    ''' :return: list of train_als keyword dicts, one per combination of the grid values '''
+    lst_key = [key for key in GRID_KEYS if key in dic_grid]
+    lst_values = [dic_grid[key] if isinstance(dic_grid[key], list) else [dic_grid[key]] for key in lst_key]
+    return [dict(zip(lst_key, values)) for values in itertools.product(*lst_values)]
+
+
+def _init_worker(train, test):
+    _dic_split['train'] = train
+    _dic_split['test'] = test
+
+
+def evaluate_params(args):
+    ''' train one configuration on the train split and rank the test split
+        :param args: (train_als keyword dict, k, solver threads)
+        :return: the keyword dict with the metrics and times added
+    '''
+    dic_params, k, threads = args
+    train, test = _dic_split['train'], _dic_split['test']
+    start = time.time()
+    user_factors, item_factors = train_als(train, threads=threads, **dic_params)
+    train_seconds = time.time() - start
+    # only users with held-out games are scored, their training games are never recommended back
+    arr_user = np.flatnonzero(np.diff(test.indptr))
+    start = time.time()
+    top, _ = score_all(user_factors[arr_user], item_factors, k, owned=train[arr_user])
+    score_seconds = time.time() - start
+    dic_result = dict(dic_params)
+    dic_result.update(ranking_metrics(top, test[arr_user], k))
+    dic_result.update(train_seconds=round(train_seconds, 3), score_seconds=round(score_seconds, 3))
+    return dic_result
+
+
+def run_grid(train, test, lst_params, k=10, workers=1, threads=1):
+    ''' evaluate every configuration, in a pool of worker processes when workers > 1
+        :param threads: solver threads of each configuration's training
+        :return: list of result dicts, best NDCG first
+    '''
+    tasks = [(dic_params, k, threads) for dic_params in lst_params]
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(train, test))
+        try:
+            lst_result = pool.map(evaluate_params, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(train, test)
+        lst_result = [evaluate_params(task) for task in tasks]
+    return sorted(lst_result, key=lambda x: -x['ndcg'])
+
+
+def evaluate(path_user_inventory, path_evaluation, config_dict, path_interactions=None):
+    ''' split, run the grid of the evaluation config and write the results
+        :return: list of result dicts, best NDCG first
+    '''
+    config = config_dict['evaluation']
+    config_rec = config_dict['recommendation']
+    if path_interactions:
+        if 'transform' in config['grid']:
+            raise ValueError('The interaction dataset already holds transformed playtime, '
+                             'remove transform from the evaluation grid or evaluate the inventory file')
+        playtime, _, _ = load_interactions(path_interactions, config_rec['dict_dir'])
+        # the dataset already holds transformed playtime
+        dic_default = {'transform': 'raw'}
+    else:
+        playtime, _, _ = load_playtime_matrix(path_user_inventory)
+        dic_default = {'transform': config_rec.get('playtime_transform', 'log'),
+                       'lst_bucket': config_rec.get('playtime_buckets')}
+    train, test = split_train_test(playtime, config.get('test_fraction', 0.2), config.get('min_items', 5),
+                                   config.get('seed', 0))
+    lst_params = [dict(dic_default, **dic_params) for dic_params in grid_from_config(config['grid'])]
+    logging.info('Evaluating %s configurations on %s train / %s test entries...' %
+                 (len(lst_params), train.nnz, test.nnz))
+    lst_result = run_grid(train, test, lst_params, k=config.get('k', 10), workers=config.get('workers', 1),
+                          threads=config.get('threads', 1))
+    with open(path_evaluation, 'w') as f:
+        for dic_result in lst_result:
+            f.write(json.dumps(dic_result, sort_keys=True) + '\n')
+    return lst_result
+
+
+def main():
+
+    now = datetime.now().strftime('%Y%m%d-%H%M%S')
+    # parse commandline parameters
+    args = proc_args()
+    path_user_inventory = args.input_file
+    if not os.path.isfile(path_user_inventory):
+        logging.exception('Exit. Invalid input file: %s' % path_user_inventory)
+        sys.exit(-1)
+
+    # parse config
+    logging.info('Parsing config file...')
+    config_dict = yaml.safe_load(open(args.config))
+
+    path_evaluation = os.path.join(args.output_path,
+                                   config_dict['evaluation']['path_evaluation'].replace('[timestamp]', now))
+    lst_result = evaluate(path_user_inventory, path_evaluation, config_dict, args.interactions)
+    k = config_dict['evaluation'].get('k', 10)
+    for dic_result in lst_result:
+        logging.info('%s: precision@%s %.4f, recall@%s %.4f, ndcg@%s %.4f, train %.1fs, score %.1fs' %
+                     (dict((key, dic_result[key]) for key in GRID_KEYS if key in dic_result),
+                      k, dic_result['precision'], k, dic_result['recall'], k, dic_result['ndcg'],
+                      dic_result['train_seconds'], dic_result['score_seconds']))
+    logging.info('Evaluation Done: %s' % path_evaluation)
+
+
+if __name__ == '__main__':
+    main()
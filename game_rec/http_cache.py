@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Persistent http response cache for the web crawlers
+    Responses are kept in a small SQLite file keyed by url, served while fresh (per-endpoint TTL),
+    revalidated with If-None-Match / If-Modified-Since once stale, and evicted least recently used first
+    Written by Faye Yan, 2016
+"""
+
+import json
+import time
+import sqlite3
+import threading
+import requests
+
+from requests.structures import CaseInsensitiveDict
+
+
+class ResponseCache(object):
+    ''' url-keyed response cache with TTL, conditional revalidation and size-bounded LRU eviction
+        :param path: SQLite file of the cache
+        :param max_bytes: total size of cached bodies to keep, least recently used entries go first
+        :param dic_ttl: seconds a response stays fresh, per endpoint name; endpoints not listed are never fresh
+            but can still be revalidated
+    '''
+    def __init__(self, path, max_bytes=1024 ** 3, dic_ttl=None, clock=time.time):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dic_ttl = dic_ttl or {}
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS response (
+                url TEXT PRIMARY KEY,
+                status INTEGER,
+                headers TEXT,
+                body BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL,
+                accessed_at REAL,
+                size INTEGER
+            )''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_response_accessed ON response (accessed_at)')
+        self._conn.commit()
+        # running size of the cached bodies, so eviction does not have to sum the table on every store
+        self.total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM response').fetchone()[0]
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stores': 0, 'evictions': 0}
+
+    def lookup(self, url, endpoint=None):
+        ''' look up a cached response
+            :return: (response or None, is_fresh, conditional request headers)
+        '''
+        with self._lock:
+            row = self._conn.execute('SELECT status, headers, body, etag, last_modified, fetched_at '
+                                     'FROM response WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None, False, {}
+            status, headers, body, etag, last_modified, fetched_at = row
+            now = self._clock()
+            self._conn.execute('UPDATE response SET accessed_at = ? WHERE url = ?', (now, url))
+            self._conn.commit()
+            fresh = now - fetched_at < self.dic_ttl.get(endpoint, 0)
+            if fresh:
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+        dic_condition = {}
+        if etag:
+            dic_condition['If-None-Match'] = etag
+        if last_modified:
+            dic_condition['If-Modified-Since'] = last_modified
+        return _to_response(url, status, headers, body), fresh, dic_condition
+
+    def touch(self, url):
+        ''' mark a stale entry fresh again after the server answered 304 Not Modified '''
+        with self._lock:
+            now = self._clock()
+            self._conn.execute('UPDATE response SET fetched_at = ?, accessed_at = ? WHERE url = ?', (now, now, url))
+            self._conn.commit()
+            self.stats['hits'] += 1
+            self.stats['misses'] -= 1
+            self.stats['revalidated'] += 1
+
+    def store(self, url, r):
+        ''' cache a successful response, then evict down to max_bytes '''
+        body = r.content
+        now = self._clock()
+        with self._lock:
+            row = self._conn.execute('SELECT size FROM response WHERE url = ?', (url,)).fetchone()
+            if row is not None:
+                self.total_bytes -= row[0]
+            self._conn.execute('INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (url, r.status_code, json.dumps(dict(r.headers)), sqlite3.Binary(body),
+                                r.headers.get('ETag'), r.headers.get('Last-Modified'), now, now, len(body)))
+            self.total_bytes += len(body)
+            self.stats['stores'] += 1
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for url, size in self._conn.execute('SELECT url, size FROM response ORDER BY accessed_at').fetchall():
+            self._conn.execute('DELETE FROM response WHERE url = ?', (url,))
+            self.stats['evictions'] += 1
+            self.total_bytes -= size
+            if self.total_bytes <= self.max_bytes:
+                break
+
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return float(self.stats['hits']) / lookups if lookups else 0.0
+
+    def close(self):
+        self._conn.close()
+
+
+def _to_response(url, status, headers, body):
+    r = requests.Response()
+    r.url = url
+    r.status_code = status
+    r.headers = CaseInsensitiveDict(json.loads(headers))
+    r._content = bytes(body)
+    r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+    return r
+
+
+def cache_from_config(config_dict):
+    ''' open the response cache configured under `cache` in the crawler config
+        :return: ResponseCache, or None if caching is not configured
+    '''
+    dic_cache = config_dict.get('cache')
+    if not dic_cache or not dic_cache.get('path'):
+        return None
+    return ResponseCache(dic_cache['path'], int(dic_cache.get('max_mb', 1024)) * 1024 ** 2, dic_cache.get('ttl'))
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Preprocessing of the user inventories into a compact interaction dataset
+    One row per played game: int32 user code, int32 app code and a float32 confidence derived from
+    the playtime, written to Parquet in row groups. Codes come from append-only id dictionaries kept
+    across runs, so the same steam user or app keeps its code and runs can be compared.
+    Input: user game inventory list
+    Output: interaction dataset, and the updated user and app id dictionaries
+    Written by Faye Yan, 2016
+"""
+
+import os
+import sys
+import json
+import yaml
+import array
+import logging
+import argparse
+import numpy as np
+import scipy.sparse
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from datetime import datetime
+
+from game_rec import metrics
+from game_rec.stream import iter_json_lines
+
+PLAYTIME_TRANSFORMS = ('raw', 'log', 'bucket')
+
+# playtime bucket bounds in minutes: 1h, 5h, 20h, 50h, 100h, 200h
+DEFAULT_BUCKETS = (60, 300, 1200, 3000, 6000, 12000)
+
+FILE_USER_DICT = 'user_ids.txt'
+FILE_APP_DICT = 'app_ids.txt'
+
+SCHEMA = pa.schema([('user', pa.int32()), ('item', pa.int32()), ('confidence', pa.float32())])
+
+
+def proc_args():
+    args_parser = argparse.ArgumentParser(description="Write the compact interaction dataset of a user inventory file")
+    args_parser.add_argument('input_file', help='Path to the user_inventory file')
+    args_parser.add_argument('--config', '-c', help='Path to config file', default='conf/config.yml')
+    args_parser.add_argument('--output_path', '-o', help='Path to output file folder', default='.')
+
+    args,_ = args_parser.parse_known_args()
+    return args
+
+
+class IdDictionary(object):
+    ''' stable id -> int32 code mapping, persisted as one id per line with the line number as code
+        codes are only ever appended, so an id keeps its code across runs
+        :param path: dictionary file, created on the first save
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lst_id = []
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.lst_id = [line.rstrip('\n') for line in f if line.strip()]
+        self.saved = len(self.lst_id)
+        self.dic_code = dict((key, code) for code, key in enumerate(self.lst_id))
+
+    def __len__(self):
+        return len(self.lst_id)
+
+    def encode(self, key):
+        ''' :return: code of the id, a new code if it has not been seen before '''
+        key = str(key)
+        code = self.dic_code.get(key)
+        if code is None:
+            code = self.dic_code[key] = len(self.lst_id)
+            self.lst_id.append(key)
+        return code
+
+    def get(self, key):
+        ''' :return: code of the id, or None without adding it '''
+        return self.dic_code.get(str(key))
+
+    def decode(self, code):
+        return self.lst_id[code]
+
+    def save(self):
+        ''' append the ids added since the last save '''
+        if self.saved == len(self.lst_id):
+            return
+        path_dir = os.path.dirname(self.path)
+        if path_dir and not os.path.isdir(path_dir):
+            os.makedirs(path_dir)
+        with open(self.path, 'a') as f:
+            f.write(''.join(key + '\n' for key in self.lst_id[self.saved:]))
+        self.saved = len(self.lst_id)
+
+
+def load_dictionaries(dict_dir):
+    ''' :return: (user IdDictionary, app IdDictionary) of dict_dir '''
+    return IdDictionary(os.path.join(dict_dir, FILE_USER_DICT)), IdDictionary(os.path.join(dict_dir, FILE_APP_DICT))
+
+
+def transform_playtime(arr_minutes, transform='log', lst_bucket=None):
+    ''' playtime minutes to the confidence of a played game, before the alpha scaling of the trainers
+        :param transform: raw: the minutes as they are;
+                          log: log(1 + minutes), so a few very long sessions don't dominate;
+                          bucket: 1 + the number of bucket bounds at or below the minutes
+        :param lst_bucket: bucket bounds in minutes, ascending
+        :return: float32 array
+    '''
+    arr_minutes = np.asarray(arr_minutes, dtype=np.float64)
+    if transform == 'raw':
+        arr_confidence = arr_minutes
+    elif transform == 'log':
+        arr_confidence = np.log1p(arr_minutes)
+    elif transform == 'bucket':
+        arr_confidence = 1 + np.searchsorted(np.asarray(lst_bucket or DEFAULT_BUCKETS), arr_minutes, side='right')
+    else:
+        raise ValueError('Unknown playtime transform %s, expected one of %s' % (transform, PLAYTIME_TRANSFORMS))
+    return arr_confidence.astype(np.float32)
+
+
+def _write_block(writer, arr_user, arr_item, arr_minutes, transform, lst_bucket):
+    metrics.inc('rows_written', len(arr_user), output='interactions')
+    table = pa.Table.from_arrays([pa.array(np.frombuffer(arr_user, dtype=np.int32)),
+                                  pa.array(np.frombuffer(arr_item, dtype=np.int32)),
+                                  pa.array(transform_playtime(np.frombuffer(arr_minutes, dtype=np.int32),
+                                                              transform, lst_bucket))],
+                                 schema=writer.schema)
+    writer.write_table(table)
+
+
+def build_interactions(path_user_inventory, path_interactions, dict_dir, transform='log', lst_bucket=None,
+                       block_size=1000000):
+    ''' encode the played games of every user into the interaction dataset
+        rows are buffered in typed arrays and written one row group of block_size rows at a time,
+        so memory does not grow with the input
+        :param dict_dir: directory of the id dictionaries, read and extended
+        :param transform: playtime transform, see transform_playtime
+        :return: dict of users, apps and rows in the dataset
+    '''
+    dic_user, dic_app = load_dictionaries(dict_dir)
+    lst_bucket = list(lst_bucket or DEFAULT_BUCKETS) if transform == 'bucket' else None
+    dic_meta = {'transform': transform, 'buckets': lst_bucket, 'source': os.path.basename(path_user_inventory)}
+    schema = SCHEMA.with_metadata({'game_rec': json.dumps(dic_meta)})
+    set_user = set()
+    set_app = set()
+    total_rows = 0
+    arr_user, arr_item, arr_minutes = array.array('i'), array.array('i'), array.array('i')
+    with pq.ParquetWriter(path_interactions, schema, compression='snappy') as writer:
+        for user_inventory in iter_json_lines(path_user_inventory):
+            (user_id, lst_inventory), = user_inventory.items()
+            lst_played = [i for i in lst_inventory or [] if (i.get('playtime_forever') or 0) > 0]
+            if not lst_played:
+                continue
+            user = dic_user.encode(user_id)
+            set_user.add(user)
+            for i in lst_played:
+                item = dic_app.encode(i.get('appid'))
+                set_app.add(item)
+                arr_user.append(user)
+                arr_item.append(item)
+                arr_minutes.append(i.get('playtime_forever'))
+            if len(arr_user) >= block_size:
+                _write_block(writer, arr_user, arr_item, arr_minutes, transform, lst_bucket)
+                total_rows += len(arr_user)
+                arr_user, arr_item, arr_minutes = array.array('i'), array.array('i'), array.array('i')
+        if len(arr_user) or not total_rows:
+            _write_block(writer, arr_user, arr_item, arr_minutes, transform, lst_bucket)
+            total_rows += len(arr_user)
+    metrics.inc('bytes_written', os.path.getsize(path_interactions), output='interactions')
+    dic_user.save()
+    dic_app.save()
+    return {'users': len(set_user), 'apps': len(set_app), 'rows': total_rows}
+
+
+def read_interactions_meta(path_interactions):
+    ''' :return: dict of the playtime transform and buckets the dataset was written with '''
+    metadata = pq.read_schema(path_interactions).metadata or {}
+    return json.loads(metadata.get(b'game_rec', b'{}'))
+
+
+def load_interactions(path_interactions, dict_dir):
+    ''' read the dataset into a users x apps matrix of the users and apps it holds
+        the dictionaries keep every id ever seen, so rows and columns are the dataset's codes in ascending
+        order rather than the codes themselves
+        :return: (csr matrix of float32 confidence, list of steam user ids per row, array of app ids per column)
+    '''
+    dic_user, dic_app = load_dictionaries(dict_dir)
+    table = pq.read_table(path_interactions)
+    arr_user_code, arr_row = np.unique(table.column('user').to_numpy(), return_inverse=True)
+    arr_app_code, arr_col = np.unique(table.column('item').to_numpy(), return_inverse=True)
+    matrix = scipy.sparse.csr_matrix((table.column('confidence').to_numpy(), (arr_row, arr_col)),
+                                     shape=(len(arr_user_code), len(arr_app_code)))
+    matrix.sum_duplicates()
+    return matrix, [dic_user.decode(code) for code in arr_user_code], \
+           np.asarray([dic_app.decode(code) for code in arr_app_code], dtype=np.int64)
+
+
+def main():
+
+    now = datetime.now().strftime('%Y%m%d-%H%M%S')
+    # parse commandline parameters
+    args = proc_args()
+    path_user_inventory = args.input_file
+    if not os.path.isfile(path_user_inventory):
+        logging.exception('Exit. Invalid input file: %s' % path_user_inventory)
+        sys.exit(-1)
+
+    # parse config
+    logging.info('Parsing config file...')
+    config_dict = yaml.safe_load(open(args.config))
+    config = config_dict['recommendation']
+
+    path_interactions = os.path.join(args.output_path, config['path_interactions'].replace('[timestamp]', now))
+    dic_count = build_interactions(path_user_inventory, path_interactions, config['dict_dir'],
+                                   config.get('playtime_transform', 'log'), config.get('playtime_buckets'))
+    logging.info('Interaction dataset written: %s (%s)' % (path_interactions, dic_count))
+
+
+if __name__ == '__main__':
+    main()
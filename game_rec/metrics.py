@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Run-wide metrics: counters, gauges and timers, with opt-in profiling per pipeline stage
+    One process-wide registry, like the logging module: any module calls metrics.inc(...) and the
+    run writes everything out at the end, as a JSON report and as Prometheus text format.
+    A sampler thread records the RSS of the process and registered gauges such as queue depths;
+    stages listed in the config are run under cProfile and/or tracemalloc.
+    Written by Faye Yan, 2016
+"""
+
+import os
+import io
+import json
+import time
+import pstats
+import logging
+import cProfile
+import resource
+import threading
+import tracemalloc
+import contextlib
+
+PREFIX = 'game_rec_'
+
+
+def rss_bytes():
+    ''' resident set size of this process; the peak RSS where /proc is not available '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _key(name, dic_label):
+    return name, tuple(sorted(dic_label.items()))
+
+
+class Registry(object):
+    ''' thread-safe store of the run's metrics
+        counters only go up; gauges keep their last and highest value; timers keep count, total and max seconds
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.dic_counter = {}
+        self.dic_gauge = {}
+        self.dic_timer = {}
+        self.dic_profile = {}
+        self.lst_sampled = []
+        self.set_profile = set()
+        self.set_trace = set()
+        self.profile_dir = None
+        self.started = time.time()
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def configure(self, profile_stages=(), trace_memory_stages=(), profile_dir=None):
+        ''' :param profile_stages: stage names run under cProfile, their stats saved to profile_dir
+            :param trace_memory_stages: stage names run under tracemalloc
+        '''
+        self.set_profile = set(profile_stages or ())
+        self.set_trace = set(trace_memory_stages or ())
+        self.profile_dir = profile_dir
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.dic_counter[key] = self.dic_counter.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            last, peak = self.dic_gauge.get(key, (value, value))
+            self.dic_gauge[key] = (value, max(peak, value))
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            count, total, peak = self.dic_timer.get(key, (0, 0.0, 0.0))
+            self.dic_timer[key] = (count + 1, total + seconds, max(peak, seconds))
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def sample(self, name, func, **labels):
+        ''' register a gauge read by the sampler thread, e.g. the depth of a queue
+            :param func: callable returning the current value
+        '''
+        with self._lock:
+            self.lst_sampled.append((name, labels, func))
+
+    def unsample(self, func):
+        with self._lock:
+            self.lst_sampled = [i for i in self.lst_sampled if i[2] != func]
+
+    def _sample_once(self):
+        self.set_gauge('rss_bytes', rss_bytes())
+        with self._lock:
+            lst_sampled = list(self.lst_sampled)
+        for name, labels, func in lst_sampled:
+            try:
+                self.set_gauge(name, func(), **labels)
+            except Exception as e:
+                logging.debug('Gauge %s not sampled: %s' % (name, e))
+
+    def start_sampler(self, interval=1.0):
+        ''' sample RSS and the registered gauges every interval seconds in a daemon thread '''
+        if self._sampler is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                self._sample_once()
+        self._sampler = threading.Thread(target=run, name='metrics-sampler', daemon=True)
+        self._sampler.start()
+
+    def stop_sampler(self):
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+            self._stop.clear()
+        self._sample_once()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        ''' time a pipeline stage, and profile it if it was configured for cProfile or tracemalloc '''
+        profiler = cProfile.Profile() if name in self.set_profile else None
+        trace = name in self.set_trace and not tracemalloc.is_tracing()
+        rss_start = rss_bytes()
+        if trace:
+            tracemalloc.start()
+        if profiler:
+            profiler.enable()
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            if profiler:
+                profiler.disable()
+            self.observe('stage', seconds, stage=name)
+            self.set_gauge('stage_rss_delta_bytes', rss_bytes() - rss_start, stage=name)
+            dic_profile = {}
+            if profiler:
+                dic_profile['cprofile'] = self._save_profile(name, profiler)
+            if trace:
+                snapshot = tracemalloc.take_snapshot()
+                dic_profile['tracemalloc'] = {'peak_bytes': tracemalloc.get_traced_memory()[1],
+                                              'top': [str(stat) for stat in
+                                                      snapshot.statistics('lineno')[:10]]}
+                tracemalloc.stop()
+            if dic_profile:
+                with self._lock:
+                    self.dic_profile[name] = dic_profile
+
+    def _save_profile(self, name, profiler):
+        ''' :return: path of the saved stats and the 15 functions with the most cumulative time '''
+        path = None
+        if self.profile_dir:
+            if not os.path.isdir(self.profile_dir):
+                os.makedirs(self.profile_dir)
+            path = os.path.join(self.profile_dir, '%s.prof' % name)
+            profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(15)
+        return {'path': path, 'top': out.getvalue().splitlines()}
+
+    def _after_fork(self):
+        # the sampler thread and a lock held by another thread do not survive the fork, and the sampled
+        # gauges read the parent's objects, e.g. the depth of a queue only the parent fills
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop = threading.Event()
+        self.lst_sampled = []
+
+    def reset(self):
+        ''' drop the recorded values and sampled gauges, e.g. in a forked worker process that inherited its
+            parent's
+        '''
+        with self._lock:
+            self.dic_counter.clear()
+            self.dic_gauge.clear()
+            self.dic_timer.clear()
+            self.dic_profile.clear()
+            self.lst_sampled = []
+
+    def merge(self, dic_report, **labels):
+        ''' add the counters and timers of another process's report(), and keep the highest gauges
+            :param labels: added to the labels of every merged metric, e.g. the worker's shard
+        '''
+        def key(dic_entry):
+            return _key(dic_entry['name'], dict(dic_entry['labels'], **labels))
+        with self._lock:
+            for dic_entry in dic_report['counters']:
+                self.dic_counter[key(dic_entry)] = self.dic_counter.get(key(dic_entry), 0) + dic_entry['value']
+            for dic_entry in dic_report['gauges']:
+                last, peak = self.dic_gauge.get(key(dic_entry), (dic_entry['value'], dic_entry['max']))
+                self.dic_gauge[key(dic_entry)] = (dic_entry['value'], max(peak, dic_entry['max']))
+            for dic_entry in dic_report['timers']:
+                count, total, peak = self.dic_timer.get(key(dic_entry), (0, 0.0, 0.0))
+                self.dic_timer[key(dic_entry)] = (count + dic_entry['count'], total + dic_entry['seconds'],
+                                                  max(peak, dic_entry['max_seconds']))
+
+    def report(self):
+        ''' :return: dict of every metric, JSON serializable '''
+        def entries(dic, func):
+            return [dict(name=name, labels=dict(labels), **func(value))
+                    for (name, labels), value in sorted(dic.items())]
+        with self._lock:
+            return {'started': self.started,
+                    'seconds': time.time() - self.started,
+                    'counters': entries(self.dic_counter, lambda value: {'value': value}),
+                    'gauges': entries(self.dic_gauge, lambda value: {'value': value[0], 'max': value[1]}),
+                    'timers': entries(self.dic_timer, lambda value: {'count': value[0], 'seconds': value[1],
+                                                                     'max_seconds': value[2]}),
+                    'profiles': dict(self.dic_profile)}
+
+    def prometheus_text(self):
+        ''' :return: the metrics in the Prometheus text exposition format '''
+        def series(name, labels, value):
+            str_label = ','.join('%s="%s"' % (key, str(val).replace('\\', '\\\\').replace('"', '\\"'))
+                                 for key, val in labels)
+            return '%s%s %s' % (name, '{%s}' % str_label if str_label else '', repr(float(value)))
+
+        lst_line = []
+        with self._lock:
+            for dic, kind in ((self.dic_counter, 'counter'), (self.dic_gauge, 'gauge'), (self.dic_timer, 'summary')):
+                lst_name = []
+                for name, _ in sorted(dic):
+                    if name not in lst_name:
+                        lst_name.append(name)
+                for name in lst_name:
+                    lst_series = [(labels, value) for (key, labels), value in sorted(dic.items()) if key == name]
+                    if kind == 'counter':
+                        lst_line.append('# TYPE %s%s_total counter' % (PREFIX, name))
+                        lst_line += [series('%s%s_total' % (PREFIX, name), labels, value)
+                                     for labels, value in lst_series]
+                    elif kind == 'gauge':
+                        lst_line.append('# TYPE %s%s gauge' % (PREFIX, name))
+                        lst_line += [series(PREFIX + name, labels, value[0]) for labels, value in lst_series]
+                        lst_line.append('# TYPE %s%s_max gauge' % (PREFIX, name))
+                        lst_line += [series('%s%s_max' % (PREFIX, name), labels, value[1])
+                                     for labels, value in lst_series]
+                    else:
+                        lst_line.append('# TYPE %s%s_seconds summary' % (PREFIX, name))
+                        for labels, value in lst_series:
+                            lst_line.append(series('%s%s_seconds_count' % (PREFIX, name), labels, value[0]))
+                            lst_line.append(series('%s%s_seconds_sum' % (PREFIX, name), labels, value[1]))
+        return '\n'.join(lst_line) + '\n'
+
+    def write(self, path_json, path_prometheus=None):
+        ''' write the JSON report, and the Prometheus text dump if a path is given '''
+        with open(path_json, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        if path_prometheus:
+            with open(path_prometheus, 'w') as f:
+                f.write(self.prometheus_text())
+
+
+# the process-wide registry and its shortcuts
+REGISTRY = Registry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY._after_fork)
+
+configure = REGISTRY.configure
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set_gauge
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+sample = REGISTRY.sample
+unsample = REGISTRY.unsample
+stage = REGISTRY.stage
+start_sampler = REGISTRY.start_sampler
+stop_sampler = REGISTRY.stop_sampler
+reset = REGISTRY.reset
+merge = REGISTRY.merge
+report = REGISTRY.report
+prometheus_text = REGISTRY.prometheus_text
+write = REGISTRY.write
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Versioned store for trained ALS factors
+    Each training run is saved as its own directory under model_dir, named by timestamp, holding
+    NumPy arrays (user and app factors, user and app ids) and a meta.json with the training settings.
+    A LATEST file names the newest complete version, so readers never see a half-written model.
+    Factors are memory-mapped on load: the app factors are shared by every process scoring from the
+    same version, and user factors are only paged in for the users looked up.
+    Written by Faye Yan, 2016
+"""
+
+import os
+import json
+import shutil
+import logging
+import numpy as np
+import scipy.sparse
+
+from datetime import datetime
+
+
+FILE_LATEST = 'LATEST'
+FILE_META = 'meta.json'
+FILE_USER_FACTORS = 'user_factors.npy'
+FILE_ITEM_FACTORS = 'item_factors.npy'
+FILE_USER_IDS = 'user_ids.npy'
+FILE_APP_IDS = 'app_ids.npy'
+FILE_OWNED = 'owned.npz'
+
+
+class ALSModel(object):
+    ''' a loaded model version
+        :param user_factors: users x rank array, one row per entry of user_ids
+        :param item_factors: apps x rank array, one row per entry of app_ids (sorted ascending)
+        :param meta: training settings saved with the model, e.g. implicit, alpha, regularization
+        :param owned: optional csr users x apps matrix of the games each user has played
+    '''
+
+    def __init__(self, version, user_factors, item_factors, user_ids, app_ids, meta, owned=None):
+        self.version = version
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.user_ids = user_ids
+        self.app_ids = app_ids
+        self.meta = meta
+        self.owned = owned
+        self._dic_user_row = None
+
+    def user_row(self, user_id):
+        ''' row of a steam user id in user_factors, None if the user was not in the training data
+            a user saved without played games, or with all-zero factors, has nothing to score and counts as absent
+        '''
+        if self._dic_user_row is None:
+            self._dic_user_row = {str(user_id): i for i, user_id in enumerate(self.user_ids)}
+        row = self._dic_user_row.get(str(user_id))
+        if row is None:
+            return None
+        if self.owned is not None and self.owned.indptr[row + 1] == self.owned.indptr[row]:
+            return None
+        if not np.any(self.user_factors[row]):
+            return None
+        return row
+
+    def app_columns(self, arr_app):
+        ''' columns of the given app ids in item_factors, -1 for apps the model has not seen '''
+        arr_app = np.asarray(arr_app, dtype=np.int64)
+        if not len(self.app_ids):
+            return np.full(len(arr_app), -1, dtype=np.int64)
+        arr_col = np.searchsorted(self.app_ids, arr_app)
+        arr_col = np.minimum(arr_col, len(self.app_ids) - 1)
+        return np.where(self.app_ids[arr_col] == arr_app, arr_col, -1)
+
+
+def new_version():
+    return datetime.now().strftime('%Y%m%d-%H%M%S')
+
+
+def list_versions(model_dir):
+    ''' complete model versions under model_dir, oldest first '''
+    if not os.path.isdir(model_dir):
+        return []
+    return sorted(i for i in os.listdir(model_dir)
+                  if not i.startswith('.') and os.path.isfile(os.path.join(model_dir, i, FILE_META)))
+
+
+def latest_version(model_dir):
+    path_latest = os.path.join(model_dir, FILE_LATEST)
+    if os.path.isfile(path_latest):
+        with open(path_latest) as f:
+            version = f.read().strip()
+        if version:
+            return version
+    lst_version = list_versions(model_dir)
+    return lst_version[-1] if lst_version else None
+
+
+def save_model(model_dir, user_factors, item_factors, lst_user_id, arr_app_id, dic_meta, version=None, keep=None,
+               owned=None):
+    ''' save one trained model as a new version and point LATEST at it
+        the files are written to a hidden directory first and renamed into place once complete
+        :param lst_user_id: steam user id of each row of user_factors
+        :param arr_app_id: app id of each row of item_factors
+        :param dic_meta: training settings, stored in meta.json
+        :param owned: optional csr users x apps matrix of played games, columns in arr_app_id order
+        :param keep: number of versions to keep, older ones are removed; None keeps all
+        :return: version name
+    '''
+    version = version or new_version()
+    # two runs saved within the same second get a suffix, which still sorts between the timestamps
+    suffix = 0
+    while os.path.exists(os.path.join(model_dir, version if not suffix else '%s-%s' % (version, suffix))):
+        suffix += 1
+    version = version if not suffix else '%s-%s' % (version, suffix)
+    arr_app_id = np.asarray(arr_app_id, dtype=np.int64)
+    # app ids are kept sorted so the columns of new inventories can be found with a binary search
+    arr_order = np.argsort(arr_app_id, kind='mergesort')
+    if not os.path.isdir(model_dir):
+        os.makedirs(model_dir)
+    path_tmp = os.path.join(model_dir, '.%s.tmp' % version)
+    if os.path.isdir(path_tmp):
+        shutil.rmtree(path_tmp)
+    os.makedirs(path_tmp)
+    np.save(os.path.join(path_tmp, FILE_USER_FACTORS), np.asarray(user_factors, dtype=np.float32))
+    np.save(os.path.join(path_tmp, FILE_ITEM_FACTORS), np.asarray(item_factors, dtype=np.float32)[arr_order])
+    np.save(os.path.join(path_tmp, FILE_USER_IDS), np.asarray([str(i) for i in lst_user_id]))
+    np.save(os.path.join(path_tmp, FILE_APP_IDS), arr_app_id[arr_order])
+    if owned is not None:
+        scipy.sparse.save_npz(os.path.join(path_tmp, FILE_OWNED), owned.tocsc()[:, arr_order].tocsr())
+    dic_meta = dict(dic_meta, version=version, users=len(lst_user_id), apps=len(arr_app_id),
+                    rank=int(np.shape(item_factors)[1]))
+    with open(os.path.join(path_tmp, FILE_META), 'w') as f:
+        json.dump(dic_meta, f, indent=2, sort_keys=True)
+    os.rename(path_tmp, os.path.join(model_dir, version))
+
+    path_latest = os.path.join(model_dir, FILE_LATEST)
+    with open(path_latest + '.tmp', 'w') as f:
+        f.write(version + '\n')
+    os.replace(path_latest + '.tmp', path_latest)
+    logging.info('Model version %s saved: %s users x %s apps' % (version, len(lst_user_id), len(arr_app_id)))
+
+    if keep:
+        for old_version in list_versions(model_dir)[:-keep]:
+            shutil.rmtree(os.path.join(model_dir, old_version))
+    return version
+
+
+def load_model(model_dir, version=None, mmap=True):
+    ''' load a model version, the newest one by default
+        :param mmap: memory-map the factor arrays read-only instead of reading them into memory
+        :return: ALSModel, or None if model_dir has no model yet
+    '''
+    version = version or latest_version(model_dir)
+    if version is None:
+        return None
+    path_version = os.path.join(model_dir, version)
+    mmap_mode = 'r' if mmap else None
+    with open(os.path.join(path_version, FILE_META)) as f:
+        dic_meta = json.load(f)
+    path_owned = os.path.join(path_version, FILE_OWNED)
+    owned = scipy.sparse.load_npz(path_owned).tocsr() if os.path.isfile(path_owned) else None
+    return ALSModel(version,
+                    np.load(os.path.join(path_version, FILE_USER_FACTORS), mmap_mode=mmap_mode),
+                    np.load(os.path.join(path_version, FILE_ITEM_FACTORS), mmap_mode=mmap_mode),
+                    np.load(os.path.join(path_version, FILE_USER_IDS)),
+                    np.load(os.path.join(path_version, FILE_APP_IDS)),
+                    dic_meta, owned)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Small DAG executor for the engine's stages
+    Stages name the artifacts they read and write. A stage starts as soon as the stages producing its
+    inputs are done, so independent stages run at the same time on a thread pool. A stage is skipped
+    when the content hash of its inputs and its parameters match a previous run whose outputs still
+    exist; the artifacts of that run are then used downstream.
+    Written by Faye Yan, 2016
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from game_rec import metrics
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class Stage(object):
+    ''' one step of the pipeline
+        :param name: unique stage name, used by --from-stage / --until-stage
+        :param func: callable(dic_artifact), reads its inputs and writes its outputs at the given paths
+        :param inputs: names of the artifacts read; the stages producing them run first
+        :param outputs: dict of artifact name -> path written by this run
+        :param params: settings that change the outputs, part of the cache key
+        :param max_age: seconds a cached result stays valid, None for ever; crawls of live data expire
+    '''
+    def __init__(self, name, func, inputs=(), outputs=None, params=None, max_age=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = dict(outputs or {})
+        self.params = params or {}
+        self.max_age = max_age
+
+
+class StageCache(object):
+    ''' cache keys and output paths of finished stages, persisted as JSON
+        file content hashes are memoized by (size, mtime), so unchanged multi-GB inputs are hashed once
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.dic_stage = {}
+        self.dic_file_hash = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                dic_cache = json.load(f)
+            self.dic_stage = dic_cache.get('stages', {})
+            self.dic_file_hash = dic_cache.get('files', {})
+        self._lock = threading.Lock()
+
+    def file_hash(self, path):
+        ''' sha1 of a file's content, or of the names and contents of a directory's files '''
+        if os.path.isdir(path):
+            sha = hashlib.sha1()
+            for root, lst_dir, lst_file in os.walk(path):
+                lst_dir.sort()
+                for name in sorted(lst_file):
+                    sha.update(os.path.relpath(os.path.join(root, name), path).encode('utf-8'))
+                    sha.update(self.file_hash(os.path.join(root, name)).encode('utf-8'))
+            return sha.hexdigest()
+        stat = os.stat(path)
+        with self._lock:
+            memo = self.dic_file_hash.get(os.path.abspath(path))
+        if memo and memo[0] == stat.st_size and memo[1] == stat.st_mtime:
+            return memo[2]
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        with self._lock:
+            self.dic_file_hash[os.path.abspath(path)] = [stat.st_size, stat.st_mtime, sha.hexdigest()]
+        return sha.hexdigest()
+
+    def stage_key(self, stage, dic_artifact):
+        sha = hashlib.sha1(stage.name.encode('utf-8'))
+        sha.update(json.dumps(stage.params, sort_keys=True, default=str).encode('utf-8'))
+        for name in stage.inputs:
+            path = dic_artifact[name]
+            sha.update(name.encode('utf-8'))
+            sha.update(self.file_hash(path).encode('utf-8') if path and os.path.exists(path) else b'-')
+        return sha.hexdigest()
+
+    def lookup(self, stage, key):
+        ''' :return: dict of artifact name -> path of a valid cached run of the stage, or None '''
+        dic_entry = self.dic_stage.get(stage.name)
+        if not dic_entry or dic_entry['key'] != key:
+            return None
+        if stage.max_age is not None and time.time() - dic_entry['finished'] > stage.max_age:
+            return None
+        if not all(path and os.path.exists(path) for path in dic_entry['outputs'].values()):
+            return None
+        return dic_entry['outputs']
+
+    def store(self, stage, key, seconds):
+        with self._lock:
+            self.dic_stage[stage.name] = {'key': key, 'outputs': stage.outputs, 'finished': time.time(),
+                                          'seconds': round(seconds, 3)}
+            self.save()
+
+    def save(self):
+        path_dir = os.path.dirname(self.path)
+        if path_dir and not os.path.isdir(path_dir):
+            os.makedirs(path_dir)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'stages': self.dic_stage, 'files': self.dic_file_hash}, f, indent=1, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class Pipeline(object):
+    ''' runs stages in dependency order, independent stages in parallel
+        :param lst_stage: stages, each artifact produced by exactly one of them
+        :param dic_source: artifacts that exist before the run, e.g. the user id file
+        :param cache: StageCache, None to always run every stage
+        :param workers: stages run at the same time
+    '''
+    def __init__(self, lst_stage, dic_source=None, cache=None, workers=4):
+        self.dic_stage = dict((stage.name, stage) for stage in lst_stage)
+        self.lst_order = [stage.name for stage in lst_stage]
+        self.dic_source = dict(dic_source or {})
+        self.cache = cache
+        self.workers = workers
+        self.dic_producer = {}
+        for stage in lst_stage:
+            for name in stage.outputs:
+                self.dic_producer[name] = stage.name
+        for stage in lst_stage:
+            for name in stage.inputs:
+                if name not in self.dic_producer and name not in self.dic_source:
+                    raise ValueError('Stage %s reads %s, which no stage produces' % (stage.name, name))
+        self.stats = {}
+
+    def upstream(self, name):
+        ''' :return: set of the stages name depends on, directly or not '''
+        set_stage = set()
+        lst_pending = [name]
+        while lst_pending:
+            for input_name in self.dic_stage[lst_pending.pop()].inputs:
+                producer = self.dic_producer.get(input_name)
+                if producer and producer not in set_stage:
+                    set_stage.add(producer)
+                    lst_pending.append(producer)
+        return set_stage
+
+    def _check_stage(self, name):
+        if name is not None and name not in self.dic_stage:
+            raise ValueError('Unknown stage %s, expected one of %s' % (name, ', '.join(self.lst_order)))
+
+    def run(self, from_stage=None, until_stage=None):
+        ''' run the pipeline
+            :param from_stage: rerun this stage even if cached; the stages it depends on are not run,
+                their outputs of the last run are taken from the cache
+            :param until_stage: stop once this stage and the stages it depends on are done
+            :return: dict of artifact name -> path
+        '''
+        self._check_stage(from_stage)
+        self._check_stage(until_stage)
+        set_selected = set(self.lst_order)
+        if until_stage:
+            set_selected = self.upstream(until_stage) | {until_stage}
+        set_reuse = self.upstream(from_stage) if from_stage else set()
+        dic_artifact = dict(self.dic_source)
+        for name in self.lst_order:
+            dic_artifact.update(self.dic_stage[name].outputs)
+        for name in [i for i in self.lst_order if i in set_reuse]:
+            dic_cached = self.cache.dic_stage.get(name) if self.cache else None
+            if not dic_cached:
+                raise ValueError('--from-stage %s needs the outputs of %s, which has no cached run' % (from_stage, name))
+            dic_artifact.update(dic_cached['outputs'])
+            self.stats[name] = 'reused'
+
+        set_done = set(set_reuse)
+        set_todo = set(i for i in set_selected if i not in set_reuse)
+        dic_running = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            while set_todo or dic_running:
+                lst_ready = [name for name in self.lst_order if name in set_todo and
+                             all(self.dic_producer.get(i) in set_done or i in self.dic_source
+                                 for i in self.dic_stage[name].inputs)]
+                for name in lst_ready:
+                    set_todo.discard(name)
+                    dic_running[executor.submit(self._run_stage, self.dic_stage[name], dic_artifact,
+                                                name == from_stage)] = name
+                if not dic_running:
+                    raise ValueError('Stages %s wait for inputs that are never produced' % sorted(set_todo))
+                set_finished, _ = wait(list(dic_running), return_when=FIRST_COMPLETED)
+                for future in set_finished:
+                    name = dic_running.pop(future)
+                    try:
+                        dic_artifact.update(future.result())
+                    except Exception:
+                        # report at once instead of after the sibling stages, which may run for hours
+                        logging.exception('Stage %s failed, rerun with --from-stage %s' % (name, name))
+                        lst_running = sorted(dic_running[i] for i in dic_running if i.running())
+                        if lst_running:
+                            logging.error('Stages still running, their outputs will not be used: %s'
+                                          % ', '.join(lst_running))
+                        raise
+                    set_done.add(name)
+        finally:
+            # queued stages are cancelled; running ones cannot be interrupted and finish in the background
+            executor.shutdown(wait=False, cancel_futures=True)
+        return dic_artifact
+
+    def _run_stage(self, stage, dic_artifact, force=False):
+        ''' :return: dict of the stage's artifact name -> path '''
+        key = self.cache.stage_key(stage, dic_artifact) if self.cache else None
+        dic_cached = self.cache.lookup(stage, key) if self.cache and not force else None
+        if dic_cached is not None:
+            logging.info('Stage %s: inputs unchanged, reusing %s' % (stage.name, ', '.join(dic_cached.values())))
+            self.stats[stage.name] = 'cached'
+            metrics.inc('stages', status='cached')
+            return dic_cached
+        logging.info('Stage %s started' % stage.name)
+        start = time.time()
+        # timed, and profiled when the metrics config asks for it
+        with metrics.stage(stage.name):
+            stage.func(dic_artifact)
+        metrics.inc('stages', status='ran')
+        seconds = time.time() - start
+        if self.cache:
+            self.cache.store(stage, key, seconds)
+        self.stats[stage.name] = 'ran in %.1fs' % seconds
+        logging.info('Stage %s done in %.1fs' % (stage.name, seconds))
+        return stage.outputs
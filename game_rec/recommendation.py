@@ -8,19 +8,24 @@
     Written by Faye Yan, 2016
 """
 
-import re
 import os
 import sys
 import json
 import yaml
 import logging
 import argparse
+import numpy as np
 
 from datetime import datetime
 from pyspark import SparkContext
+from pyspark.sql import SQLContext
 from pyspark.mllib.recommendation import ALS
 
-sc = SparkContext()
+try:
+    from game_rec.model_store import save_model
+except ImportError:
+    # spark-submit runs this file as a script, with game_rec/ itself on the path
+    from model_store import save_model
 
 
 def proc_args():
@@ -30,6 +35,9 @@ def proc_args():
     args_parser.add_argument('--output_path', '-o', help='Path to output file folder', default='.')
     args_parser.add_argument('--output_format', '-f', help='Format of the output file, currently supported: JSON',
                              choices=['json','xml','html'], default='json')
+    args_parser.add_argument('--timestamp', help='Timestamp of the output file name, the current time by default')
+    args_parser.add_argument('--interactions', help='Path to the interaction dataset of the input file; '
+                                                    'trains implicit ALS on its confidence column')
 
     args,_ = args_parser.parse_known_args()
     return args
@@ -37,7 +45,7 @@ def proc_args():
 
 def parse_raw_string(raw_string):
     user_inventory = json.loads(raw_string)
-    return user_inventory.items()[0]
+    return list(user_inventory.items())[0]
 
 #index user id with incremental numbers, will use the numbers to identify users
 def id_index(x):
@@ -53,11 +61,110 @@ def create_tuple(x):
     else:
         return (index, [])
 
+#training triples of (user index, app id, playtime)
+def flatten_tuple(x):
+    (index, (appid, playtime)) = x
+    return (index, appid, playtime)
+
+#one output line per user: {user_id: [recommended app ids]}
+def format_recommendation(x):
+    (index, (lst_rating, user_id)) = x
+    return json.dumps({user_id: [rating.product for rating in lst_rating]})
+
+#read an id dictionary of the interaction dataset, the line number is the code; it goes through
+#sc.textFile like the user dictionary, so both are numbered the same way and can live on HDFS
+def read_id_dictionary(sc, path):
+    return sc.textFile(path)\
+             .filter(lambda line: line.strip())\
+             .map(lambda line: line.strip())\
+             .collect()
+
+#(user code, app code, confidence) of one interaction dataset row
+def interaction_tuple(row):
+    return (row.user, row.item, row.confidence)
+
+#(code, id) of one line of an id dictionary numbered with zipWithIndex
+def code_id(x):
+    (line, code) = x
+    return (code, line.strip())
+
+#(user code, steam user id) of the users in the interaction dataset; the dictionary holds every user
+#ever seen, so it is read on the executors and joined onto the dataset's own user codes
+def dataset_id_rdd(sc, training_rdd, path_user_dict):
+    user_code_rdd = training_rdd.map(lambda x: (x[0], None)).distinct()
+    return sc.textFile(path_user_dict)\
+             .filter(lambda line: line.strip())\
+             .zipWithIndex()\
+             .map(code_id)\
+             .join(user_code_rdd)\
+             .mapValues(lambda x: x[0])
+
+#like format_recommendation, for models trained on app codes
+def format_coded_recommendation(bc_app_id):
+    def format_line(x):
+        (index, (lst_rating, user_id)) = x
+        return json.dumps({user_id: [int(bc_app_id.value[rating.product]) for rating in lst_rating]})
+    return format_line
+
+def recommend_batch(model, id_rdd, recommend_num, path_recommend_games, format_line=format_recommendation):
+    ''' score every user in one distributed pass and write the output from the executors
+        :param model: trained MatrixFactorizationModel
+        :param id_rdd: (user index, steam user id) pairs
+        :param recommend_num: number of apps per user
+        :param path_recommend_games: output directory, one JSON line per user in the part files
+        :param format_line: formats one (index, (ratings, user id)) pair
+    '''
+    model.recommendProductsForUsers(recommend_num)\
+         .join(id_rdd)\
+         .map(format_line)\
+         .saveAsTextFile(path_recommend_games)
+
+def recommend_per_user(model, id_rdd, recommend_num, path_recommend_games, lst_app_id=None):
+    ''' one recommendProducts job per user, collected on the driver and written as a single JSON file
+        much slower than recommend_batch; kept for small runs that need the single-file output
+        :param lst_app_id: app id of each product code, for models trained on the interaction dataset
+    '''
+    dic_id_index = id_rdd.collectAsMap()
+    dic_recommended = {}
+    for index in dic_id_index.keys():
+        try:
+            lst_recommended = [int(lst_app_id[i.product]) if lst_app_id else i.product
+                               for i in model.recommendProducts(index, recommend_num)]
+        except Exception as e:
+            # users without any playtime are not in the model
+            logging.debug('No recommendation for user index %s: %s' % (index, e))
+            continue
+        dic_recommended.update({dic_id_index.get(index): lst_recommended})
+    with open(path_recommend_games, 'w') as f:
+        json.dump(dic_recommended, f, indent=2)
+
+def save_spark_model(model, id_rdd, config, path_user_inventory, dic_meta, lst_app_id=None):
+    ''' copy the factors of a trained model into the model store, so new users can be folded in later
+        the factors are streamed to the driver one partition at a time
+        :param model: trained MatrixFactorizationModel
+        :param id_rdd: (user index, steam user id) pairs
+        :param dic_meta: how the model was trained, fold-in solves the same problem
+        :param lst_app_id: app id of each product code, for models trained on the interaction dataset
+        :return: version name
+    '''
+    lst_product = sorted(model.productFeatures().collect())
+    lst_user_id = []
+    lst_user_factors = []
+    for index, (features, user_id) in model.userFeatures().join(id_rdd).toLocalIterator():
+        lst_user_id.append(user_id)
+        lst_user_factors.append(features)
+    lst_product_app_id = [int(lst_app_id[product]) if lst_app_id else product for product, _ in lst_product]
+    return save_model(config['model_dir'],
+                      np.asarray(lst_user_factors, dtype=np.float32).reshape(len(lst_user_id), model.rank),
+                      np.asarray([features for _, features in lst_product], dtype=np.float32),
+                      lst_user_id, lst_product_app_id, dict(dic_meta, backend='spark', input=path_user_inventory),
+                      keep=config.get('model_keep'))
+
 def main():
 
-    now = datetime.now().strftime('%Y%m%d-%H%M%S')
     # parse commandline parameters
     args = proc_args()
+    now = args.timestamp or datetime.now().strftime('%Y%m%d-%H%M%S')
     path_user_inventory = args.input_file
     if not os.path.isfile(path_user_inventory):
         logging.exception('Exit. Invalid input file: %s' % path_user_inventory)
@@ -77,38 +184,61 @@ def main():
     # set output file name
     logging.info('Setup output file...')
     path_recommend_games = os.path.join(out_path, config['path_recommend_games'].replace('[timestamp]', now)
-                                                                                .replace('foramt', out_format))
+                                                                                .replace('[format]', out_format))
     
-    # indexing user inventory
-    logging.info('Indexing user inventory by user id...')
-    user_inventory_rdd = sc.textFile(path_user_inventory).map(parse_raw_string).zipWithIndex()
-    # collect (index,user ids)
-    logging.info('Collecting index user ids...')
-    dic_id_index = user_inventory_rdd.map(id_index).collectAsMap()
-    # convert dataframe format
-    logging.info('Converting datafram format...')
-    training_rdd = user_inventory_rdd.map(create_tuple)\
-                                     .flatMapValues(lambda x: x)\
-                                     .map(lambda (index,(appid,time)):(index,appid,time))
-
-    # extract the top 10 recommended games
-    logging.info('Extract the top 10 recommended games...')
-    model = ALS.train(training_rdd, config['model_feature_num'])
-    dic_recommended = {}
-    for index in dic_id_index.keys():
-        try:
-            lst_recommended = [i.product for i in model.recommendProducts(index, config['recommend_num'])]
-            user_id = dic_id_index.get(index)
-            dic_recommended.update({user_id: lst_recommended})
-        except:
-            pass
+    # the context is only created when the Spark backend actually runs
+    sc = SparkContext()
+
+    if args.interactions:
+        # compact dataset: users and apps are already int32 codes of the stable id dictionaries
+        logging.info('Reading interaction dataset %s...' % args.interactions)
+        lst_app_id = read_id_dictionary(sc, os.path.join(config['dict_dir'], 'app_ids.txt'))
+        training_rdd = SQLContext(sc).read.parquet(args.interactions).rdd.map(interaction_tuple).cache()
+        id_rdd = dataset_id_rdd(sc, training_rdd, os.path.join(config['dict_dir'], 'user_ids.txt'))
+        format_line = format_coded_recommendation(sc.broadcast(lst_app_id))
+
+        logging.info('Extract the top %s recommended games...' % config['recommend_num'])
+        # the dataset is built with the playtime transform of the same config
+        dic_meta = {'implicit': True, 'alpha': config.get('alpha', 40.0),
+                    'regularization': config.get('regularization', 0.1), 'iterations': config.get('iterations', 10),
+                    'transform': config.get('playtime_transform', 'log'), 'buckets': config.get('playtime_buckets')}
+        model = ALS.trainImplicit(training_rdd, config['model_feature_num'], iterations=dic_meta['iterations'],
+                                  lambda_=dic_meta['regularization'], alpha=dic_meta['alpha'])
+    else:
+        # indexing user inventory
+        logging.info('Indexing user inventory by user id...')
+        user_inventory_rdd = sc.textFile(path_user_inventory).map(parse_raw_string).zipWithIndex()
+        # (index,user ids) stay distributed, they are joined back onto the recommendations
+        id_rdd = user_inventory_rdd.map(id_index)
+        # convert dataframe format
+        logging.info('Converting datafram format...')
+        training_rdd = user_inventory_rdd.map(create_tuple)\
+                                         .flatMapValues(lambda x: x)\
+                                         .map(flatten_tuple)
+        lst_app_id = None
+        format_line = format_recommendation
+
+        # extract the top 10 recommended games
+        logging.info('Extract the top %s recommended games...' % config['recommend_num'])
+        # ALS.train defaults, fold-in solves the same explicit problem
+        dic_meta = {'implicit': False, 'regularization': 0.01, 'iterations': 5}
+        model = ALS.train(training_rdd, config['model_feature_num'])
+    if config.get('model_dir'):
+        logging.info('Saving model factors to %s...' % config['model_dir'])
+        save_spark_model(model, id_rdd, config, args.interactions or path_user_inventory, dic_meta, lst_app_id)
 
     # create output
-    logging.info('Creating output file: %s' % path_recommend_games)
+    logging.info('Creating output: %s' % path_recommend_games)
     if out_format == 'json':
-        json.dump(dic_recommended, open(path_recommend_games, 'wb'), indent=2)
+        if config.get('scoring_mode', 'batch') == 'batch':
+            recommend_batch(model, id_rdd, config['recommend_num'], path_recommend_games, format_line)
+        else:
+            recommend_per_user(model, id_rdd, config['recommend_num'], path_recommend_games, lst_app_id)
     else:
         #TODO, we can create html page later for web view
         pass
 
-    logging.info('Recommendation Done.')
\ No newline at end of file
+    logging.info('Recommendation Done.')
+
+if __name__ == '__main__':
+    main()
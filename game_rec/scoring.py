@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Top-n scoring from ALS factors
+    Users are scored in memory-bounded blocks with one matrix multiply per block, the top n picked
+    with argpartition, and games the user already owns masked out
+    Written by Faye Yan, 2016
+"""
+
+import numpy as np
+
+# scores kept per block when the block size is picked automatically, ~4 MB of float32 stays in cache
+AUTO_BLOCK_SCORES = 1 << 20
+
+
+def _top_n(scores, n):
+    ''' :return: (columns, scores) of the n best entries per row, best first '''
+    n = min(n, scores.shape[1])
+    if n <= 0:
+        empty = np.zeros((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+    # partition in place order (no negated copy of the scores): the n largest end up in the last n slots
+    top = np.argpartition(scores, scores.shape[1] - n, axis=1)[:, -n:]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def _mask_owned(scores, owned, start, end):
+    # owned is a csr users x apps matrix; its stored entries in rows start:end are knocked out
+    block = owned[start:end]
+    rows = np.repeat(np.arange(end - start), np.diff(block.indptr))
+    scores[rows, block.indices] = -np.inf
+
+
+def auto_block_size(n_items):
+    return max(16, AUTO_BLOCK_SCORES // max(n_items, 1))
+
+def score_blocks(user_factors, item_factors, recommend_num, owned=None, block_size=None):
+    ''' batch API: top-n apps for every user, one block of users at a time
+        memory is bounded by block_size x number of apps scores per block
+        :param user_factors: users x k factors
+        :param item_factors: apps x k factors
+        :param recommend_num: apps per user
+        :param owned: optional csr users x apps matrix of owned games, never recommended
+        :param block_size: users scored per matrix multiply, picked from the number of apps if not given;
+            blocks that fit in cache beat very large ones, since the top-n selection is the bottleneck
+        :return: generator of (first row of the block, app columns, scores), each block_size x n;
+            a column of -1 marks a slot left empty because the user owns nearly every app
+    '''
+    item_factors_t = np.ascontiguousarray(item_factors.T)
+    block_size = block_size or auto_block_size(item_factors.shape[0])
+    for start in range(0, user_factors.shape[0], block_size):
+        end = min(start + block_size, user_factors.shape[0])
+        scores = user_factors[start:end].dot(item_factors_t)
+        if owned is not None:
+            _mask_owned(scores, owned, start, end)
+        top, top_scores = _top_n(scores, recommend_num)
+        top[np.isneginf(top_scores)] = -1
+        yield start, top, top_scores
+
+
+def score_all(user_factors, item_factors, recommend_num, owned=None, block_size=None):
+    ''' batch API: like score_blocks, concatenated into (users x n columns, users x n scores) '''
+    lst_top = []
+    lst_score = []
+    for _, top, top_scores in score_blocks(user_factors, item_factors, recommend_num, owned, block_size):
+        lst_top.append(top)
+        lst_score.append(top_scores)
+    if not lst_top:
+        return np.zeros((0, recommend_num), dtype=np.int64), np.zeros((0, recommend_num))
+    return np.vstack(lst_top), np.vstack(lst_score)
+
+
+def score_user(user_vector, item_factors, recommend_num, owned_items=None):
+    ''' single-user API: top-n apps for one user vector
+        :param user_vector: k factors of the user
+        :param owned_items: app columns the user already owns
+        :return: (app columns, scores), best first
+    '''
+    scores = item_factors.dot(np.asarray(user_vector, dtype=item_factors.dtype))[None, :]
+    if owned_items is not None and len(owned_items):
+        scores[0, np.asarray(owned_items, dtype=np.int64)] = -np.inf
+    top, top_scores = _top_n(scores, recommend_num)
+    keep = ~np.isneginf(top_scores[0])
+    return top[0][keep], top_scores[0][keep]
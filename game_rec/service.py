@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Recommendation HTTP service
+    Loads the latest saved model and the app metadata once and answers GET /recommend/<steamid>?n=
+    from memory. Concurrent requests are scored together in small batches (one matrix multiply per
+    batch), answers are kept in an LRU result cache, and a watcher thread swaps in new model versions
+    as training runs save them, without dropping requests.
+    GET /metrics returns request counts, cache hit rate, batch sizes and p50/p99 latency as JSON.
+    Written by Faye Yan, 2016
+"""
+
+import re
+import json
+import time
+import queue
+import logging
+import threading
+import collections
+import numpy as np
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from game_rec.client import LatencyHistogram
+from game_rec.app_store import app_store_from_config
+from game_rec.scoring import score_blocks
+from game_rec.model_store import load_model, latest_version
+
+# upper bounds of the request latency buckets, in milliseconds; answers from memory take well under 5 ms
+SERVICE_BUCKETS_MS = (0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000, float('inf'))
+
+ROUTE_RECOMMEND = re.compile(r'^/recommend/(\w+)/?$')
+
+
+class _Request(object):
+    ''' one user waiting in the scoring queue '''
+    __slots__ = ('model', 'row', 'n', 'done', 'result')
+
+    def __init__(self, model, row, n):
+        self.model = model
+        self.row = row
+        self.n = n
+        self.done = threading.Event()
+        self.result = None
+
+
+class RecommendService(object):
+    ''' in-memory top-n recommendations from the latest saved model
+        :param model_dir: model store directory written by the training backends
+        :param app_store: optional AppStore, used to add app name, price and image to the answers
+        :param default_n: apps per answer when the request has no n
+        :param max_n: upper limit of n
+        :param cache_size: answers kept in the LRU result cache
+        :param batch_size: most users scored together
+        :param batch_wait_ms: how long the first request of a batch waits for others to join it
+        :param reload_seconds: how often model_dir is checked for a new version, 0 to never reload
+    '''
+    def __init__(self, model_dir, app_store=None, default_n=10, max_n=100, cache_size=100000, batch_size=64,
+                 batch_wait_ms=2, reload_seconds=60):
+        self.model_dir = model_dir
+        self.app_store = app_store
+        self.default_n = default_n
+        self.max_n = max_n
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.reload_seconds = reload_seconds
+        self.model = None
+        self.latency = LatencyHistogram(SERVICE_BUCKETS_MS)
+        self.stats = {'requests': 0, 'not_found': 0, 'cache_hits': 0, 'batches': 0, 'batched_users': 0,
+                      'reloads': 0}
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def load(self, version=None):
+        ''' load a model version and make it the one answering requests
+            requests already being scored finish on the model they started with
+            :return: True if a new version was swapped in
+        '''
+        model = load_model(self.model_dir, version)
+        if model is None:
+            raise ValueError('No saved model in %s, run a training first' % self.model_dir)
+        if self.model is not None and model.version == self.model.version:
+            return False
+        # build the id lookup and fill the app cache before the model takes traffic
+        model.user_row('')
+        if self.app_store is not None:
+            self.app_store.get_apps(model.app_ids.tolist())
+        previous, self.model = self.model, model
+        # cached answers are keyed by version, the old ones simply age out of the LRU
+        logging.info('Serving model version %s (%s users x %s apps)%s' %
+                     (model.version, len(model.user_ids), len(model.app_ids),
+                      ', replacing %s' % previous.version if previous is not None else ''))
+        return True
+
+    def start(self):
+        if self.model is None:
+            self.load()
+        lst_target = [self._score_loop]
+        if self.reload_seconds:
+            lst_target.append(self._reload_loop)
+        for target in lst_target:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _reload_loop(self):
+        while not self._stop.wait(self.reload_seconds):
+            try:
+                version = latest_version(self.model_dir)
+                if version and version != self.model.version and self.load(version):
+                    self.stats['reloads'] += 1
+            except Exception as e:
+                # keep serving the current version
+                logging.exception('Model reload failed: %s' % e)
+
+    def _next_batch(self):
+        request = self._queue.get()
+        if request is None:
+            return []
+        lst_request = [request]
+        deadline = time.time() + self.batch_wait
+        while len(lst_request) < self.batch_size:
+            timeout = deadline - time.time()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            lst_request.append(request)
+        return lst_request
+
+    def _score_loop(self):
+        while not self._stop.is_set():
+            lst_request = self._next_batch()
+            if not lst_request:
+                continue
+            # rows are only valid in the model version they were looked up in, which may have been
+            # swapped out since
+            dic_model = collections.OrderedDict()
+            for request in lst_request:
+                dic_model.setdefault(id(request.model), []).append(request)
+            for lst_same_model in dic_model.values():
+                try:
+                    self._score_batch(lst_same_model[0].model, lst_same_model)
+                except Exception as e:
+                    logging.exception('Scoring failed: %s' % e)
+            for request in lst_request:
+                request.done.set()
+
+    def _score_batch(self, model, lst_request):
+        arr_row = np.asarray([request.row for request in lst_request])
+        owned = model.owned[arr_row] if model.owned is not None else None
+        n = max(request.n for request in lst_request)
+        user_factors = np.asarray(model.user_factors[arr_row])
+        for _, top, _ in score_blocks(user_factors, model.item_factors, n, owned, len(lst_request)):
+            for request, arr_col in zip(lst_request, top):
+                arr_col = arr_col[:request.n]
+                request.result = model.app_ids[arr_col[arr_col >= 0]].tolist()
+        self.stats['batches'] += 1
+        self.stats['batched_users'] += len(lst_request)
+
+    def recommend(self, steamid, n=None):
+        ''' top-n app ids of a user, from the result cache or scored in the next batch
+            :return: (model version, list of app ids), or (model version, None) for users not in the model
+        '''
+        n = max(1, min(int(n or self.default_n), self.max_n))
+        model = self.model
+        key = (model.version, steamid, n)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats['cache_hits'] += 1
+                return model.version, self._cache[key]
+        row = model.user_row(steamid)
+        if row is None:
+            return model.version, None
+        request = _Request(model, row, n)
+        self._queue.put(request)
+        request.done.wait()
+        if request.result is None:
+            raise RuntimeError('Scoring failed for user %s' % steamid)
+        with self._lock:
+            self._cache[key] = request.result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return model.version, request.result
+
+    def handle(self, steamid, n=None):
+        ''' answer of GET /recommend/<steamid>
+            :return: (http status, response dict)
+        '''
+        start = time.time()
+        version, lst_app_id = self.recommend(steamid, n)
+        if lst_app_id is None:
+            status, dic_response = 404, {'steamid': steamid, 'version': version,
+                                         'error': 'user not in the model'}
+        else:
+            if self.app_store is not None:
+                lst_app = self.app_store.enrich({steamid: lst_app_id})[steamid]
+            else:
+                lst_app = [{'steam_appid': app_id} for app_id in lst_app_id]
+            status, dic_response = 200, {'steamid': steamid, 'version': version, 'apps': lst_app}
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['not_found'] += status == 404
+            self.latency.observe((time.time() - start) * 1000)
+        return status, dic_response
+
+    def metrics(self):
+        with self._lock:
+            dic_metrics = dict(self.stats)
+            dic_metrics['latency'] = self.latency.summary()
+        dic_metrics['version'] = self.model.version if self.model is not None else None
+        dic_metrics['cache_size'] = len(self._cache)
+        dic_metrics['cache_hit_rate'] = float(self.stats['cache_hits']) / self.stats['requests'] \
+                                        if self.stats['requests'] else 0.0
+        dic_metrics['mean_batch_size'] = float(self.stats['batched_users']) / self.stats['batches'] \
+                                         if self.stats['batches'] else 0.0
+        return dic_metrics
+
+
+class RecommendHandler(BaseHTTPRequestHandler):
+    ''' routes: GET /recommend/<steamid>?n=, GET /metrics '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        service = self.server.service
+        url = urlsplit(self.path)
+        match = ROUTE_RECOMMEND.match(url.path)
+        n = None
+        if match:
+            n = parse_qs(url.query).get('n', [None])[0]
+            try:
+                n = int(n) if n else None
+            except ValueError:
+                self._send(400, {'error': 'n must be a number'})
+                return
+        try:
+            if match:
+                status, dic_response = service.handle(match.group(1), n)
+            elif url.path == '/metrics':
+                status, dic_response = 200, service.metrics()
+            else:
+                status, dic_response = 404, {'error': 'unknown path'}
+        except Exception as e:
+            logging.exception('Request %s failed: %s' % (self.path, e))
+            status, dic_response = 500, {'error': 'internal error'}
+        self._send(status, dic_response)
+
+    def _send(self, status, dic_response):
+        body = json.dumps(dic_response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('%s %s' % (self.address_string(), format % args))
+
+
+def service_from_config(config_dict):
+    ''' build the service from the recommendation, service and database sections of the config '''
+    config = config_dict.get('service') or {}
+    app_store = None
+    if config.get('enrich', True):
+        app_store = app_store_from_config(config_dict['database'])
+    return RecommendService(config_dict['recommendation']['model_dir'], app_store,
+                            default_n=config_dict['recommendation'].get('recommend_num', 10),
+                            max_n=config.get('max_n', 100),
+                            cache_size=config.get('cache_size', 100000),
+                            batch_size=config.get('batch_size', 64),
+                            batch_wait_ms=config.get('batch_wait_ms', 2),
+                            reload_seconds=config.get('reload_seconds', 60))
+
+
+def serve(config_dict):
+    ''' run the service until interrupted '''
+    config = config_dict.get('service') or {}
+    service = service_from_config(config_dict)
+    service.start()
+    server = ThreadingHTTPServer((config.get('host', '0.0.0.0'), config.get('port', 8080)), RecommendHandler)
+    server.daemon_threads = True
+    server.service = service
+    logging.info('Serving recommendations on http://%s:%s/recommend/<steamid>' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        logging.info('Service stopped: %s' % json.dumps(service.metrics()))
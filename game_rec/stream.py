@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Streaming helpers for the crawler and parser stages
+    Inputs are read lazily line by line or chunk by chunk, so memory stays flat whatever the file size
+    Written by Faye Yan, 2016
+"""
+
+import json
+
+from game_rec.dump import iter_lines
+
+CHUNK_SIZE = 1 << 16
+
+
+def iter_ids(path):
+    ''' lazily read one id per line, skipping blank lines
+        :param path: flat file of ids, e.g. the user id list
+        :return: generator of stripped ids
+    '''
+    with open(path, 'r') as f:
+        for line in f:
+            entity_id = line.strip()
+            if entity_id:
+                yield entity_id
+
+
+def iter_json_lines(path):
+    ''' lazily decode a line-per-record JSON file, e.g. a crawler output, plain or framed dump
+        :return: generator of decoded records
+    '''
+    for line in iter_lines(path):
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_json_object_items(f, chunk_size=CHUNK_SIZE):
+    ''' incrementally decode the (key, value) pairs of one large top-level JSON object
+        only the current value is held in memory, e.g. one app of the steamspy app list.
+        :param f: text file object positioned at the object
+        :return: generator of (key, value)
+    '''
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill(buf, pos):
+        chunk = f.read(chunk_size)
+        return buf[pos:] + chunk, 0, not chunk
+
+    def skip(buf, pos, eof, chars):
+        # skip whitespace and the given separator characters, reading more as needed
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] in chars):
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf, pos, eof
+            buf, pos, eof = fill(buf, pos)
+
+    buf, pos, eof = skip(buf, pos, eof, '')
+    if buf[pos:pos + 1] != '{':
+        raise ValueError('Expected a JSON object')
+    pos += 1
+    while True:
+        buf, pos, eof = skip(buf, pos, eof, ',')
+        if pos >= len(buf):
+            raise ValueError('Unterminated JSON object')
+        if buf[pos] == '}':
+            return
+        lst_token = []
+        for separator in ('', ':'):
+            buf, pos, eof = skip(buf, pos, eof, separator)
+            while True:
+                try:
+                    token, end = decoder.raw_decode(buf, pos)
+                    # a number or literal at the end of the buffer may continue in the next chunk
+                    if end < len(buf) or eof:
+                        break
+                except ValueError:
+                    if eof:
+                        raise
+                buf, pos, eof = fill(buf, pos)
+            lst_token.append(token)
+            pos = end
+        yield lst_token[0], lst_token[1]
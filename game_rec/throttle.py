@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Rate control for the web crawlers
+    Token buckets and sliding windows keep each endpoint within its request budget, and
+    RateController retries throttled or failed requests with exponential backoff
+    Written by Faye Yan, 2016
+"""
+
+import time
+import random
+import asyncio
+import logging
+import requests
+import threading
+import collections
+
+from email.utils import parsedate_to_datetime
+
+from game_rec import metrics
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class TokenBucket(object):
+    ''' token bucket rate limiter
+        tokens refill at `rate` per second up to `capacity`; each request takes one token.
+        Reservations may drive the bucket negative, so concurrent callers queue up fairly
+        instead of all waking at the same time.
+    '''
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        ''' take tokens from the bucket
+            :param tokens: number of tokens to take
+            :return: seconds the caller has to wait before using them
+        '''
+        with self._lock:
+            now = self._clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class SlidingWindowLimiter(object):
+    ''' sliding window rate limiter
+        allows at most `max_calls` calls in any `period` seconds, matching quotas such as
+        "200 calls per 5 min" exactly instead of spreading them out with fixed sleeps.
+    '''
+    def __init__(self, max_calls, period, clock=time.monotonic):
+        self.max_calls = int(max_calls)
+        self.period = float(period)
+        self._clock = clock
+        # start times of the last max_calls calls, including ones reserved in the future
+        self._calls = collections.deque(maxlen=self.max_calls)
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        ''' reserve slots for the next calls
+            :param tokens: number of calls
+            :return: seconds the caller has to wait before making them
+        '''
+        with self._lock:
+            now = self._clock()
+            start = now
+            for _ in range(tokens):
+                start = now
+                if self._calls:
+                    start = max(start, self._calls[-1])
+                    if len(self._calls) == self.max_calls:
+                        start = max(start, self._calls[0] + self.period)
+                self._calls.append(start)
+            return start - now
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+def parse_retry_after(value):
+    ''' parse a Retry-After header, given either in seconds or as an HTTP date
+        :return: seconds to wait, or None if the header is missing or malformed
+    '''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RateController(object):
+    ''' shared rate-control layer for blocking http calls
+        waits on the endpoint limiter before every call, and on HTTP 429/5xx or connection errors
+        backs off exponentially with full jitter, honoring Retry-After when the server sends one.
+        Time spent waiting and working is accumulated in `stats`.
+        With a ResponseCache, fresh responses are served without a call and stale ones are revalidated.
+        Requests go through the CrawlerClient when one is given, plain requests.get otherwise.
+    '''
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, limiter=None, max_retries=3, backoff_base=1.0, backoff_max=300.0, timeout=30, sleep=time.sleep,
+                 cache=None, endpoint=None, client=None):
+        self.limiter = limiter
+        self.client = client
+        self.cache = cache
+        self.endpoint = endpoint
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self._sleep = sleep
+        self.stats = {'calls': 0, 'retries': 0, 'throttled': 0, 'errors': 0,
+                      'wait_seconds': 0.0, 'work_seconds': 0.0}
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _wait(self, seconds):
+        if seconds > 0:
+            self._sleep(seconds)
+            self.stats['wait_seconds'] += seconds
+            metrics.inc('rate_wait_seconds', seconds, endpoint=self.endpoint)
+
+    async def _wait_async(self, seconds):
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+            self.stats['wait_seconds'] += seconds
+            metrics.inc('rate_wait_seconds', seconds, endpoint=self.endpoint)
+
+    def get(self, url, cache_endpoint=None, **kwargs):
+        ''' send a GET request within the rate budget, or answer it from the cache
+            :param url: request url
+            :param cache_endpoint: endpoint name for the cache TTL, defaults to the controller's endpoint
+            :return: the response; after max_retries the last response is returned, or the last error raised
+        '''
+        # streamed bodies are not cached, they would have to be read into memory first
+        if self.cache is None or kwargs.get('stream'):
+            return self._get(url, **kwargs)
+        cached, fresh, dic_condition = self.cache.lookup(url, cache_endpoint or self.endpoint)
+        if fresh:
+            metrics.inc('http_cache_hits', endpoint=cache_endpoint or self.endpoint)
+            return cached
+        if dic_condition:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **dic_condition)
+        r = self._get(url, **kwargs)
+        if r.status_code == 304 and cached is not None:
+            self.cache.touch(url)
+            return cached
+        if r.status_code == 200:
+            self.cache.store(url, r)
+        return r
+
+    def _get(self, url, **kwargs):
+        if self.client is None:
+            kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.max_retries):
+            if self.limiter is not None:
+                self._wait(self.limiter.reserve())
+            start = time.time()
+            try:
+                r = (self.client or requests).get(url, **kwargs)
+            except requests.RequestException as e:
+                self.stats['work_seconds'] += time.time() - start
+                self.stats['errors'] += 1
+                metrics.inc('http_requests', endpoint=self.endpoint, status='error')
+                if attempt == self.max_retries - 1:
+                    raise
+                logging.warning('Request failed (%s/%s) %s: %s' % (attempt + 1, self.max_retries, url, e))
+                self.stats['retries'] += 1
+                metrics.inc('http_retries', endpoint=self.endpoint)
+                self._wait(self.backoff(attempt))
+                continue
+            self.stats['work_seconds'] += time.time() - start
+            self.stats['calls'] += 1
+            metrics.inc('http_requests', endpoint=self.endpoint, status=r.status_code)
+            if r.status_code not in self.RETRY_STATUS or attempt == self.max_retries - 1:
+                return r
+            if r.status_code == 429:
+                self.stats['throttled'] += 1
+            self.stats['retries'] += 1
+            metrics.inc('http_retries', endpoint=self.endpoint)
+            delay = parse_retry_after(r.headers.get('Retry-After'))
+            if delay is None:
+                delay = self.backoff(attempt)
+            logging.warning('HTTP %s from %s, retrying in %.1fs' % (r.status_code, url, delay))
+            self._wait(min(delay, self.backoff_max))
+        return r
+
+    async def get_json_async(self, session, url, **kwargs):
+        ''' asyncio counterpart of get for JSON APIs, with the same limiter, retries and backoff
+            :param session: aiohttp ClientSession
+            :return: the decoded JSON body; an error status outside RETRY_STATUS is raised at once, like the
+                     response get returns without retrying it, and after max_retries the last error is raised
+        '''
+        for attempt in range(self.max_retries):
+            if self.limiter is not None:
+                await self._wait_async(self.limiter.reserve())
+            start = time.time()
+            try:
+                async with session.get(url, **kwargs) as r:
+                    status, retry_after = r.status, r.headers.get('Retry-After')
+                    if status not in self.RETRY_STATUS or attempt == self.max_retries - 1:
+                        r.raise_for_status()
+                        dic_result = await r.json(content_type=None)
+            except aiohttp.ClientResponseError as e:
+                # a 4xx such as 404 will not change on a retry, and a retry status is only raised on the last attempt
+                self.stats['work_seconds'] += time.time() - start
+                self.stats['calls'] += 1
+                metrics.inc('http_requests', endpoint=self.endpoint, status=e.status)
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.stats['work_seconds'] += time.time() - start
+                self.stats['errors'] += 1
+                metrics.inc('http_requests', endpoint=self.endpoint, status='error')
+                if attempt == self.max_retries - 1:
+                    raise
+                logging.warning('Request failed (%s/%s) %s: %s' % (attempt + 1, self.max_retries, url, e))
+                self.stats['retries'] += 1
+                metrics.inc('http_retries', endpoint=self.endpoint)
+                await self._wait_async(self.backoff(attempt))
+                continue
+            self.stats['work_seconds'] += time.time() - start
+            self.stats['calls'] += 1
+            metrics.inc('http_requests', endpoint=self.endpoint, status=status)
+            if self.client is not None:
+                self.client.record(url, time.time() - start)
+            if status not in self.RETRY_STATUS:
+                return dic_result
+            if status == 429:
+                self.stats['throttled'] += 1
+            self.stats['retries'] += 1
+            metrics.inc('http_retries', endpoint=self.endpoint)
+            delay = parse_retry_after(retry_after)
+            if delay is None:
+                delay = self.backoff(attempt)
+            logging.warning('HTTP %s from %s, retrying in %.1fs' % (status, url, delay))
+            await self._wait_async(min(delay, self.backoff_max))
+
+
+def limiter_from_config(config_dict, endpoint):
+    ''' build the limiter of an endpoint from the crawler config
+        `rate`/`capacity` gives a token bucket, `max_calls`/`period` gives a sliding window
+        :param config_dict: crawler section of the config
+        :param endpoint: key under `rate_limit`, e.g. inventory
+        :return: TokenBucket or SlidingWindowLimiter, or None if the endpoint is not rate limited
+    '''
+    dic_limit = (config_dict.get('rate_limit') or {}).get(endpoint)
+    if not dic_limit:
+        return None
+    if dic_limit.get('max_calls'):
+        return SlidingWindowLimiter(dic_limit['max_calls'], dic_limit.get('period', 1))
+    if dic_limit.get('rate'):
+        return TokenBucket(dic_limit['rate'], dic_limit.get('capacity'))
+    return None
+
+
+def controller_from_config(config_dict, endpoint, repeat=3, cache=None, client=None):
+    ''' build the RateController of an endpoint from the crawler config
+        :param cache: optional ResponseCache shared by the controllers
+        :param client: optional CrawlerClient shared by the controllers
+    '''
+    dic_backoff = config_dict.get('backoff') or {}
+    return RateController(limiter_from_config(config_dict, endpoint), max_retries=repeat,
+                          backoff_base=dic_backoff.get('base', 1.0), backoff_max=dic_backoff.get('max', 300.0),
+                          timeout=config_dict.get('timeout', 30), cache=cache, endpoint=endpoint,
+                          client=client)
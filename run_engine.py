@@ -16,31 +16,222 @@ import argparse
 from logging import config
 from datetime import datetime
 from subprocess import Popen, PIPE, STDOUT
+from sqlalchemy.engine import make_url
 
-from game_rec.crawler import get_inventory_for_user, get_app_details, get_game_page
+from game_rec import metrics
+from game_rec.client import client_from_config
+from game_rec.throttle import controller_from_config
+from game_rec.crawler import get_inventory_for_user, get_inventory_for_user_async, get_app_list, read_app_list, \
+                             get_app_details, get_game_page, crawl_apps_streaming, get_inventory_sharded, \
+                             merge_inventory_shards
+from game_rec.pipeline import Stage, StageCache, Pipeline
+from game_rec.als_local import recommend_local
+from game_rec.interactions import build_interactions
 from game_rec.database import parse_app_info, parse_app_steamspy, merge_dfs, save_to_db
+from game_rec.service import serve
 
 def proc_args():
     args_parser = argparse.ArgumentParser(description="Game Recommendation Engine")
-    args_parser.add_argument('input_file', help='Path to user id file')
+    args_parser.add_argument('input_file', help="Path to user id file, or 'serve' to run the recommendation service")
     args_parser.add_argument('--config', '-c', help='Path to config file', default='conf/config.yml')
     args_parser.add_argument('--output_path', '-o', help='Path to output file folder', default='out/')
     args_parser.add_argument('--output_format', '-f', help='Format of the output file, currently supported: JSON',
                              choices=['json','xml','html'], default='json')
+    args_parser.add_argument('--resume', help='Timestamp of a previous run to resume, e.g. 20160501-120000')
+    args_parser.add_argument('--from-stage', dest='from_stage',
+                             help='Rerun from this stage, reusing the cached outputs of the stages before it')
+    args_parser.add_argument('--until-stage', dest='until_stage', help='Stop after this stage')
 
     args,_ = args_parser.parse_known_args()
     return args
 
-def spark_submit(script, args):
-    command = Popen(["/usr/hdp/current/spark-client/bin/spark-submit", "--num-executors", "5",
-                     "--master", "yarn", script] + args)
+def spark_submit(script, args, config):
+    command = Popen([config.get('spark_submit', '/usr/hdp/current/spark-client/bin/spark-submit'),
+                     "--num-executors", str(config.get('num_executors', 5)),
+                     "--master", config.get('spark_master', 'yarn'), script] + args)
     return command.wait()
 
+def build_stages(config_dict, args, out_path, out_format, now, resume):
+    ''' the engine's stages and the artifacts they pass to each other
+        step 1 crawls, step 2 parses and saves the crawler outputs, step 3 generates the top n game
+        recommendations for each user, with ALS on Spark or on this node
+        :return: (list of Stage, dict of source artifacts, shared CrawlerClient)
+    '''
+    logger = logging.getLogger()
+    config_crawler = config_dict['crawler']
+    config_db = config_dict['database']
+    config_rec = config_dict['recommendation']
+    config_pipeline = config_dict.get('pipeline') or {}
+    # crawls of live data are only reused for a while
+    crawl_max_age = config_pipeline.get('crawl_max_age_hours', 24) * 3600
+    # stage artifacts of the database step are written as csv or Parquet
+    db_format = config_db.get('output_format', 'csv')
+
+    def path_of(config, key, file_format=None):
+        path = os.path.join(out_path, config[key].replace('[timestamp]', now))
+        return path.replace('[format]', file_format) if file_format else path
+
+    # one pooled http client shared by all crawlers
+    client = client_from_config(config_crawler)
+    repeat = config_crawler['repeat_num']
+    dic_crawl_params = dict((key, config_crawler[key]) for key in ('base_url', 'steamspy_url', 'steampower_url',
+                                                                  'steamspy_app'))
+    # the dump format of the app outputs changes their bytes, so it is part of their cache key
+    dic_app_crawl_params = dict(dic_crawl_params, dump_compression=config_crawler.get('dump_compression'))
+
+    ######################
+    # step 1: run crawlers
+    # step 1.1: get game inventory of each steam user id
+    def crawl_inventory(dic_artifact):
+        if config_crawler.get('inventory_mode') == 'async':
+            total_ct = get_inventory_for_user_async(dic_artifact['user_id'], dic_artifact['user_inventory'],
+                                                    config_crawler, repeat=repeat, resume=resume, client=client)
+        else:
+            total_ct = get_inventory_for_user(dic_artifact['user_id'], dic_artifact['user_inventory'],
+                                              config_crawler, repeat=repeat, resume=resume, client=client)
+        logger.info('  ...processed %s steam user ids.' % total_ct)
+
+    # step 1.1, sharded: one worker process per API key, then the shard outputs are joined into one inventory
+    def crawl_inventory_sharded(dic_artifact):
+        total_ct = get_inventory_sharded(dic_artifact['user_id'], dic_artifact['inventory_shards'], config_crawler,
+                                         repeat=repeat, resume=resume)
+        logger.info('  ...processed %s steam user ids.' % total_ct)
+
+    def merge_inventory(dic_artifact):
+        total_ct = merge_inventory_shards(dic_artifact['inventory_shards'], dic_artifact['user_inventory'],
+                                          len(config_crawler['keys']))
+        logger.info('  ...merged the inventories of %s steam user ids.' % total_ct)
+
+    # step 1.2: get the steamspy app list, then the details of each app
+    def crawl_app_list(dic_artifact):
+        if not (resume and os.path.isfile(dic_artifact['app_user'])):
+            get_app_list(dic_artifact['app_user'], config_crawler,
+                         controller_from_config(config_crawler, 'app_details', repeat, client=client))
+
+    def crawl_app_details(dic_artifact):
+        lst_app_id = get_app_details(dic_artifact['app_info'], dic_artifact['app_user'], config_crawler,
+                                     repeat=repeat, resume=resume, client=client, fetch_list=False)
+        logger.info('  ...returned %s app ids.' % len(lst_app_id))
+
+    # step 1.3: get game's steamSpy page, only needs the app list so it runs alongside the app details
+    def crawl_game_page(dic_artifact):
+        get_game_page(read_app_list(dic_artifact['app_user']), dic_artifact['app_steamspy'], config_crawler,
+                      repeat=repeat, resume=resume, client=client)
+
+    # steps 1.2 and 1.3 as one streaming stage: both endpoints are fed from the app list as it downloads
+    def crawl_apps(dic_artifact):
+        lst_app_id = crawl_apps_streaming(dic_artifact['app_user'], dic_artifact['app_info'],
+                                          dic_artifact['app_steamspy'], config_crawler, repeat=repeat, resume=resume,
+                                          client=client)
+        logger.info('  ...returned %s app ids.' % len(lst_app_id))
+
+    ########################################
+    # step 2: parse and save crawler outputs
+    # step 2.1: parse app info
+    def parse_info(dic_artifact):
+        parse_app_info(dic_artifact['app_info'], dic_artifact['steam_app_info'])
+
+    # step 2.2: parse app steamspy, independent of 2.1
+    def parse_steamspy(dic_artifact):
+        parse_app_steamspy(dic_artifact['app_steamspy'], dic_artifact['steam_app_tag'],
+                           workers=config_db.get('parse_workers', 1), mode=config_db.get('tag_parser', 'soup'))
+
+    # step 2.3: merge dataframes
+    def merge(dic_artifact):
+        merge_dfs(dic_artifact['steam_app_tag'], dic_artifact['steam_app_info'], dic_artifact['master_app_info'])
+
+    # step 2.4: save steam app info to MySQL
+    def save(dic_artifact):
+        logger.info('  ...saved %s apps to DB.' % save_to_db(dic_artifact['steam_app_info'], config_db))
+
+    #####################################################################################
+    # step 3: generate top n game recommendations for each user
+    # step 3.1: compact interaction dataset with stable user and app codes
+    def interactions(dic_artifact):
+        dic_count = build_interactions(dic_artifact['user_inventory'], dic_artifact['interactions'],
+                                       config_rec['dict_dir'], config_rec.get('playtime_transform', 'log'),
+                                       config_rec.get('playtime_buckets'))
+        logger.info('  ...%s interactions of %s users on %s apps.' %
+                    (dic_count['rows'], dic_count['users'], dic_count['apps']))
+
+    # step 3.2: train and score
+    def recommend(dic_artifact):
+        path_interactions = dic_artifact.get('interactions')
+        if config_rec.get('backend', 'spark') == 'local':
+            total_ct = recommend_local(dic_artifact['user_inventory'], dic_artifact['recommend_games'], config_rec,
+                                       path_interactions)
+            logger.info('  ...recommended games for %s users.' % total_ct)
+        else:
+            exit_code = spark_submit('game_rec/recommendation.py',
+                                     [dic_artifact['user_inventory'], '-c', args.config, '-o', args.output_path,
+                                      '-f', args.output_format, '--timestamp', now] +
+                                     (['--interactions', path_interactions] if path_interactions else []),
+                                     config_rec)
+            if exit_code != 0:
+                raise RuntimeError('Recommendation generation failed w/ exit_code {}'.format(exit_code))
+
+    lst_stage = [Stage('inventory', crawl_inventory, ['user_id'],
+                       {'user_inventory': path_of(config_crawler, 'path_user_inventory')},
+                       dict(dic_crawl_params, mode=config_crawler.get('inventory_mode')), crawl_max_age),
+                 Stage('parse_app_info', parse_info, ['app_info'],
+                       {'steam_app_info': path_of(config_db, 'path_steam_app_info', db_format)}),
+                 Stage('parse_app_steamspy', parse_steamspy, ['app_steamspy'],
+                       {'steam_app_tag': path_of(config_db, 'path_steam_app_tag', db_format)},
+                       {'tag_parser': config_db.get('tag_parser', 'soup')}),
+                 Stage('merge', merge, ['steam_app_tag', 'steam_app_info'],
+                       {'master_app_info': path_of(config_db, 'path_master_app_info', db_format)}),
+                 # the password stays out of the stage params; changing the database still reruns the load
+                 Stage('save_db', save, ['steam_app_info'],
+                       params={'db_conn': make_url(config_db['db_conn']).render_as_string(hide_password=True)})]
+    if config_crawler.get('keys'):
+        path_user_inventory = path_of(config_crawler, 'path_user_inventory')
+        # the keys themselves are left out of the cache key, only their number changes the shards
+        lst_stage[0:1] = [Stage('inventory', crawl_inventory_sharded, ['user_id'],
+                                {'inventory_shards': path_user_inventory + '.shards'},
+                                dict(dic_crawl_params, mode=config_crawler.get('inventory_mode'),
+                                     shards=len(config_crawler['keys'])), crawl_max_age),
+                          Stage('inventory_merge', merge_inventory, ['inventory_shards'],
+                                {'user_inventory': path_user_inventory})]
+    if config_crawler.get('app_crawl_mode') == 'stream':
+        lst_stage[1:1] = [Stage('app_crawl', crawl_apps, [],
+                                {'app_user': path_of(config_crawler, 'path_app_user'),
+                                 'app_info': path_of(config_crawler, 'path_app_info'),
+                                 'app_steamspy': path_of(config_crawler, 'path_app_steamspy')},
+                                dic_app_crawl_params, crawl_max_age)]
+    else:
+        lst_stage[1:1] = [Stage('app_list', crawl_app_list, [], {'app_user': path_of(config_crawler, 'path_app_user')},
+                                dic_crawl_params, crawl_max_age),
+                          Stage('app_details', crawl_app_details, ['app_user'],
+                                {'app_info': path_of(config_crawler, 'path_app_info')}, dic_app_crawl_params,
+                                crawl_max_age),
+                          Stage('steamspy_page', crawl_game_page, ['app_user'],
+                                {'app_steamspy': path_of(config_crawler, 'path_app_steamspy')}, dic_app_crawl_params,
+                                crawl_max_age)]
+    lst_input = ['user_inventory']
+    if config_rec.get('path_interactions'):
+        lst_stage.append(Stage('interactions', interactions, ['user_inventory'],
+                               {'interactions': path_of(config_rec, 'path_interactions')},
+                               dict((key, config_rec.get(key)) for key in ('dict_dir', 'playtime_transform',
+                                                                            'playtime_buckets'))))
+        lst_input.append('interactions')
+    lst_stage.append(Stage('recommend', recommend, lst_input,
+                           {'recommend_games': path_of(config_rec, 'path_recommend_games', out_format)},
+                           dict((key, value) for key, value in config_rec.items() if not key.startswith('path_'))))
+    return lst_stage, {'user_id': args.input_file}, client
+
 def main():
 
-    now = datetime.now().strftime('%Y%m%d-%H%M%S')
     # parse commandline parameters
     args = proc_args()
+    if args.input_file == 'serve':
+        # long-running service mode, answers from the latest saved model instead of running the pipeline
+        config_dict = yaml.safe_load(open(args.config))
+        logging.config.dictConfig(config_dict['log'])
+        serve(config_dict)
+        return
+    # a resumed run reuses the timestamp, and so the output files, of the run it continues
+    resume = args.resume is not None
+    now = args.resume if resume else datetime.now().strftime('%Y%m%d-%H%M%S')
     path_user_id = args.input_file
     if not os.path.isfile(path_user_id):
         logging.exception('Exit. Invalid input file.')
@@ -52,72 +243,38 @@ def main():
         out_format = 'json'
 
     # parse config
-    config_dict = yaml.load(open(args.config))
+    config_dict = yaml.safe_load(open(args.config))
 
     # setup logger
     logging.config.dictConfig(config_dict['log'])
     logger = logging.getLogger()
 
-    ######################
-    # step 1: run crawlers
-    config = config_dict['crawler']
-    # setup output files
-    path_user_inventory = os.path.join(out_path, config['path_user_inventory'].replace('[timestamp]', now))
-    path_app_user = os.path.join(out_path, config['path_app_user'].replace('[timestamp]', now))
-    path_app_info = os.path.join(out_path, config['path_app_info'].replace('[timestamp]', now))
-    path_app_steamspy = os.path.join(out_path, config['path_app_steamspy'].replace('[timestamp]', now))
-
-    # step 1.1: get game inventory of each steam user id
-    logger.info('Getting game inventory of each steam user id...')
-    total_ct = get_inventory_for_user(path_user_id, path_user_inventory, config)
-    logger.info('  ...processed %s steam user ids.' % total_ct)
-
-    # step 1.2: get app details
-    logger.info('Getting game app details...')
-    lst_app_id = get_app_details(path_app_info, path_app_user, config, repeat=config['repeat_num'])
-    logger.info('  ...returned %s app ids.' % len(lst_app_id))
-
-    # step 1.3: get game's steamSpy page
-    logger.info('Getting game page...')
-    get_game_page(lst_app_id, path_app_steamspy, config, repeat=config['repeat_num'])
-    logger.info('Crawler Done.')
-
-    ########################################
-    # step 2: parse and save crawler outputs
-    config = config_dict['database']
-    # setup output files
-    path_steam_app_info = os.path.join(out_path, config['path_steam_app_info'].replace('[timestamp]', now))
-    path_steam_app_tag = os.path.join(out_path, config['path_steam_app_tag'].replace('[timestamp]', now))
-    path_master_app_info = os.path.join(out_path, config['path_master_app_info'].replace('[timestamp]', now))
-
-    # step 2.1: parse app info
-    logger.info('Parsing app info: %s' % path_app_info)
-    df_steam_app = parse_app_info(path_app_info, path_steam_app_info)
-    logger.info('Steam app info file created.')
-
-    # step 2.2: parse app steamspy
-    logger.info('Parsing app steamspy: %s' % path_app_steamspy)
-    df_app_tag = parse_app_steamspy(path_app_steamspy, path_steam_app_tag)
-    logger.info('Steam app steamSpy file created.')
-
-    # step 2.3: merge dataframes
-    logger.info('Merging dataframes...')
-    merge_dfs(df_app_tag, df_steam_app, path_master_app_info)
-    logger.info('Dataframes merged.')
-
-    # step 2.4: save steam app info to MySQL
-    logger.info('Saving steam app info to DB...')
-    save_to_db(path_steam_app_info, config)
-    logger.info('Save to MySQL Done.')
-
-    #####################################################################################
-    # step 3: generate top 5 game recommendations for each user, using pySpark ALS module 
-    logger.info('Utilizing Spark to generate list of top recommendations...')
-    exit_code = spark_submit('game_rec/recommendation.py',
-                             [path_user_inventory, '-c', args.config, '-o', args.output_path, '-f', args.output_format])
-    if exit_code != 0:
-        logger.exception('Recommendation generation failed w/ exit_code {}'.format(exit_code))
+    config_metrics = config_dict.get('metrics') or {}
+    path_profile = config_metrics.get('profile_dir', 'profile_[timestamp]').replace('[timestamp]', now)
+    metrics.configure(config_metrics.get('profile_stages'), config_metrics.get('trace_memory_stages'),
+                      os.path.join(out_path, path_profile))
+    metrics.start_sampler(config_metrics.get('sample_seconds', 5))
 
+    config_pipeline = config_dict.get('pipeline') or {}
+    lst_stage, dic_source, client = build_stages(config_dict, args, out_path, out_format, now, resume)
+    cache = StageCache(config_pipeline['cache_path']) if config_pipeline.get('cache_path') else None
+    pipeline = Pipeline(lst_stage, dic_source, cache, workers=config_pipeline.get('workers', 4))
+    try:
+        pipeline.run(from_stage=args.from_stage, until_stage=args.until_stage)
+    finally:
+        for host, dic_latency in client.latency_summary().items():
+            logger.info('  ...%s: %s requests, mean %.0f ms, p50 <= %s ms, p99 <= %s ms' %
+                        (host, dic_latency['count'], dic_latency['mean_ms'], dic_latency['p50_ms'],
+                         dic_latency['p99_ms']))
+        client.close()
+        for name, status in pipeline.stats.items():
+            logger.info('  ...stage %s: %s' % (name, status))
+        # the report is written for failed runs too, they are the ones worth looking at
+        metrics.stop_sampler()
+        path_report = config_metrics.get('path_report', 'metrics_[timestamp]').replace('[timestamp]', now)
+        path_metrics = os.path.join(out_path, path_report)
+        metrics.write(path_metrics + '.json', path_metrics + '.prom')
+        logger.info('  ...metrics: %s.json, %s.prom' % (path_metrics, path_metrics))
     logger.info('Done.')
 
 
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import numpy as np
+import scipy.sparse
+import pytest
+
+from game_rec.als_local import train_als, fold_in, confidence_matrix, recommend_local
+from game_rec.interactions import build_interactions, load_interactions
+from game_rec.model_store import ALSModel, load_model
+
+
+def _playtime(users=60, apps=25, seed=0):
+    rnd = np.random.RandomState(seed)
+    playtime = scipy.sparse.random(users, apps, density=0.2, random_state=rnd, format='lil') * 500
+    # one app played by everyone, the row the item side cannot split into blocks
+    playtime[:, 3] = 120
+    return playtime.tocsr()
+
+
+def _write_inventory(path, dic_inventory):
+    with open(path, 'w') as f:
+        for user_id, lst_app in dic_inventory.items():
+            f.write(json.dumps({user_id: [{'appid': app_id, 'playtime_forever': minutes}
+                                          for app_id, minutes in lst_app]}) + '\n')
+
+
+def test_entry_chunks_do_not_change_the_factors():
+    playtime = _playtime()
+    user_whole, item_whole = train_als(playtime, factors=4, iterations=2, threads=1, nnz_per_block=100000)
+    user_chunked, item_chunked = train_als(playtime, factors=4, iterations=2, threads=2, nnz_per_block=7)
+    np.testing.assert_allclose(user_chunked, user_whole, rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(item_chunked, item_whole, rtol=1e-4, atol=1e-6)
+
+
+@pytest.mark.parametrize('backend', ['local', 'spark'])
+def test_fold_in_solves_the_trainers_problem(backend):
+    playtime = _playtime()
+    item_factors = np.random.RandomState(1).rand(playtime.shape[1], 3)
+    model = ALSModel('v', None, item_factors, [], np.arange(playtime.shape[1]),
+                     {'backend': backend, 'implicit': True, 'regularization': 0.5, 'alpha': 40.0, 'transform': 'log'})
+    user_factors = fold_in(playtime, model, threads=1)
+    confidence = confidence_matrix(playtime, 40.0, 'log')
+    row = confidence[5]
+    factors = item_factors[row.indices]
+    # Spark's trainImplicit scales the regularization by the user's entries
+    regularization = 0.5 * (row.nnz if backend == 'spark' else 1)
+    lhs = item_factors.T.dot(item_factors) + (factors * row.data[:, None]).T.dot(factors) + \
+          regularization * np.eye(3)
+    rhs = factors.T.dot(1.0 + row.data)
+    np.testing.assert_allclose(user_factors[5], np.linalg.solve(lhs, rhs), rtol=1e-4)
+
+
+def test_users_without_playtime_are_not_saved(tmp_path):
+    dic_inventory = dict(('u%s' % i, [(10 + i % 5, 60), (20 + i % 3, 30)]) for i in range(20))
+    dic_inventory['idle'] = [(10, 0)]
+    _write_inventory(str(tmp_path / 'inventory.txt'), dic_inventory)
+    config = {'model_feature_num': 3, 'recommend_num': 2, 'iterations': 2, 'model_dir': str(tmp_path / 'models')}
+    assert recommend_local(str(tmp_path / 'inventory.txt'), str(tmp_path / 'out'), config) == 20
+    model = load_model(str(tmp_path / 'models'))
+    assert 'idle' not in model.user_ids.tolist()
+    assert model.owned.shape[0] == len(model.user_ids)
+
+
+def test_interactions_hold_only_the_datasets_users(tmp_path):
+    dict_dir = str(tmp_path / 'dict')
+    _write_inventory(str(tmp_path / 'old.txt'), {'old': [(1, 10), (2, 20)]})
+    _write_inventory(str(tmp_path / 'new.txt'), {'new1': [(2, 30), (3, 40)], 'new2': [(3, 50)]})
+    build_interactions(str(tmp_path / 'old.txt'), str(tmp_path / 'old.parquet'), dict_dir, transform='raw')
+    build_interactions(str(tmp_path / 'new.txt'), str(tmp_path / 'new.parquet'), dict_dir, transform='raw')
+    playtime, lst_user_id, arr_app_id = load_interactions(str(tmp_path / 'new.parquet'), dict_dir)
+    assert lst_user_id == ['new1', 'new2']
+    assert arr_app_id.tolist() == [2, 3]
+    assert playtime.toarray().tolist() == [[30, 40], [0, 50]]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from game_rec.checkpoint import CheckpointJournal, BatchWriter, open_checkpoint
+from game_rec.dump import iter_lines
+
+
+def _line(entity_id):
+    return json.dumps({entity_id: int(entity_id)}) + '\n'
+
+
+def _keys(path):
+    return [list(json.loads(line))[0] for line in iter_lines(path)]
+
+
+def test_journal_last_status_wins(tmp_path):
+    path = str(tmp_path / 'out.txt.ckpt')
+    with CheckpointJournal(path) as journal:
+        journal.mark_failed('1')
+        journal.mark_done('1')
+        journal.mark_failed('2')
+    journal = CheckpointJournal(path, resume=True)
+    assert '1' in journal
+    assert '2' not in journal
+    assert list(journal.pending(['1', '2', '3'])) == ['2', '3']
+    journal.close()
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_resume_fetches_only_what_is_missing(tmp_path, compression):
+    path = str(tmp_path / 'out.txt')
+    journal, f = open_checkpoint(path, compression=compression)
+    with journal, f, BatchWriter(f, journal, batch_size=2) as writer:
+        for i in range(5):
+            writer.write(str(i), _line(str(i)))
+    journal, f = open_checkpoint(path, resume=True, compression=compression)
+    with journal, f, BatchWriter(f, journal, batch_size=2) as writer:
+        lst_todo = list(journal.pending(str(i) for i in range(8)))
+        for entity_id in lst_todo:
+            writer.write(entity_id, _line(entity_id))
+    assert lst_todo == ['5', '6', '7']
+    assert _keys(path) == [str(i) for i in range(8)]
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_crash_between_flush_and_journal_does_not_duplicate(tmp_path, compression):
+    path = str(tmp_path / 'out.txt')
+    journal, f = open_checkpoint(path, compression=compression)
+    writer = BatchWriter(f, journal, batch_size=2)
+    for i in range(4):
+        writer.write(str(i), _line(str(i)))
+    # the next batch reaches the output, then the process dies before journaling it
+    journal.mark_done_many = lambda lst_entity_id, output_size=None: None
+    writer.write('4', _line('4'))
+    writer.write('5', _line('5'))
+    journal.close()
+    f.close()
+
+    journal, f = open_checkpoint(path, resume=True, compression=compression)
+    with journal, f, BatchWriter(f, journal, batch_size=2) as writer:
+        lst_todo = list(journal.pending(str(i) for i in range(6)))
+        for entity_id in lst_todo:
+            writer.write(entity_id, _line(entity_id))
+    assert lst_todo == ['4', '5']
+    assert _keys(path) == [str(i) for i in range(6)]
+
+
+def test_done_ids_without_their_batch_end_are_dropped(tmp_path):
+    path = str(tmp_path / 'out.txt')
+    journal, f = open_checkpoint(path)
+    with journal, f, BatchWriter(f, journal, batch_size=2) as writer:
+        writer.write('0', _line('0'))
+        writer.write('1', _line('1'))
+    # a crash while journaling a batch: its done line is written, its end line is not
+    with open(path + '.ckpt', 'a') as f_journal:
+        f_journal.write('done\t2\n')
+    journal = CheckpointJournal(path + '.ckpt', resume=True)
+    assert '1' in journal
+    assert '2' not in journal
+    journal.close()
+
+
+def test_plain_resume_drops_a_torn_last_line(tmp_path):
+    path = str(tmp_path / 'out.txt')
+    with open(path, 'w') as f:
+        f.write(_line('0') + '{"1": ')
+    with open(path + '.ckpt', 'w') as f:
+        f.write('done\t0\n')
+    journal, f = open_checkpoint(path, resume=True)
+    journal.close()
+    f.close()
+    with open(path) as f:
+        assert f.read() == _line('0')
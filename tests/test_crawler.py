@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+import requests
+
+from game_rec import crawler
+from game_rec.crawler import _fetch_app_detail, _fetch_game_page, crawl_apps_streaming, get_inventory_for_user, \
+    shard_of, shard_paths, split_user_ids, merge_inventory_shards
+
+
+class FakeController(object):
+    ''' stands in for the RateController of an endpoint, answering with one canned response '''
+    def __init__(self, status_code, text):
+        self.r = requests.Response()
+        self.r.status_code = status_code
+        self.r._content = text.encode('utf-8')
+        self.r.encoding = 'utf-8'
+
+    def get(self, url):
+        return self.r
+
+
+class FakeClient(object):
+    ''' answers the inventory calls of each user id from a list of (status, body) '''
+    def __init__(self, dic_response):
+        self.dic_response = dict((user_id, list(lst_response)) for user_id, lst_response in dic_response.items())
+
+    def get(self, url, params=None, **kwargs):
+        status_code, body = self.dic_response[params['steamid']].pop(0)
+        r = FakeController(status_code, json.dumps(body)).r
+        r.headers['Retry-After'] = '0'
+        return r
+
+
+CONFIG = {'steampower_url': 'http://store/api/appdetails?appids=[app_id]', 'steamspy_app': 'http://spy/app/[app_id]'}
+
+
+def _write_shards(path_shard_dir, lst_user_id, shards):
+    path_shard_dir.mkdir(exist_ok=True)
+    for _, path_inventory in shard_paths(str(path_shard_dir), shards):
+        open(path_inventory, 'w').close()
+    for user_id in lst_user_id:
+        with open(shard_paths(str(path_shard_dir), shards)[shard_of(user_id, shards)][1], 'a') as f:
+            f.write(json.dumps({user_id: []}) + '\n')
+
+
+@pytest.mark.parametrize('fetch', [_fetch_app_detail, _fetch_game_page])
+def test_error_pages_are_not_written(fetch):
+    # the controller hands back the last 429/5xx once its retries are spent
+    assert fetch(FakeController(503, '{"error": "busy"}'), CONFIG, '10') is None
+    assert fetch(FakeController(429, '<html>slow down</html>'), CONFIG, '10') is None
+
+
+def test_pages_are_written_as_one_line_per_app():
+    assert json.loads(_fetch_game_page(FakeController(200, '<html>ok</html>'), CONFIG, '10')) == \
+           {'10': '<html>ok</html>'}
+    assert json.loads(_fetch_app_detail(FakeController(200, '{"10": {"success": true}}'), CONFIG, '10')) == \
+           {'10': {'success': True}}
+
+
+def test_streaming_crawl_raises_a_consumer_error(tmp_path, monkeypatch):
+    path_app_user = str(tmp_path / 'app_user.json')
+    with open(path_app_user, 'w') as f:
+        json.dump(dict((str(app_id), {}) for app_id in range(200)), f)
+
+    def fetch_page(rate_controller, config_dict, app_id):
+        if app_id == '50':
+            raise RuntimeError('parser bug')
+        return json.dumps({app_id: ''}) + '\n'
+    monkeypatch.setattr(crawler, '_fetch_app_detail', lambda rate_controller, config_dict, app_id:
+                        json.dumps({app_id: {}}) + '\n')
+    monkeypatch.setattr(crawler, '_fetch_game_page', fetch_page)
+    # a queue far smaller than the list: without the stop event the list reader would block forever
+    with pytest.raises(RuntimeError, match='parser bug'):
+        crawl_apps_streaming(path_app_user, str(tmp_path / 'app_info.txt'), str(tmp_path / 'app_steamspy.txt'),
+                             {'write_batch': 10}, resume=True, queue_size=2)
+
+
+def test_inventory_crawl_retries_and_journals_failures(tmp_path):
+    path_user_id = str(tmp_path / 'user_id.txt')
+    with open(path_user_id, 'w') as f:
+        f.write('1\n2\n3\n')
+    games = {'response': {'games': [{'appid': 10, 'playtime_forever': 5}]}}
+    client = FakeClient({'1': [(429, {}), (200, games)],
+                         '2': [(503, {}), (503, {})],
+                         '3': [(403, {}), (200, games)]})
+    config = {'base_url': 'http://api/inventory', 'key': 'k', 'backoff': {'base': 0}}
+    path_user_inventory = str(tmp_path / 'user_inventory.txt')
+    assert get_inventory_for_user(path_user_id, path_user_inventory, config, repeat=2, client=client) == 3
+    with open(path_user_inventory) as f:
+        assert [json.loads(line) for line in f] == [{'1': games['response']['games']}]
+    # 403 is not retried
+    assert client.dic_response['3'] == [(200, games)]
+
+
+def test_split_puts_each_user_in_one_shard(tmp_path):
+    path_user_id = str(tmp_path / 'user_id.txt')
+    with open(path_user_id, 'w') as f:
+        f.write(''.join('%s\n' % (76561197960265728 + i) for i in range(100)))
+    lst_path = [path_id for path_id, _ in shard_paths(str(tmp_path), 3)]
+    split_user_ids(path_user_id, lst_path)
+    lst_shard = [open(path).read().split() for path in lst_path]
+    assert sorted(sum(lst_shard, [])) == open(path_user_id).read().split()
+    assert all(shard_of(user_id, 3) == i for i, lst_user_id in enumerate(lst_shard) for user_id in lst_user_id)
+
+
+def test_merge_ignores_shards_of_an_earlier_key_count(tmp_path):
+    lst_user_id = [str(76561197960265728 + i) for i in range(50)]
+    path_shard_dir = tmp_path / 'shards'
+    # an earlier run with 4 keys, then this run with 2
+    _write_shards(path_shard_dir, lst_user_id, 4)
+    _write_shards(path_shard_dir, lst_user_id, 2)
+    path_user_inventory = str(tmp_path / 'user_inventory.txt')
+    assert merge_inventory_shards(str(path_shard_dir), path_user_inventory, 2) == 50
+    with open(path_user_inventory) as f:
+        assert sorted(list(json.loads(line))[0] for line in f) == sorted(lst_user_id)
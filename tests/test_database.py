@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+from game_rec.database import save_to_db, write_frame, tbl_steam_app
+
+
+def _apps(lst_app_id, name):
+    return pd.DataFrame({'steam_appid': np.asarray(lst_app_id, dtype=np.int32),
+                         'name': ['%s %s' % (name, app_id) for app_id in lst_app_id],
+                         'type': 'game',
+                         'initial_price': [9.99] * len(lst_app_id),
+                         'release_date': pd.to_datetime(['2016-05-01'] * len(lst_app_id)),
+                         'score': pd.array([80] * len(lst_app_id), dtype='Int16'),
+                         'recommendation': pd.array([None] * len(lst_app_id), dtype='Int64'),
+                         'windows': np.uint8(1), 'mac': np.uint8(0), 'linux': np.uint8(1),
+                         'header_image': None})
+
+
+def _rows(engine):
+    with engine.connect() as conn:
+        return conn.execute(sqlalchemy.select(tbl_steam_app.c.steam_appid, tbl_steam_app.c.name,
+                                              tbl_steam_app.c.recommendation)
+                            .order_by(tbl_steam_app.c.steam_appid)).fetchall()
+
+
+def test_rerunning_a_load_replaces_rows(tmp_path):
+    engine = sqlalchemy.create_engine('sqlite:///%s' % (tmp_path / 'apps.sqlite'))
+    config = {'load_batch_size': 2}
+    assert save_to_db(_apps([10, 20, 30], 'old'), config, engine) == 3
+    # overlapping rerun: 20 and 30 are updated in place, 40 is added
+    assert save_to_db(_apps([20, 30, 40], 'new'), config, engine) == 3
+    assert _rows(engine) == [(10, 'old 10', None), (20, 'new 20', None), (30, 'new 30', None),
+                             (40, 'new 40', None)]
+
+
+def test_load_from_a_saved_frame_file(tmp_path):
+    engine = sqlalchemy.create_engine('sqlite:///%s' % (tmp_path / 'apps.sqlite'))
+    path = str(tmp_path / 'steam_app_info.parquet')
+    write_frame(_apps([1, 2], 'saved'), path)
+    assert save_to_db(path, {}, engine) == 2
+    assert [row[0] for row in _rows(engine)] == [1, 2]
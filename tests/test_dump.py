@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+
+import pytest
+
+from game_rec.dump import DumpWriter, DumpReader, INDEX_SUFFIX, is_dump, iter_lines, open_dump_writer
+
+
+def _line(entity_id):
+    return json.dumps({entity_id: '<html>%s</html>' % entity_id}) + '\n'
+
+
+def _write_dump(path, blocks=3, per_block=4):
+    with DumpWriter(path) as writer:
+        for block in range(blocks):
+            lst_key = [str(block * per_block + i) for i in range(per_block)]
+            writer.write_block(lst_key, [_line(key) for key in lst_key])
+
+
+def test_round_trip_and_random_access(tmp_path):
+    path = str(tmp_path / 'pages.txt')
+    _write_dump(path)
+    assert is_dump(path)
+    reader = DumpReader(path)
+    assert len(reader) == 12
+    assert reader.get('6') == _line('6')
+    assert reader.get(11) == _line('11')
+    assert reader.get('12') is None
+    assert list(iter_lines(path)) == [_line(str(i)) for i in range(12)]
+    # the blocks are plain gzip members, so the whole dump reads with any gzip reader
+    with gzip.open(path, 'rt') as f:
+        assert f.read() == ''.join(_line(str(i)) for i in range(12))
+
+
+def test_ranges_cover_every_block_once(tmp_path):
+    path = str(tmp_path / 'pages.txt')
+    _write_dump(path, blocks=5, per_block=3)
+    reader = DumpReader(path)
+    lst_range = reader.ranges(7)
+    assert lst_range == [(0, 3), (3, 5)]
+    assert [line for start, stop in lst_range for lst_line in reader.iter_blocks(start, stop)
+            for line in lst_line] == list(iter_lines(path))
+
+
+def test_latest_record_wins(tmp_path):
+    path = str(tmp_path / 'pages.txt')
+    with DumpWriter(path) as writer:
+        writer.write_block(['1'], ['{"1": "old"}\n'])
+        writer.write_block(['1'], ['{"1": "new"}\n'])
+    assert DumpReader(path).get('1') == '{"1": "new"}\n'
+
+
+def test_resume_cuts_a_torn_block_and_index_line(tmp_path):
+    path = str(tmp_path / 'pages.txt')
+    _write_dump(path, blocks=2)
+    size = sum(length for _, length, _ in DumpReader(path).lst_block)
+    # a crash part way through the next block and its index line
+    with open(path, 'ab') as f:
+        f.write(b'\x1f\x8b\x08 torn')
+    with open(path + INDEX_SUFFIX, 'a') as f:
+        f.write('%s\t999' % size)
+    assert len(DumpReader(path)) == 8
+    with DumpWriter(path, resume=True) as writer:
+        assert writer.offset == size
+        writer.write_block(['8'], [_line('8')])
+    assert list(iter_lines(path)) == [_line(str(i)) for i in range(9)]
+
+
+def test_index_entry_past_the_end_of_the_dump_is_ignored(tmp_path):
+    path = str(tmp_path / 'pages.txt')
+    _write_dump(path, blocks=2)
+    lst_block = DumpReader(path).lst_block
+    # the last block was indexed but only partly reached the disk
+    with open(path, 'rb+') as f:
+        f.truncate(lst_block[1][0] + 5)
+    assert len(DumpReader(path)) == 4
+
+
+def test_resume_with_another_codec_is_refused(tmp_path):
+    path = str(tmp_path / 'pages.txt')
+    _write_dump(path, blocks=1)
+    with pytest.raises((ValueError, ImportError)):
+        DumpWriter(path, codec='zstd', resume=True)
+
+
+def test_plain_output_over_an_old_dump_is_not_read_as_a_dump(tmp_path):
+    path = str(tmp_path / 'pages.txt')
+    _write_dump(path, blocks=1)
+    with open_dump_writer(path) as f:
+        f.write(_line('0'))
+    assert not is_dump(path)
+    assert list(iter_lines(path)) == [_line('0')]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import scipy.sparse
+import pytest
+
+from game_rec.evaluate import ranking_metrics, split_train_test, evaluate
+
+
+def test_perfect_ranking():
+    top = np.array([[0, 1], [2, 3]])
+    test = scipy.sparse.csr_matrix(np.array([[1, 1, 0, 0], [0, 0, 1, 1]]))
+    dic_metric = ranking_metrics(top, test, 2)
+    assert dic_metric == {'precision': 1.0, 'recall': 1.0, 'ndcg': pytest.approx(1.0), 'users': 2}
+
+
+def test_miss_and_partial_hit():
+    top = np.array([[2, 0], [3, 2]])
+    test = scipy.sparse.csr_matrix(np.array([[1, 0, 0, 0], [0, 1, 0, 0]]))
+    dic_metric = ranking_metrics(top, test, 2)
+    # user 0 finds its game second, user 1 misses
+    assert dic_metric['precision'] == pytest.approx(0.25)
+    assert dic_metric['recall'] == pytest.approx(0.5)
+    assert dic_metric['ndcg'] == pytest.approx((1 / np.log2(3)) / 2)
+
+
+def test_catalog_smaller_than_k():
+    # 3 apps and k = 10: the ranking has 3 columns
+    top = np.array([[0, 2, 1]])
+    test = scipy.sparse.csr_matrix(np.array([[1, 0, 1]]))
+    dic_metric = ranking_metrics(top, test, 10)
+    assert dic_metric['precision'] == pytest.approx(0.2)
+    assert dic_metric['recall'] == 1.0
+    assert dic_metric['ndcg'] == pytest.approx(1.0)
+
+
+def test_empty_slots_and_users_without_held_out_games():
+    top = np.array([[0, -1], [1, -1]])
+    test = scipy.sparse.csr_matrix(np.array([[0, 0], [0, 1]]))
+    dic_metric = ranking_metrics(top, test, 2)
+    assert dic_metric['users'] == 1
+    assert dic_metric['recall'] == 1.0
+    assert ranking_metrics(top, scipy.sparse.csr_matrix((2, 2)), 2)['users'] == 0
+
+
+def test_split_only_holds_out_from_users_with_enough_games():
+    playtime = scipy.sparse.csr_matrix(np.vstack([np.ones(20), np.r_[np.ones(3), np.zeros(17)]]))
+    train, test = split_train_test(playtime, test_fraction=0.5, min_items=5)
+    assert (train + test != playtime).nnz == 0
+    assert test[1].nnz == 0
+    assert test[0].nnz > 0
+
+
+def test_grid_transform_is_rejected_on_interaction_input(tmp_path):
+    config_dict = {'evaluation': {'grid': {'factors': [2], 'transform': ['log', 'raw']}},
+                   'recommendation': {'dict_dir': str(tmp_path)}}
+    with pytest.raises(ValueError):
+        evaluate(None, str(tmp_path / 'evaluation.json'), config_dict, str(tmp_path / 'interactions.parquet'))
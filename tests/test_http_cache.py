@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import requests
+
+from game_rec.http_cache import ResponseCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+def _response(body, etag=None):
+    r = requests.Response()
+    r.status_code = 200
+    r._content = body
+    if etag:
+        r.headers['ETag'] = etag
+    return r
+
+
+def _sizes(cache):
+    return cache._conn.execute('SELECT COALESCE(SUM(size), 0) FROM response').fetchone()[0]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_bytes=25, clock=FakeClock())
+    cache.store('a', _response(b'x' * 10))
+    cache.store('b', _response(b'x' * 10))
+    cache.lookup('a')
+    cache.store('c', _response(b'x' * 10))
+    assert cache.lookup('b')[0] is None
+    assert cache.lookup('a')[0].content == b'x' * 10
+    assert cache.stats['evictions'] == 1
+    assert cache.total_bytes == _sizes(cache) == 20
+
+
+def test_replacing_an_entry_keeps_the_running_total(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = ResponseCache(path, max_bytes=100, clock=FakeClock())
+    cache.store('a', _response(b'x' * 30))
+    cache.store('a', _response(b'x' * 40))
+    assert cache.total_bytes == _sizes(cache) == 40
+    cache.close()
+    # the total is loaded once when the cache is reopened
+    assert ResponseCache(path, max_bytes=100).total_bytes == 40
+
+
+def test_hits_misses_and_revalidation_are_counted(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), dic_ttl={'app': 10}, clock=FakeClock())
+    assert cache.lookup('a', 'app') == (None, False, {})
+    cache.store('a', _response(b'{}', etag='"v1"'))
+    assert cache.lookup('a', 'app')[1] is True
+    cached, fresh, dic_condition = cache.lookup('a', 'other')
+    assert not fresh and dic_condition == {'If-None-Match': '"v1"'}
+    cache.touch('a')
+    assert cache.stats == {'hits': 2, 'misses': 1, 'revalidated': 1, 'stores': 1, 'evictions': 0}
+    assert cache.hit_rate() == 2.0 / 3
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import pytest
+
+from game_rec.pipeline import Stage, StageCache, Pipeline
+
+
+def _write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_stages_run_in_order_and_are_cached(tmp_path):
+    lst_ran = []
+
+    def first(dic_artifact):
+        lst_ran.append('first')
+        _write(dic_artifact['a'], 'a')
+
+    def second(dic_artifact):
+        lst_ran.append('second')
+        _write(dic_artifact['b'], open(dic_artifact['a']).read() + 'b')
+
+    lst_stage = [Stage('second', second, ['a'], {'b': str(tmp_path / 'b')}),
+                 Stage('first', first, [], {'a': str(tmp_path / 'a')})]
+    Pipeline(lst_stage, cache=StageCache(str(tmp_path / 'cache.json'))).run()
+    pipeline = Pipeline(lst_stage, cache=StageCache(str(tmp_path / 'cache.json')))
+    pipeline.run()
+    assert lst_ran == ['first', 'second']
+    assert pipeline.stats == {'first': 'cached', 'second': 'cached'}
+
+
+def test_a_failed_stage_is_raised_without_waiting_for_its_siblings(tmp_path):
+    release = threading.Event()
+
+    def slow(dic_artifact):
+        release.wait(10)
+
+    def broken(dic_artifact):
+        raise RuntimeError('broken')
+
+    lst_stage = [Stage('slow', slow, [], {'s': str(tmp_path / 's')}),
+                 Stage('broken', broken, [], {'b': str(tmp_path / 'b')})]
+    start = time.time()
+    with pytest.raises(RuntimeError):
+        Pipeline(lst_stage, workers=2).run()
+    assert time.time() - start < 5
+    release.set()
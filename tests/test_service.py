@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import scipy.sparse
+import pytest
+
+from http.server import ThreadingHTTPServer
+
+from game_rec.model_store import save_model
+from game_rec.service import RecommendService, RecommendHandler
+
+
+@pytest.fixture
+def service(tmp_path):
+    # users: a played 0 and 1, b played nothing, c was saved with all-zero factors
+    user_factors = np.array([[1.0, 0.0], [0.5, 0.5], [0.0, 0.0]])
+    item_factors = np.array([[1.0, 0.0], [0.9, 0.1], [0.8, 0.0], [0.1, 0.9]])
+    owned = scipy.sparse.csr_matrix(np.array([[1, 1, 0, 0], [0, 0, 0, 0], [0, 0, 1, 0]]))
+    save_model(str(tmp_path), user_factors, item_factors, ['a', 'b', 'c'], [10, 20, 30, 40], {'backend': 'local'},
+               owned=owned)
+    service = RecommendService(str(tmp_path), reload_seconds=0)
+    service.load()
+    service.start()
+    yield service
+    service.stop()
+
+
+def test_recommends_unowned_apps_best_first(service):
+    status, dic_response = service.handle('a', 2)
+    assert status == 200
+    assert [dic_app['steam_appid'] for dic_app in dic_response['apps']] == [30, 40]
+
+
+@pytest.mark.parametrize('steamid', ['unknown', 'b', 'c'])
+def test_users_without_factors_are_not_found(service, steamid):
+    status, dic_response = service.handle(steamid)
+    assert status == 404
+    assert 'apps' not in dic_response
+    assert service.stats['not_found'] == 1
+
+
+def test_answers_are_cached_per_model_version(service):
+    service.handle('a', 2)
+    service.handle('a', 2)
+    assert service.stats['cache_hits'] == 1
+    assert service.stats['batched_users'] == 1
+
+
+@pytest.fixture
+def get(service):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RecommendHandler)
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def get(path):
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:%s%s' % (server.server_address[1], path)) as r:
+                return r.status, json.loads(r.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+    yield get
+    server.shutdown()
+    server.server_close()
+
+
+def test_handler_answers_400_only_for_a_bad_n(get):
+    assert get('/recommend/a?n=2')[0] == 200
+    assert get('/recommend/a?n=two') == (400, {'error': 'n must be a number'})
+
+
+def test_handler_answers_500_for_other_errors(get, service, monkeypatch):
+    def handle(steamid, n=None):
+        raise ValueError('broken model')
+    monkeypatch.setattr(service, 'handle', handle)
+    assert get('/recommend/a') == (500, {'error': 'internal error'})
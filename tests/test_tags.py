@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from game_rec.database import extract_tags_soup, extract_tags_xpath
+
+PAGE = '''<html><body><div class="p-r-30">
+<a href="/tag/Action">Action</a> <a href="/tag/Open+World">Open World</a> <a href="/genre/RPG">RPG</a>
+</div></body></html>'''
+
+
+@pytest.mark.parametrize('extract_tags', [extract_tags_soup, extract_tags_xpath])
+def test_extractors_agree(extract_tags):
+    assert extract_tags(PAGE) == extract_tags_soup(PAGE)
+    assert len(extract_tags(PAGE)) == 2
+
+
+@pytest.mark.parametrize('page', ['', '   \n', '<!-- gone -->', '<html><body></body></html>'])
+def test_pages_without_a_summary_are_skipped(page):
+    assert extract_tags_xpath(page) is None
+    assert extract_tags_soup(page) is None
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import requests
+
+import pytest
+
+from game_rec.throttle import TokenBucket, SlidingWindowLimiter, RateController, parse_retry_after
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+needs_aiohttp = pytest.mark.skipif(aiohttp is None, reason='aiohttp is not installed')
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_waits_once_the_burst_is_spent():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    # the bucket goes negative, so the next callers queue up behind each other
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+    clock.now = 10.0
+    assert bucket.reserve() == 0.0
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeClient(object):
+    ''' answers GET requests from a list of responses, raising the exceptions in it '''
+    def __init__(self, lst_response):
+        self.lst_response = list(lst_response)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        response = self.lst_response.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def test_sliding_window_allows_max_calls_per_period():
+    clock = FakeClock()
+    limiter = SlidingWindowLimiter(max_calls=3, period=60, clock=clock)
+    assert [limiter.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.reserve() == pytest.approx(60.0)
+    clock.now = 120.0
+    assert limiter.reserve() == 0.0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('5') == 5.0
+    assert parse_retry_after('-3') == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def test_rate_controller_honors_retry_after():
+    lst_sleep = []
+    client = FakeClient([FakeResponse(429, {'Retry-After': '7'}), FakeResponse(503), FakeResponse(200)])
+    controller = RateController(max_retries=3, backoff_base=1.0, sleep=lst_sleep.append, client=client)
+    assert controller.get('http://example.com/api').status_code == 200
+    assert client.calls == 3
+    # Retry-After of the 429, then jittered backoff of at most base * 2 for the 503
+    assert lst_sleep[0] == 7.0
+    assert 0.0 <= lst_sleep[1] <= 2.0
+    assert controller.stats['throttled'] == 1
+    assert controller.stats['retries'] == 2
+
+
+def test_rate_controller_returns_other_errors_at_once():
+    client = FakeClient([FakeResponse(404), FakeResponse(200)])
+    controller = RateController(max_retries=3, sleep=lambda seconds: None, client=client)
+    assert controller.get('http://example.com/api').status_code == 404
+    assert client.calls == 1
+
+
+def test_rate_controller_returns_last_response_after_max_retries():
+    client = FakeClient([FakeResponse(500), FakeResponse(500)])
+    controller = RateController(max_retries=2, sleep=lambda seconds: None, client=client)
+    assert controller.get('http://example.com/api').status_code == 500
+    assert client.calls == 2
+
+
+def test_rate_controller_raises_the_last_connection_error():
+    client = FakeClient([requests.ConnectionError('reset'), requests.ConnectionError('reset')])
+    controller = RateController(max_retries=2, sleep=lambda seconds: None, client=client)
+    with pytest.raises(requests.ConnectionError):
+        controller.get('http://example.com/api')
+    assert controller.stats['errors'] == 2
+
+
+def test_rate_controller_waits_on_its_limiter():
+    lst_sleep = []
+    clock = FakeClock()
+    controller = RateController(TokenBucket(rate=1, capacity=1, clock=clock), sleep=lst_sleep.append,
+                                client=FakeClient([FakeResponse(200), FakeResponse(200)]))
+    controller.get('http://example.com/api')
+    controller.get('http://example.com/api')
+    assert lst_sleep == [pytest.approx(1.0)]
+
+
+class FakeAsyncResponse(object):
+    def __init__(self, status, body=None, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(None, (), status=self.status)
+
+    async def json(self, content_type=None):
+        return self.body
+
+
+class FakeSession(object):
+    ''' answers GET requests from a list of responses, raising the exceptions in it '''
+    def __init__(self, lst_response):
+        self.lst_response = list(lst_response)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        response = self.lst_response.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def lst_sleep(monkeypatch):
+    lst_sleep = []
+
+    async def sleep(seconds):
+        lst_sleep.append(seconds)
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+    return lst_sleep
+
+
+@needs_aiohttp
+def test_get_json_async_honors_retry_after(lst_sleep):
+    session = FakeSession([FakeAsyncResponse(429, headers={'Retry-After': '2'}), FakeAsyncResponse(200, {'a': 1})])
+    controller = RateController(max_retries=3)
+    assert asyncio.run(controller.get_json_async(session, 'http://example.com/api')) == {'a': 1}
+    assert lst_sleep == [2.0]
+    assert controller.stats['throttled'] == 1
+
+
+@needs_aiohttp
+def test_get_json_async_retries_connection_errors(lst_sleep):
+    session = FakeSession([aiohttp.ClientConnectionError('reset'), FakeAsyncResponse(200, {'a': 1})])
+    controller = RateController(max_retries=3, backoff_base=1.0)
+    assert asyncio.run(controller.get_json_async(session, 'http://example.com/api')) == {'a': 1}
+    assert len(lst_sleep) == 1 and 0.0 <= lst_sleep[0] <= 1.0
+
+
+@needs_aiohttp
+def test_get_json_async_raises_other_errors_at_once(lst_sleep):
+    session = FakeSession([FakeAsyncResponse(404), FakeAsyncResponse(200, {'a': 1})])
+    controller = RateController(max_retries=3)
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(controller.get_json_async(session, 'http://example.com/api'))
+    assert session.calls == 1
+    assert lst_sleep == []
+
+
+@needs_aiohttp
+def test_get_json_async_raises_the_last_retry_status(lst_sleep):
+    session = FakeSession([FakeAsyncResponse(503), FakeAsyncResponse(503)])
+    controller = RateController(max_retries=2)
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(controller.get_json_async(session, 'http://example.com/api'))
+    assert session.calls == 2